@@ -18,6 +18,14 @@ from firebase_admin import credentials
 
 # DB プール
 from models.connection_pool import init_connection_pool
+from models.db_session import init_db_session
+from utils.s3_delete_queue import init_s3_delete_queue
+from utils.transcode import init_transcode_worker
+from utils.broadcast import init_broadcast
+from utils.play_buffer import init_play_buffer
+from utils.spotlight_counter import init_spotlight_counter
+from utils.content_index import init_content_index
+from utils.rate_limit import init_rate_limiter
 
 # ========================================
 # Firebase 初期化（1回だけ）
@@ -53,6 +61,30 @@ def create_app(config_name='production'):
     except Exception as e:
         pass
 
+    # リクエスト単位のDBセッション（1リクエスト1コネクション、終了時に一括COMMIT）
+    init_db_session(app)
+
+    # S3ファイル削除キューのワーカー（削除したコンテンツのファイルをバックグラウンドでまとめて削除）
+    init_s3_delete_queue(app)
+
+    # 動画のトランスコードワーカー（ビットレート制限・低解像度版の作成）
+    init_transcode_worker(app)
+
+    # 一斉通知ジョブの引き取り（送信中に止まったジョブを続きから送信）
+    init_broadcast(app)
+
+    # 再生回数・再生履歴の書き込みバッファ（まとめてDBに反映）
+    init_play_buffer(app)
+
+    # スポットライト数の分散カウンターを content.spotlightnum へ反映するワーカー
+    init_spotlight_counter(app)
+
+    # フィード対象コンテンツのインデックス（LISTEN/NOTIFY で差分更新）
+    init_content_index(app)
+
+    # レート制限（RATE_LIMIT_BACKEND=postgres の場合は使われなくなったバケットを削除するワーカー）
+    init_rate_limiter(app)
+
     # ========================================
     # Blueprint 読込
     # ========================================
@@ -0,0 +1,73 @@
+"""
+プッシュ通知送信のベンチマーク（FCMには接続しない）
+
+utils/fcm_stub.py の StubMessaging を相手に、
+旧実装（1件ずつ messaging.send を同期呼び出し）と
+NotificationDispatcher（キュー + ワーカー + send_each のバッチ送信）のスループットを比較する。
+
+実行方法:
+    python benchmarks/bench_push.py            # 2000件
+    python benchmarks/bench_push.py 10000 0.08 # 件数, 1回のAPI呼び出しの遅延（秒）
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firebase_admin import messaging
+
+from utils.fcm_stub import StubMessaging
+from utils.notification import NotificationDispatcher
+
+
+def bench_sync(count, latency):
+    """旧実装：リクエストごとに messaging.send を1回"""
+    stub = StubMessaging(latency=latency)
+    start = time.perf_counter()
+    for i in range(count):
+        stub.send(messaging.Message(
+            notification=messaging.Notification(title="title", body=f"body {i}"),
+            token=f"token-{i}",
+        ))
+    return time.perf_counter() - start, stub.calls
+
+
+def bench_dispatcher(count, latency, workers):
+    """新実装：キューに積んでワーカーがまとめて送信"""
+    stub = StubMessaging(latency=latency, transient_failure_rate=0.01, seed=1)
+    unregistered = []
+    dispatcher = NotificationDispatcher(sender=stub, workers=workers, backoff=0.05,
+                                        on_unregistered=unregistered.extend)
+    start = time.perf_counter()
+    enqueue_start = start
+    for i in range(count):
+        token = f"unregistered-{i}" if i % 100 == 0 else f"token-{i}"
+        dispatcher.enqueue(token, "title", f"body {i}")
+    enqueue_time = time.perf_counter() - enqueue_start
+    dispatcher.flush()
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+    return elapsed, enqueue_time, dispatcher.stats(), len(unregistered)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+
+    # 同期送信は遅いので件数を絞って計測し、1件あたりに換算する
+    sync_count = min(count, 100)
+    sync_time, sync_calls = bench_sync(sync_count, latency)
+    print(f"同期送信      : {sync_count}件 {sync_time:.2f}s  "
+          f"{sync_count / sync_time:8.1f} 件/s  API呼び出し {sync_calls}回")
+
+    for workers in (1, 2, 4):
+        elapsed, enqueue_time, stats, unregistered = bench_dispatcher(count, latency, workers)
+        print(f"ディスパッチャ: {count}件 workers={workers} {elapsed:.2f}s  "
+              f"{count / elapsed:8.1f} 件/s  API呼び出し {stats['api_calls']}回  "
+              f"リクエスト側の待ち {enqueue_time / count * 1e6:.1f}µs/件  "
+              f"再送 {stats['retried']}件  無効トークン {unregistered}件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+検索クエリのベンチマーク
+
+旧実装（title / tag への ILIKE '%word%' の OR 連結）と、
+searchtext + pg_trgm GIN インデックスを使う新実装のレイテンシを、
+コンテンツ件数を増やしながら比較する。
+
+本番テーブルには触れず、セッション内の TEMP テーブルにダミーデータを作って計測する。
+（pg_trgm 拡張が作成済みであること: migrations/004_content_search.sql）
+
+実行方法:
+    python benchmarks/bench_search.py                 # 10000, 50000, 200000 件
+    python benchmarks/bench_search.py 10000 1000000   # 件数を指定
+"""
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SIZES = [10000, 50000, 200000]
+REPEAT = 20
+WORDS = ["猫", "ねこ動画", "music", "旅行 vlog", "ゲーム実況"]
+
+# ダミーデータ用の語彙（title / tag に組み合わせて使う）
+VOCAB = [
+    "猫", "犬", "ねこ動画", "旅行", "vlog", "料理", "レシピ", "ゲーム実況", "music", "ライブ",
+    "カフェ", "東京", "大阪", "京都", "散歩", "朝活", "勉強", "作業用", "ダンス", "weekend",
+]
+
+OLD_QUERY = """
+    SELECT contentID
+    FROM bench_content
+    WHERE {where}
+    ORDER BY ({score}) DESC, posttimestamp DESC
+    LIMIT 50
+"""
+
+NEW_QUERY = """
+    SELECT contentID
+    FROM bench_content
+    WHERE {where}
+    ORDER BY ({score}) DESC, posttimestamp DESC, contentID DESC
+    LIMIT 51
+"""
+
+
+def connect():
+    return psycopg2.connect(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_NAME"),
+    )
+
+
+def populate(cur, size):
+    """TEMPテーブルを作り直して size 件のダミーコンテンツを入れる"""
+    cur.execute("DROP TABLE IF EXISTS bench_content")
+    cur.execute("""
+        CREATE TEMP TABLE bench_content (
+            contentID SERIAL PRIMARY KEY,
+            title VARCHAR(128),
+            tag VARCHAR(128),
+            posttimestamp TIMESTAMP,
+            searchtext TEXT GENERATED ALWAYS AS (lower(COALESCE(title, '') || ' ' || COALESCE(tag, ''))) STORED
+        )
+    """)
+    cur.execute("""
+        INSERT INTO bench_content (title, tag, posttimestamp)
+        SELECT
+            (%(vocab)s)[1 + (random() * (array_length(%(vocab)s, 1) - 1))::int]
+                || md5(i::text)::varchar(6)
+                || (%(vocab)s)[1 + (random() * (array_length(%(vocab)s, 1) - 1))::int],
+            (%(vocab)s)[1 + (random() * (array_length(%(vocab)s, 1) - 1))::int],
+            NOW() - (i || ' seconds')::interval
+        FROM generate_series(1, %(size)s) AS i
+    """, {"vocab": VOCAB, "size": size})
+    cur.execute("CREATE INDEX ON bench_content USING gin (searchtext gin_trgm_ops)")
+    cur.execute("ANALYZE bench_content")
+
+
+def old_query(words):
+    where, score, params = [], [], []
+    for w in words:
+        where += ["COALESCE(title,'') ILIKE %s", "COALESCE(tag,'') ILIKE %s"]
+        params += [f"%{w}%", f"%{w}%"]
+    for w in words:
+        score += ["CASE WHEN COALESCE(title,'') ILIKE %s THEN 1 ELSE 0 END",
+                  "CASE WHEN COALESCE(tag,'') ILIKE %s THEN 1 ELSE 0 END"]
+        params += [f"%{w}%", f"%{w}%"]
+    return OLD_QUERY.format(where=" OR ".join(where), score=" + ".join(score)), params
+
+
+def new_query(words):
+    patterns = [f"%{w.lower()}%" for w in words]
+    score = []
+    for _ in patterns:
+        score += ["CASE WHEN lower(COALESCE(title,'')) LIKE %s THEN 1 ELSE 0 END",
+                  "CASE WHEN lower(COALESCE(tag,'')) LIKE %s THEN 1 ELSE 0 END"]
+    params = patterns + [p for p in patterns for _ in range(2)]
+    where = " OR ".join(["searchtext LIKE %s"] * len(patterns))
+    return NEW_QUERY.format(where=where, score=" + ".join(score)), params
+
+
+def measure(cur, build):
+    """全検索語を REPEAT 回ずつ実行し、1クエリあたりのレイテンシ（ms）を返す"""
+    samples = []
+    for _ in range(REPEAT):
+        for word in WORDS:
+            sql, params = build(word.split())
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            cur.fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            print(f"{'件数':>10} | {'旧 p50':>9} {'旧 p95':>9} | {'新 p50':>9} {'新 p95':>9}  (ms)")
+            for size in sizes:
+                populate(cur, size)
+                old_p50, old_p95 = measure(cur, old_query)
+                new_p50, new_p95 = measure(cur, new_query)
+                print(f"{size:>10} | {old_p50:9.2f} {old_p95:9.2f} | {new_p50:9.2f} {new_p95:9.2f}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
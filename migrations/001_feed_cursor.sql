@@ -0,0 +1,23 @@
+-- ============================================================
+-- フィードカーソルテーブル
+-- ============================================================
+-- /api/content/getcontents/random のランダム取得を ORDER BY RANDOM() から
+-- ユーザごとの擬似ランダム置換 + サーバー側カーソルに置き換えるためのテーブル。
+--
+-- seed       : エポックごとのシード（置換を決める）
+-- epoch      : 何周目か（一周するたびに +1）
+-- position   : 置換上の次の位置（0 〜 domainsize - 1）
+-- domainsize : エポック開始時点の MAX(contentID)。新規投稿は次のエポックから対象になる
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/001_feed_cursor.sql
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS feedcursor (
+    userID VARCHAR(512) PRIMARY KEY REFERENCES "user"(userID) ON DELETE CASCADE,
+    seed BIGINT NOT NULL,
+    epoch INTEGER NOT NULL DEFAULT 0,
+    position INTEGER NOT NULL DEFAULT 0,
+    domainsize INTEGER NOT NULL DEFAULT 0,
+    updatedtimestamp TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,33 @@
+-- ============================================================
+-- contentuser の疎化（全ユーザ × 全コンテンツ の紐付けを廃止）
+-- ============================================================
+-- これまで投稿時・新規登録時に contentuser へ全件を INSERT していたため、
+-- 行数が ユーザ数 × コンテンツ数 に比例して増え続けていた。
+-- 今後は スポットライトON / 通知済み が発生した時点でのみ行を作成し、
+-- 行が無い場合は spotlightflag = FALSE / notified = FALSE として扱う。
+--
+-- このマイグレーションでは、意味のある情報を持たない既存行を削除する。
+--   - spotlightflag が TRUE ではない
+--   - notified が TRUE ではない
+--   - notification から参照されていない（外部キーのため残す）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/002_sparse_contentuser.sql
+-- ============================================================
+
+BEGIN;
+
+DELETE FROM contentuser cu
+WHERE cu.spotlightflag IS NOT TRUE
+  AND cu.notified IS NOT TRUE
+  AND NOT EXISTS (
+      SELECT 1
+      FROM notification n
+      WHERE n.contentuserCID = cu.contentID
+        AND n.contentuserUID = cu.userID
+  );
+
+COMMIT;
+
+-- 削除した領域をディスクに返す（テーブルロックを取るためメンテナンス時間帯に実行）
+VACUUM (FULL, ANALYZE) contentuser;
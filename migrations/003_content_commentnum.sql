@@ -0,0 +1,29 @@
+-- ============================================================
+-- コンテンツごとのコメント数カラム
+-- ============================================================
+-- フィード・詳細・管理画面で毎回 comment を COUNT(*) していたのをやめ、
+-- content.commentnum を参照する。
+-- 値は insert_comment / delete_comment / delete_user_account が
+-- 同じトランザクション内で増減させる。
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/003_content_commentnum.sql
+-- ============================================================
+
+BEGIN;
+
+ALTER TABLE content
+ADD COLUMN IF NOT EXISTS commentnum INTEGER NOT NULL DEFAULT 0;
+
+-- 既存データの件数で初期化
+UPDATE content c
+SET commentnum = cm.num
+FROM (
+    SELECT contentID, COUNT(*) AS num
+    FROM comment
+    GROUP BY contentID
+) cm
+WHERE c.contentID = cm.contentID
+  AND c.commentnum <> cm.num;
+
+COMMIT;
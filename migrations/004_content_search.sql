@@ -0,0 +1,27 @@
+-- ============================================================
+-- 検索用カラムと trigram インデックス
+-- ============================================================
+-- /api/content/serch の ILIKE '%word%' は B-tree インデックスが効かず、
+-- コンテンツ数に比例して遅くなっていた。
+-- title と tag を小文字化して連結した searchtext を生成列として持ち、
+-- pg_trgm の GIN インデックスで部分一致（日本語を含む）を引けるようにする。
+--
+-- 注意:
+--   - 日本語を trigram に分解するには、DBのロケールが C 以外（ja_JP.UTF-8 / en_US.UTF-8 など）である必要がある
+--   - 1〜2文字の検索語は trigram が作れないため、インデックスの全件走査になる（結果は正しい）
+--   - 生成列の追加はテーブルの書き換えを伴うため、メンテナンス時間帯に実行する
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/004_content_search.sql
+-- ============================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE content
+ADD COLUMN IF NOT EXISTS searchtext TEXT
+GENERATED ALWAYS AS (lower(COALESCE(title, '') || ' ' || COALESCE(tag, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_content_searchtext_trgm
+ON content USING gin (searchtext gin_trgm_ops);
+
+ANALYZE content;
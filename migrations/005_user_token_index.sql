@@ -0,0 +1,12 @@
+-- ============================================================
+-- FCMトークンのインデックス
+-- ============================================================
+-- 通知ディスパッチャが FCM から未登録と報告されたトークンを
+--   UPDATE "user" SET token = NULL WHERE token = ANY(%s)
+-- で一括削除するためのインデックス。
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/005_user_token_index.sql
+-- ============================================================
+
+CREATE INDEX IF NOT EXISTS idx_user_token ON "user"(token) WHERE token IS NOT NULL;
@@ -0,0 +1,31 @@
+-- ============================================================
+-- 一斉通知ジョブテーブル
+-- ============================================================
+-- /api/admin/adminnotification（targetuid = "all"）をバックグラウンドジョブで処理し、
+-- /api/admin/adminnotification/status で進捗を確認できるようにする。
+-- gunicorn のどのワーカーに問い合わせても同じ進捗が見えるよう、状態はDBに持つ。
+--
+-- status      : queued → running → done / failed
+-- totaltokens : 送信先トークン数（重複除く）
+-- insertednum : 登録した通知履歴の件数
+-- sentnum     : プッシュ通知の送信成功数
+-- failednum   : プッシュ通知の送信失敗数（無効トークンを含む）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/006_broadcast_job.sql
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS broadcastjob (
+    jobID SERIAL PRIMARY KEY,
+    adminuserID VARCHAR(512) REFERENCES "user"(userID) ON DELETE SET NULL,
+    title TEXT,
+    message TEXT,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    totaltokens INTEGER NOT NULL DEFAULT 0,
+    insertednum INTEGER NOT NULL DEFAULT 0,
+    sentnum INTEGER NOT NULL DEFAULT 0,
+    failednum INTEGER NOT NULL DEFAULT 0,
+    errormessage TEXT,
+    createdtimestamp TIMESTAMP DEFAULT NOW(),
+    finishedtimestamp TIMESTAMP
+);
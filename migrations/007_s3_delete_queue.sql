@@ -0,0 +1,25 @@
+-- ============================================================
+-- S3ファイル削除キュー
+-- ============================================================
+-- コンテンツ・アカウント削除時、S3のファイルはリクエスト中に1件ずつ消さず、
+-- DBの削除と同じトランザクションでこのテーブルにキーを登録する。
+-- utils/s3_delete_queue.py のワーカーが delete_objects（1回最大1000件）でまとめて削除し、
+-- 成功した行を消す。失敗した行は attempts を増やして nextattempttimestamp まで待ってから再試行する。
+-- ワーカーが再起動してもキーはDBに残るので、S3にファイルが取り残されない。
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/007_s3_delete_queue.sql
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS s3deletequeue (
+    queueID BIGSERIAL PRIMARY KEY,
+    s3key TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lasterror TEXT,
+    createdtimestamp TIMESTAMP DEFAULT NOW(),
+    nextattempttimestamp TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- 期限が来たものを古い順に取り出す
+CREATE INDEX IF NOT EXISTS idx_s3deletequeue_nextattempt
+    ON s3deletequeue(nextattempttimestamp, queueID);
@@ -0,0 +1,40 @@
+-- ============================================================
+-- 動画トランスコードジョブ
+-- ============================================================
+-- 動画の投稿は S3 に保存した時点で完了とし、ビットレートの制限と低解像度版の作成は
+-- utils/transcode.py のワーカーがバックグラウンドで行う。
+-- ワーカーが落ちてもジョブはDBに残り、一定時間 running のままのものは再実行される。
+--
+-- status        : queued → running → done / failed（失敗は attempts が上限になるまで queued に戻る）
+-- sourcekey     : 投稿時の S3 キー（movie/xxx.mp4）
+-- outputkey     : 差し替え後の contentpath（ビットレートが上限以下なら sourcekey のまま）
+-- probems / transcodems / uploadms : 各工程の所要時間（ミリ秒）
+--
+-- content.renditions : 低解像度版のキー {"720p": "movie/xxx_720p.mp4", ...}
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/008_transcode_job.sql
+-- ============================================================
+
+ALTER TABLE content ADD COLUMN IF NOT EXISTS renditions JSONB;
+
+CREATE TABLE IF NOT EXISTS transcodejob (
+    jobID SERIAL PRIMARY KEY,
+    contentID INTEGER NOT NULL REFERENCES content(contentID) ON DELETE CASCADE,
+    sourcekey TEXT NOT NULL,
+    outputkey TEXT,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    probems INTEGER,
+    transcodems INTEGER,
+    uploadms INTEGER,
+    errormessage TEXT,
+    createdtimestamp TIMESTAMP DEFAULT NOW(),
+    startedtimestamp TIMESTAMP,
+    finishedtimestamp TIMESTAMP
+);
+
+-- 未処理・実行中のジョブを古い順に取り出す
+CREATE INDEX IF NOT EXISTS idx_transcodejob_pending
+    ON transcodejob(jobID)
+    WHERE status IN ('queued', 'running');
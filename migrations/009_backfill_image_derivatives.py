@@ -0,0 +1,105 @@
+"""
+既存のサムネイル・アイコンの縮小版を作成（utils/images.py）
+
+新しくアップロードされた画像は投稿時・アイコン変更時に縮小版が作られるが、
+それ以前の画像には無いため、レスポンスの thumbnailpaths / iconimgpaths が404になる。
+デプロイ後に1回実行する（migrations/015_image_variant_flags.sql の後）。縮小版が既にある画像は作成を飛ばし、
+作成済みのフラグ（content.thumbnailvariants / "user".iconvariants）だけを設定するので、途中で止めても再実行できる。
+
+実行方法:
+    python migrations/009_backfill_image_derivatives.py
+    python migrations/009_backfill_image_derivatives.py --dry-run   # 件数の確認のみ
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from config import config
+from models.connection_pool import init_connection_pool, get_connection, release_connection
+from utils.images import IMAGE_VARIANTS_ENABLED, upload_image_variants, variant_keys
+from utils.s3 import download_from_s3, head_s3_object, s3_key_from_path
+
+
+def load_image_keys():
+    """縮小版のフラグが立っていないサムネイル・アイコンのS3キー → DBに保存されているパスの一覧"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT thumbnailpath FROM content
+                 WHERE thumbnailpath IS NOT NULL AND thumbnailvariants = FALSE
+                UNION
+                SELECT DISTINCT iconimgpath FROM "user"
+                 WHERE iconimgpath IS NOT NULL AND iconvariants = FALSE
+            """)
+            rows = cur.fetchall()
+        conn.rollback()
+    finally:
+        release_connection(conn)
+    keys = {}
+    for (path,) in rows:
+        key = s3_key_from_path(path)
+        if key and variant_keys(key):
+            keys.setdefault(key, []).append(path)
+    return dict(sorted(keys.items()))
+
+
+def mark_generated(kind, paths):
+    """縮小版を作成済みのフラグを立てる"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            if kind == "icon":
+                cur.execute('UPDATE "user" SET iconvariants = TRUE WHERE iconimgpath = ANY(%s)', (paths,))
+            else:
+                cur.execute("UPDATE content SET thumbnailvariants = TRUE WHERE thumbnailpath = ANY(%s)", (paths,))
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv
+    if not IMAGE_VARIANTS_ENABLED:
+        print("Pillow が無い、または IMAGE_VARIANTS_ENABLED=False のため終了します")
+        return
+
+    app = Flask(__name__)
+    app.config.from_object(config["default"])
+    init_connection_pool()
+
+    with app.app_context():
+        keys = load_image_keys()
+        print(f"対象: {len(keys)}件")
+        created = skipped = failed = 0
+        for i, (key, paths) in enumerate(keys.items(), 1):
+            kind = key.split("/", 1)[0]
+            if all(head_s3_object(k) is not None for k in variant_keys(key)):
+                skipped += 1
+                if not dry_run:
+                    mark_generated(kind, paths)
+                continue
+            if dry_run:
+                created += 1
+                continue
+            try:
+                data = download_from_s3(key)
+            except Exception as e:
+                print(f"❌ 取得失敗: {key}: {e}")
+                failed += 1
+                continue
+            if upload_image_variants(data, key, kind):
+                mark_generated(kind, paths)
+                created += 1
+            else:
+                failed += 1
+            if i % 100 == 0:
+                print(f"{i}/{len(keys)} 作成{created} スキップ{skipped} 失敗{failed}")
+        print(f"完了: 作成{created} スキップ{skipped} 失敗{failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+-- ============================================================
+-- スポットライト数の分散カウンター
+-- ============================================================
+-- スポットライトのON/OFFのたびに content の同じ行を UPDATE すると、
+-- 人気の投稿ではその1行の行ロック待ちで直列化される。
+-- ON/OFF では spotlightcounter の slot（0〜SPOTLIGHT_COUNTER_SLOTS-1 からランダム）に +1/-1 を加算し、
+-- utils/spotlight_counter.py のワーカーが定期的に content.spotlightnum へまとめて反映（fold）する。
+--
+-- delta : まだ content.spotlightnum に反映していない増減
+-- 投稿の詳細（get_content_detail）は spotlightnum + 未反映分 の合計を返す。一覧は反映済みの値（数秒遅れ）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/010_spotlight_counter.sql
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS spotlightcounter (
+    contentID INTEGER NOT NULL REFERENCES content(contentID) ON DELETE CASCADE,
+    slot SMALLINT NOT NULL,
+    delta INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (contentID, slot)
+);
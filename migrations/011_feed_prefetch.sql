@@ -0,0 +1,16 @@
+-- ============================================================
+-- フィードカーソルの先読み候補
+-- ============================================================
+-- /api/content/getcontents/random を1回の問い合わせで返せるよう、
+-- 置換から次回以降の候補 contentID を先に取り出して feedcursor に保存しておく。
+--
+-- prefetch : 置換から取り出し済みで、まだ返していない候補（置換の順）
+--            position は prefetch の次の位置を指す
+--            残っている間は候補の詳細取得・カーソル更新・lastcontetid 更新を1文で行い、
+--            足りなくなったら置換を進めて補充する（models/content_get.py:get_feed_page）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/011_feed_prefetch.sql
+-- ============================================================
+
+ALTER TABLE feedcursor ADD COLUMN IF NOT EXISTS prefetch INTEGER[] NOT NULL DEFAULT '{}';
@@ -0,0 +1,39 @@
+-- ============================================================
+-- フィード対象コンテンツの変更通知（LISTEN/NOTIFY）
+-- ============================================================
+-- 各ワーカーはフィードの対象（テキスト投稿以外）の contentID と投稿者をメモリ上に持ち（utils/content_index.py）、
+-- content の追加・削除・textflag の変更を content_index チャネルの通知で受け取って差分だけ更新する。
+-- 通知はCOMMIT時に、COMMITの順で届く。
+--
+-- ペイロード:
+--   A <contentID> <userID> : フィードの対象になった（投稿・テキスト投稿以外への変更）
+--   D <contentID>          : フィードの対象から外れた（削除・テキスト投稿への変更）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/012_content_index_notify.sql
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION notify_content_index() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('content_index', 'D ' || OLD.contentID);
+    ELSIF NEW.textflag THEN
+        PERFORM pg_notify('content_index', 'D ' || NEW.contentID);
+    ELSE
+        PERFORM pg_notify('content_index', 'A ' || NEW.contentID || ' ' || NEW.userID);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS content_index_insert_delete ON content;
+CREATE TRIGGER content_index_insert_delete
+    AFTER INSERT OR DELETE ON content
+    FOR EACH ROW EXECUTE FUNCTION notify_content_index();
+
+DROP TRIGGER IF EXISTS content_index_update ON content;
+CREATE TRIGGER content_index_update
+    AFTER UPDATE OF textflag, userID ON content
+    FOR EACH ROW
+    WHEN (OLD.textflag IS DISTINCT FROM NEW.textflag OR OLD.userID IS DISTINCT FROM NEW.userID)
+    EXECUTE FUNCTION notify_content_index();
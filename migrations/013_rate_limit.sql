@@ -0,0 +1,23 @@
+-- ============================================================
+-- レート制限のトークンバケット（全ワーカー共通）
+-- ============================================================
+-- RATE_LIMIT_BACKEND=postgres の場合に utils/rate_limit.py が使用する。
+-- key（userID:エンドポイント:メソッド）ごとに1行。リクエストのたびに1文の UPSERT で
+-- 経過時間分のトークンを補充して1つ使う（補充後に1未満なら更新せず429）。
+--
+-- tokens    : 最後の更新時点のトークン数
+-- updatedat : 最後の更新時刻
+-- 失われても困らない一時的なデータなので UNLOGGED（WALを書かない。クラッシュ時は空になる）
+-- しばらく使われていない行はワーカーが定期的に削除する
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/013_rate_limit.sql
+-- ============================================================
+
+CREATE UNLOGGED TABLE IF NOT EXISTS ratelimit (
+    key VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updatedat TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ratelimit_updatedat ON ratelimit (updatedat);
@@ -0,0 +1,13 @@
+-- ============================================================
+-- 通知一覧のキーセットページング用インデックス
+-- ============================================================
+-- /api/users/notification は (通知日時, notificationID) の新しい順に1ページずつ返す
+-- （models/selectdata.py:get_notification）。通知日時が NULL の古い行は epoch として並べるため、
+-- 同じ式のインデックスを作成する。既読化（/api/users/notification/read）の範囲指定にも使われる。
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/014_notification_keyset.sql
+-- ============================================================
+
+CREATE INDEX IF NOT EXISTS idx_notification_userid_keyset
+    ON notification (userID, (COALESCE(notificationtimestamp, TIMESTAMP 'epoch')) DESC, notificationID DESC);
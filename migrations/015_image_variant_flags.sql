@@ -0,0 +1,20 @@
+-- ============================================================
+-- 縮小版（utils/images.py）を作成済みかどうかのフラグ
+-- ============================================================
+-- 縮小版のURLは元画像のキーから組み立てるが、バックフィル前の画像・作成に失敗した画像・
+-- デフォルトアイコンには縮小版が無く、そのURLを返すと404になる。
+-- 作成できた画像だけフラグを立て、レスポンスではフラグが立っているものだけ縮小版のURLを返す
+-- （立っていなければ全サイズとも元画像のURL）。
+--
+-- content.thumbnailvariants : サムネイルの縮小版を作成済み
+-- "user".iconvariants       : アイコンの縮小版を作成済み
+--
+-- このマイグレーションの後に migrations/009_backfill_image_derivatives.py を実行すると、
+-- 既存の画像の縮小版の作成とフラグの設定を行う（実行済みの場合も、もう一度実行するとフラグだけ設定される）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/015_image_variant_flags.sql
+-- ============================================================
+
+ALTER TABLE content ADD COLUMN IF NOT EXISTS thumbnailvariants BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE "user" ADD COLUMN IF NOT EXISTS iconvariants BOOLEAN NOT NULL DEFAULT FALSE;
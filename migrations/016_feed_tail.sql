@@ -0,0 +1,15 @@
+-- ============================================================
+-- フィードカーソルにエポック開始後の投稿の位置を追加
+-- ============================================================
+-- 置換の範囲（domainsize）はエポック開始時の最大contentIDなので、その後の投稿は
+-- 一周するまで置換に現れない。prefetch を補充するときに contentID > tailcontentid の
+-- 投稿を順に調べて prefetch に混ぜ、調べた最後の contentID を保存する
+-- （models/content_get.py:get_feed_page）
+--
+-- tailcontentid : 調べ済みの最大 contentID（新しいエポックでは domainsize に戻す）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/016_feed_tail.sql
+-- ============================================================
+
+ALTER TABLE feedcursor ADD COLUMN IF NOT EXISTS tailcontentid INTEGER NOT NULL DEFAULT 0;
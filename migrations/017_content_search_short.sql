@@ -0,0 +1,33 @@
+-- ============================================================
+-- 1〜2文字の検索語用の索引
+-- ============================================================
+-- pg_trgm は3文字未満の検索語から trigram を作れないため、004 の GIN インデックスでは
+-- 1〜2文字の検索語（日本語では多い）がインデックスの全件走査になっていた。
+-- searchtext に含まれる1文字・2文字の部分文字列の配列を返す関数の式インデックスを作り、
+-- 1〜2文字の検索語は search_grams(searchtext) @> ARRAY[検索語] で引く
+-- （models/selectdata.py:get_search_contents。3文字以上はこれまで通り trigram）
+--
+-- 注意:
+--   - 関数の定義を変えた場合はインデックスを作り直す（REINDEX）
+--   - インデックスの作成は content の全件を読むため、メンテナンス時間帯に実行する
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/017_content_search_short.sql
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION search_grams(t TEXT)
+RETURNS TEXT[]
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT COALESCE(array_agg(DISTINCT g), '{}')
+    FROM (
+        SELECT substr(t, i, 1) AS g FROM generate_series(1, char_length(t)) AS i
+        UNION
+        SELECT substr(t, i, 2) FROM generate_series(1, char_length(t) - 1) AS i
+    ) grams
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_content_searchtext_grams
+ON content USING gin (search_grams(searchtext));
+
+ANALYZE content;
@@ -0,0 +1,17 @@
+-- ============================================================
+-- 署名付きURLでのアップロードの登録を1回にする
+-- ============================================================
+-- /api/content/upload/complete は同じチケットで再送されると登録済みのコンテンツを返すが、
+-- 確認（SELECT）と登録（INSERT）が別の文だったため、同時に送られると両方が登録していた。
+-- アップロード先のS3キーを uploadkey として一意にし、INSERT ... ON CONFLICT (uploadkey) で登録する
+-- （models/createdata.py:add_uploaded_content）
+--
+-- uploadkey : /upload/presign で発行したコンテンツのS3キー（それ以外の投稿は NULL）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/018_content_upload_key.sql
+-- ============================================================
+
+ALTER TABLE content ADD COLUMN IF NOT EXISTS uploadkey TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_content_uploadkey ON content (uploadkey);
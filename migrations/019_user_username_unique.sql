@@ -0,0 +1,20 @@
+-- ============================================================
+-- ユーザ名の一意制約
+-- ============================================================
+-- ログイン時の新規登録（models/create_username.py:login_user）は使われていない候補から
+-- ユーザ名を選ぶが、同時に登録したユーザが同じ候補を選ぶと重複していた。
+-- username に一意インデックスを作り、重複した場合は一意制約違反で候補を作り直す。
+--
+-- 注意:
+--   - 既に重複したユーザ名があると作成に失敗する。先に次の問い合わせで確認し、片方を変更しておく
+--       SELECT username, COUNT(*) FROM "user" GROUP BY username HAVING COUNT(*) > 1;
+--   - CONCURRENTLY のためトランザクションの外で実行する（psql -f ならそのままでよい）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/019_user_username_unique.sql
+-- ============================================================
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_user_username_unique ON "user" (username);
+
+-- 一意インデックスで同じ検索ができるので、database_indexes.sql の一意でない方は削除する
+DROP INDEX CONCURRENTLY IF EXISTS idx_user_username;
@@ -0,0 +1,23 @@
+-- ============================================================
+-- 一斉通知ジョブの再開
+-- ============================================================
+-- 一斉通知はワーカープロセスのスレッドで送信するため、再起動すると running のまま止まっていた。
+-- 送信中はバッチごとに heartbeattimestamp を更新し、一定時間更新の無いジョブは
+-- 他のワーカーが引き取って続きから送信する（utils/broadcast.py:reclaim_broadcast_jobs）。
+--
+-- heartbeattimestamp : 最後に進捗を更新した日時
+-- attempts           : 実行した回数（上限に達したジョブは failed にする）
+-- lasttoken          : 送信済みの最後のトークン（トークン順に送るので、続きはこれより後から）
+--
+-- 実行方法:
+--   psql -U toudai -d spotlight -f migrations/020_broadcast_job_resume.sql
+-- ============================================================
+
+ALTER TABLE broadcastjob ADD COLUMN IF NOT EXISTS heartbeattimestamp TIMESTAMP;
+ALTER TABLE broadcastjob ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE broadcastjob ADD COLUMN IF NOT EXISTS lasttoken TEXT;
+
+-- 未完了のジョブを探す
+CREATE INDEX IF NOT EXISTS idx_broadcastjob_pending
+    ON broadcastjob(jobID)
+    WHERE status IN ('queued', 'running');
@@ -1,5 +1,13 @@
+import os
+
 import psycopg2
-from models.connection_pool import get_connection, release_connection
+from models.db_session import get_connection, release_connection
+from models.user_cache import invalidate_user_profile
+
+# 進捗の更新がこの秒数無い一斉通知ジョブは、ワーカーが落ちたとみなして他のワーカーが続きから送信する
+BROADCAST_STALE_SECONDS = int(os.getenv("BROADCAST_STALE_SECONDS", "600"))
+# 一斉通知ジョブの実行回数の上限（超えたら failed）
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "3"))
 
 def uid_admin_auth(uid):
     conn = None
@@ -54,6 +62,7 @@ def get_all_user_data(offset):
 
 #管理者に変更
 def enable_admin(userID):
+    conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
@@ -61,6 +70,7 @@ def enable_admin(userID):
                 UPDATE "user" SET admin = True WHERE userID = %s;
             """, (userID,))
         conn.commit()
+        invalidate_user_profile(userID)
     except psycopg2.Error as e:
         pass
     finally:
@@ -69,6 +79,7 @@ def enable_admin(userID):
 
 #一般ユーザに変更
 def disable_admin(userID):
+    conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
@@ -76,6 +87,7 @@ def disable_admin(userID):
                 UPDATE "user" SET admin = False WHERE userID = %s;
             """, (userID,))
         conn.commit()
+        invalidate_user_profile(userID)
     except psycopg2.Error as e:
         pass
     finally:
@@ -94,7 +106,7 @@ def get_all_content_data(offset):
                 """
                 SELECT c.contentID, c.spotlightnum, c.playnum, c.contentpath, c.thumbnailpath, c.title, c.tag, c.posttimestamp, 
                 c.userID , u.username,
-                COALESCE((SELECT COUNT(*) FROM comment WHERE contentID = c.contentID) ,0)AS commentnum,
+                c.commentnum,
                 COALESCE((SELECT COUNT(*) FROM reports WHERE contentID = c.contentID) ,0)AS reportnum
                 FROM content c 
                 LEFT OUTER JOIN "user" u ON c.userID = u.userID
@@ -141,6 +153,7 @@ def get_reports_data(offset):
 
 #通報を処理
 def process_report(reportID):
+    conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
@@ -156,6 +169,7 @@ def process_report(reportID):
 
 #通報を処理解除
 def unprocess_report(reportID):
+    conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
@@ -179,7 +193,7 @@ def get_content_data(offset):
                 """
                 SELECT c.contentID, c.spotlightnum, c.playnum, c.contentpath, c.thumbnailpath, c.title, c.tag, c.posttimestamp,
                        c.userID , u.username,
-                COALESCE((SELECT COUNT(*) FROM comment WHERE contentID = c.contentID) ,0)AS commentnum,
+                c.commentnum,
                 COALESCE((SELECT COUNT(*) FROM reports WHERE contentID = c.contentID) ,0)AS reportnum
                 FROM content c 
                 LEFT OUTER JOIN "user" u ON c.userID = u.userID
@@ -361,4 +375,225 @@ def get_reported_comments():
         return []
     finally:
         if conn:
-            release_connection(conn)
\ No newline at end of file
+            release_connection(conn)
+
+# ---------------- 一斉通知ジョブ ----------------
+# 一斉通知の対象：トークンがあり通知が有効なユーザー
+_BROADCAST_TARGET_WHERE = """
+    token IS NOT NULL AND token <> '' AND notificationenabled = TRUE
+"""
+
+
+def create_broadcast_job(adminuserID, title, message):
+    """一斉通知ジョブを登録してjobIDを返す（登録したワーカーが1回目を実行する）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO broadcastjob (adminuserID, title, message, attempts, heartbeattimestamp)
+                VALUES (%s, %s, %s, 1, NOW())
+                RETURNING jobID;
+                """
+            ,(adminuserID, title, message))
+            job_id = cur.fetchone()[0]
+        conn.commit()
+        return job_id
+    except psycopg2.Error:
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def update_broadcast_job(jobID, status=None, totaltokens=None, insertednum=None, sentnum=None, failednum=None,
+                         errormessage=None, finished=False, lasttoken=None):
+    """一斉通知ジョブの進捗を更新（None の項目は変更しない）。heartbeattimestamp も更新する"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcastjob
+                   SET status = COALESCE(%s, status),
+                       totaltokens = COALESCE(%s, totaltokens),
+                       insertednum = COALESCE(%s, insertednum),
+                       sentnum = COALESCE(%s, sentnum),
+                       failednum = COALESCE(%s, failednum),
+                       errormessage = COALESCE(%s, errormessage),
+                       lasttoken = COALESCE(%s, lasttoken),
+                       heartbeattimestamp = NOW(),
+                       finishedtimestamp = CASE WHEN %s THEN NOW() ELSE finishedtimestamp END
+                 WHERE jobID = %s;
+                """
+            ,(status, totaltokens, insertednum, sentnum, failednum, errormessage, lasttoken, finished, jobID))
+        conn.commit()
+    except psycopg2.Error:
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def claim_stale_broadcast_jobs(limit=1):
+    """
+    進捗の更新が BROADCAST_STALE_SECONDS 秒無い未完了のジョブを最大 limit 件引き取る
+    複数のワーカーが同時に実行しても FOR UPDATE SKIP LOCKED で同じジョブを取り合わない
+    実行回数が上限に達したジョブは failed にする
+    Returns: [(jobID, title, message, lasttoken, sentnum, failednum), ...]
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE broadcastjob
+                   SET status = 'failed',
+                       errormessage = 'ワーカーが停止したため中断しました',
+                       finishedtimestamp = NOW()
+                 WHERE status IN ('queued', 'running')
+                   AND COALESCE(heartbeattimestamp, createdtimestamp) < NOW() - INTERVAL '1 second' * %s
+                   AND attempts >= %s;
+                """
+            ,(BROADCAST_STALE_SECONDS, BROADCAST_MAX_ATTEMPTS))
+            cur.execute(
+                """
+                UPDATE broadcastjob
+                   SET status = 'running',
+                       attempts = attempts + 1,
+                       heartbeattimestamp = NOW()
+                 WHERE jobID IN (
+                        SELECT jobID
+                          FROM broadcastjob
+                         WHERE status IN ('queued', 'running')
+                           AND COALESCE(heartbeattimestamp, createdtimestamp) < NOW() - INTERVAL '1 second' * %s
+                           AND attempts < %s
+                         ORDER BY jobID
+                         LIMIT %s
+                         FOR UPDATE SKIP LOCKED
+                 )
+                RETURNING jobID, title, message, lasttoken, sentnum, failednum;
+                """
+            ,(BROADCAST_STALE_SECONDS, BROADCAST_MAX_ATTEMPTS, limit))
+            rows = cur.fetchall()
+        conn.commit()
+        return rows
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return []
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def get_broadcast_jobs(jobID=None, limit=10):
+    """一斉通知ジョブを取得（jobID 未指定なら新しい順に limit 件）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT jobID, adminuserID, title, message, status, totaltokens, insertednum, sentnum, failednum,
+                       errormessage, createdtimestamp, finishedtimestamp
+                  FROM broadcastjob
+                 WHERE %s IS NULL OR jobID = %s
+                 ORDER BY jobID DESC
+                 LIMIT %s;
+                """
+            ,(jobID, jobID, limit))
+            rows = cur.fetchall()
+        return rows
+    except psycopg2.Error:
+        return []
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def count_broadcast_tokens():
+    """一斉通知の送信先トークン数（重複を除く）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT COUNT(DISTINCT token) FROM "user" WHERE {_BROADCAST_TARGET_WHERE};')
+            row = cur.fetchone()
+        return row[0] if row else 0
+    except psycopg2.Error:
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def insert_broadcast_notifications(jobID, title, message):
+    """
+    対象ユーザー全員の通知履歴を INSERT ... SELECT 1回で登録し、件数を返す
+    件数はジョブの insertednum に同じトランザクションで記録し、引き取ったジョブでは登録し直さない
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT insertednum FROM broadcastjob WHERE jobID = %s FOR UPDATE;", (jobID,))
+            row = cur.fetchone()
+            if row is not None and row[0] > 0:
+                conn.commit()
+                return row[0]
+            cur.execute(
+                f"""
+                INSERT INTO notification (userID, notificationtext, notificationtitle)
+                SELECT userID, %s, %s
+                  FROM "user"
+                 WHERE {_BROADCAST_TARGET_WHERE};
+                """
+            ,(message, title))
+            inserted = cur.rowcount
+            cur.execute(
+                "UPDATE broadcastjob SET insertednum = %s, heartbeattimestamp = NOW() WHERE jobID = %s;",
+                (inserted, jobID)
+            )
+        conn.commit()
+        return inserted
+    except psycopg2.Error:
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def iter_broadcast_tokens(batch_size=500, after=None):
+    """
+    一斉通知の送信先トークンをサーバーサイドカーソルで batch_size 件ずつ、トークン順に返す
+    同一端末に複数アカウントがある場合も1回だけ送るよう、DB側で重複を除く
+    after を指定するとそのトークンより後から（引き取ったジョブの続き）
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor(name="broadcast_tokens") as cur:
+            cur.itersize = batch_size
+            cur.execute(
+                f'SELECT DISTINCT token FROM "user" WHERE {_BROADCAST_TARGET_WHERE} AND (%s IS NULL OR token > %s) ORDER BY token;',
+                (after, after)
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+        conn.commit()
+    finally:
+        if conn:
+            release_connection(conn)
@@ -0,0 +1,82 @@
+"""
+ユーザーごとのブロックリストのキャッシュ
+
+フィード・検索・コメントの除外のたびに blocklist を問い合わせないよう、
+ユーザーごとに「自分がブロックしたユーザー」「自分をブロックしたユーザー」を frozenset でプロセス内に保持する。
+- insert_block / delete_block / delete_user_account は、このプロセスのキャッシュをその場とCOMMIT後に破棄する
+- 他のワーカープロセスのキャッシュは BLOCKLIST_CACHE_TTL 秒で期限切れになる（それまでは古いブロック状態で除外される）
+"""
+import os
+
+import psycopg2
+
+from models.db_session import get_connection, release_connection
+from models.process_cache import ProcessCache
+
+BLOCKLIST_CACHE_TTL = float(os.getenv("BLOCKLIST_CACHE_TTL", "60"))        # 秒
+BLOCKLIST_CACHE_SIZE = int(os.getenv("BLOCKLIST_CACHE_SIZE", "10000"))    # ユーザー数
+
+_EMPTY = (frozenset(), frozenset())
+
+
+def _load_block_sets(userID):
+    """blocklist から (自分がブロックしたユーザー, 自分をブロックしたユーザー) を1回の問い合わせで取得"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT blockedUserID, TRUE
+                  FROM blocklist
+                 WHERE userID = %s
+                UNION ALL
+                SELECT userID, FALSE
+                  FROM blocklist
+                 WHERE blockedUserID = %s;
+            """, (userID, userID))
+            rows = cur.fetchall()
+        blocked = frozenset(uid for uid, mine in rows if mine)
+        blocking = frozenset(uid for uid, mine in rows if not mine)
+        return blocked, blocking
+    except psycopg2.Error:
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+_cache = ProcessCache(_load_block_sets, maxsize=BLOCKLIST_CACHE_SIZE, ttl=BLOCKLIST_CACHE_TTL)
+
+
+def get_block_sets(userID):
+    """(自分がブロックしたユーザー, 自分をブロックしたユーザー) の userID の frozenset"""
+    if not userID:
+        return _EMPTY
+    sets = _cache.get(userID)
+    if sets is None:
+        # 取得に失敗した場合はキャッシュせず、除外なしで続ける
+        return _EMPTY
+    return sets
+
+
+def get_blocked_user_ids(userID, both_ways=False):
+    """
+    除外するユーザーの userID の frozenset
+
+    Args:
+        both_ways: True なら自分をブロックしたユーザーも含める（両方向ブロック）
+    """
+    blocked, blocking = get_block_sets(userID)
+    return blocked | blocking if both_ways else blocked
+
+
+def invalidate_blocklist(*userIDs):
+    """
+    指定ユーザーのキャッシュを破棄（ブロック登録/解除・退会時）
+    COMMIT前に他のリクエストが読み込んだ古い状態が残らないよう、COMMIT後にもう一度破棄する
+    """
+    _cache.invalidate(userIDs)
+
+
+def get_blocklist_cache_stats():
+    return _cache.stats()
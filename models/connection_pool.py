@@ -1,19 +1,249 @@
 # spotlight-backend/models/db.py
 
 from psycopg2 import pool
+from collections import deque
 import psycopg2
+import threading
+import time
 import os
 
 # グローバル変数としてプールを保持
 connection_pool = None
 
+# プール設定（環境変数で上書き可能）
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))               # 空き待ちの上限（秒）
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))    # コネクションの最大寿命（秒）
+DB_POOL_VALIDATE_IDLE = float(os.getenv("DB_POOL_VALIDATE_IDLE", "30"))    # この秒数以上アイドルならSELECT 1で確認
+
+
+class PoolTimeoutError(pool.PoolError):
+    """空きコネクションを待っている間にタイムアウトした"""
+    pass
+
+
+class BoundedConnectionPool:
+    """
+    スレッドセーフな上限付きコネクションプール
+    - 上限に達したら timeout 秒まで空きを待つ（SimpleConnectionPoolのように即例外にしない）
+    - 取得時に切断済み・寿命切れ・長時間アイドルのコネクションを検査して作り直す
+    - 待ち時間・使用中数などのメトリクスを保持する
+    """
+
+    def __init__(self, minconn, maxconn, timeout=DB_POOL_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                 validate_idle=DB_POOL_VALIDATE_IDLE, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.validate_idle = validate_idle
+        self._kwargs = kwargs
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()         # (conn, 作成時刻, 返却時刻)
+        self._in_use = {}            # id(conn) -> (conn, 作成時刻, 取得時刻)
+        self._opened = 0             # 開いている（または作成中の）コネクション数
+        self._closed = False
+
+        # メトリクス
+        self._checkouts = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waiting = 0
+        self._peak_in_use = 0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+
+        for _ in range(minconn):
+            with self._cond:
+                self._opened += 1
+            conn = self._connect()
+            now = time.monotonic()
+            with self._cond:
+                self._idle.append((conn, now, now))
+
+    def _connect(self):
+        """新しいコネクションを作成（失敗したら枠を戻す）"""
+        try:
+            conn = psycopg2.connect(**self._kwargs)
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _discard(self, conn, recycled=False):
+        """コネクションを閉じて枠を空ける"""
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._opened -= 1
+            if recycled:
+                self._recycled += 1
+            else:
+                self._discarded += 1
+            self._cond.notify()
+
+    def _is_usable(self, conn, released_at, now):
+        """取得時の検査：切断済み・アイドル後の疎通確認"""
+        if conn.closed:
+            return False
+        if self.validate_idle is not None and now - released_at >= self.validate_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        """コネクションを取得。空きが無ければ timeout 秒まで待つ"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        # 直近に返却されたもの（温まっているもの）から使う
+                        entry = self._idle.pop()
+                        break
+                    if self._opened < self.maxconn:
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"connection pool exhausted: waited {timeout:.1f}s "
+                            f"(in_use={len(self._in_use)}, max={self.maxconn})"
+                        )
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            now = time.monotonic()
+            if entry is None:
+                conn = self._connect()
+                created_at = now
+            else:
+                conn, created_at, released_at = entry
+                if self.max_lifetime and now - created_at >= self.max_lifetime:
+                    self._discard(conn, recycled=True)
+                    continue
+                if not self._is_usable(conn, released_at, now):
+                    self._discard(conn)
+                    continue
+
+            wait = now - start
+            with self._cond:
+                self._in_use[id(conn)] = (conn, created_at, now)
+                self._checkouts += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                if waited:
+                    self._waited += 1
+                self._peak_in_use = max(self._peak_in_use, len(self._in_use))
+            return conn
+
+    def putconn(self, conn, close=False):
+        """コネクションを返却。壊れている・寿命切れなら閉じる"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            # プール外のコネクション（二重返却など）は閉じるだけ
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        created_at = entry[1]
+
+        if close or self._closed or conn.closed:
+            self._discard(conn)
+            return
+        if self.max_lifetime and time.monotonic() - created_at >= self.max_lifetime:
+            self._discard(conn, recycled=True)
+            return
+
+        # 未完了のトランザクションが残っていたら巻き戻す
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """全コネクションを閉じる（使用中のものは返却時に閉じる）"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """プールのメトリクスを取得"""
+        now = time.monotonic()
+        with self._cond:
+            in_use = len(self._in_use)
+            oldest = max((now - e[2] for e in self._in_use.values()), default=0.0)
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "open": self._opened,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "peak_in_use": self._peak_in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "waited_checkouts": self._waited,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+                "oldest_checkout_ms": round(oldest * 1000, 3),
+            }
+
+
 def init_connection_pool():
     """Flask起動時に一度だけ呼び出してプールを作成"""
     global connection_pool
     if connection_pool is None:
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            minconn=5,
-            maxconn=20,
+        connection_pool = BoundedConnectionPool(
+            minconn=DB_POOL_MIN,
+            maxconn=DB_POOL_MAX,
             user=os.getenv("DB_USER"),
             password=os.getenv("DB_PASSWORD"),
             host=os.getenv("DB_HOST"),
@@ -22,11 +252,20 @@ def init_connection_pool():
         )
 
 def get_connection():
-    """プールからコネクションを取得"""
+    """プールからコネクションを取得（空きが無ければ DB_POOL_TIMEOUT 秒まで待つ）"""
     if connection_pool is None:
         raise Exception("❌ Connection pool is not initialized. Call init_connection_pool() first.")
     return connection_pool.getconn()
 
+def open_dedicated_connection():
+    """
+    プールとは別の専用コネクションを開く（LISTEN のように長時間持ち続ける用途）
+    接続先はプールと同じ。使い終わったら呼び出し側で close() する
+    """
+    if connection_pool is None:
+        raise Exception("❌ Connection pool is not initialized. Call init_connection_pool() first.")
+    return psycopg2.connect(**connection_pool._kwargs)
+
 def release_connection(conn):
     """使用後にコネクションを返却"""
     if connection_pool:
@@ -36,3 +275,9 @@ def close_all_connections():
     """アプリ終了時に全コネクションを閉じる"""
     if connection_pool:
         connection_pool.closeall()
+
+def get_pool_stats():
+    """プールのメトリクスを取得（未初期化ならNone）"""
+    if connection_pool is None:
+        return None
+    return connection_pool.stats()
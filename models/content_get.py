@@ -1,159 +1,14 @@
 import psycopg2
-from models.connection_pool import get_connection, release_connection
+import random
+from models.db_session import get_connection, release_connection
+from utils.feed_shuffle import FeedPermutation
+from utils.content_index import get_content_index
 
 
-def get_recent_history_ids(uid, exclude_content_ids=None):
-    """
-    最近の再生履歴を除外してコンテンツを取得
-    スクロール中の重複取得を防ぐため、既に取得したコンテンツIDを除外可能
-    
-    Args:
-        uid: ユーザーID
-        exclude_content_ids: 除外するコンテンツIDのリスト（スクロール中の重複防止用）
-    """
-    conn = None
-    try:
-        conn = get_connection()
-        with conn.cursor() as cur:
-            # パラメータ構築
-            params = [uid, uid, uid, uid, uid]
-            
-            # 除外IDの条件を追加
-            exclude_condition = ""
-            if exclude_content_ids and len(exclude_content_ids) > 0:
-                placeholders = ','.join(['%s'] * len(exclude_content_ids))
-                exclude_condition = f"""
-                        UNION
-                        SELECT contentID
-                        FROM (VALUES ({placeholders})) AS excluded(contentID)
-                """
-                params.extend(exclude_content_ids)
-            
-            query = """
-                SELECT c.title, c.contentpath, c.spotlightnum, c.posttimestamp, 
-                    c.playnum, c.link, u1.username, u1.userID, u1.iconimgpath, c.textflag, c.thumbnailpath,
-                    cu.spotlightflag, COALESCE((SELECT COUNT(*) FROM comment WHERE contentID = c.contentID) ,0)AS commentnum, c.contentid
-                FROM content c
-                JOIN "user" u1 ON c.userID = u1.userID
-                LEFT JOIN contentuser cu 
-                ON cu.contentID = c.contentID
-                AND cu.userID = %s
-                WHERE NOT EXISTS (
-                    SELECT 1
-                    FROM (
-                        SELECT DISTINCT contentID
-                        FROM (
-                            SELECT contentID
-                            FROM playhistory
-                            WHERE userID = %s
-                            ORDER BY playid DESC
-                            LIMIT 50
-                        ) AS recent_history
-                        UNION
-                        SELECT lastcontetid
-                        FROM "user"
-                        WHERE userID = %s
-                        UNION
-                        SELECT c.contentID
-                        FROM content c
-                        JOIN "user" u ON c.userID = u.userID
-                        WHERE c.userID IN (
-                            SELECT blockedUserID
-                            FROM blocklist
-                            WHERE userID = %s
-                            UNION
-                            SELECT userID
-                            FROM blocklist
-                            WHERE blockedUserID = %s
-                        )
-            """ + exclude_condition + """
-                    ) p
-                    WHERE p.contentID = c.contentID
-                )
-            """
-            
-            # 除外IDがある場合は追加条件を適用
-            if exclude_content_ids and len(exclude_content_ids) > 0:
-                query += " AND c.contentID NOT IN (" + ','.join(['%s'] * len(exclude_content_ids)) + ")"
-                params.extend(exclude_content_ids)
-            
-            query += " ORDER BY RANDOM() LIMIT 5;"
-            
-            cur.execute(query, tuple(params))
-            rows = cur.fetchall()
-        return rows
-    except psycopg2.Error as e:
-        return []
-    finally:
-        if conn:
-            release_connection(conn)
-
-def get_history_ran(uid,limitnum, exclude_content_ids=None):
-    conn = None
-    try:
-        conn = get_connection()
-        with conn.cursor() as cur:
-            # 除外するcontentIDの条件を追加
-            exclude_condition = ""
-            params = [uid, uid, uid, uid]
-            
-            if exclude_content_ids and len(exclude_content_ids) > 0:
-                # 除外するcontentIDのプレースホルダーを作成
-                placeholders = ','.join(['%s'] * len(exclude_content_ids))
-                exclude_condition = f"""
-                        UNION
-                        SELECT contentID
-                        FROM (VALUES ({placeholders})) AS excluded(contentID)
-                """
-                params.extend(exclude_content_ids)
-            
-            query = """
-                SELECT c.title, c.contentpath, c.spotlightnum, c.posttimestamp, 
-                    c.playnum, c.link, u1.username, u1.userID, u1.iconimgpath, c.textflag, c.thumbnailpath,
-                    cu.spotlightflag, COALESCE((SELECT COUNT(*) FROM comment WHERE contentID = c.contentID) ,0)AS commentnum, c.contentid
-                FROM content c
-                JOIN "user" u1 ON c.userID = u1.userID
-                LEFT JOIN contentuser cu 
-                ON cu.contentID = c.contentID
-                AND cu.userID = %s
-                WHERE NOT EXISTS (
-                    SELECT 1
-                    FROM (
-                        SELECT lastcontetid AS contentID
-                        FROM "user"
-                        WHERE userID = %s AND lastcontetid IS NOT NULL
-                        UNION
-                        SELECT DISTINCT contentID
-                        FROM content
-                        WHERE userID IN (
-                            SELECT blockedUserID FROM blocklist WHERE userID = %s
-                            UNION
-                            SELECT userID FROM blocklist WHERE blockedUserID = %s
-                        )
-                    ) p
-                    WHERE p.contentID = c.contentID
-                )
-            """
-            # 除外するcontentIDがある場合は追加条件を適用
-            if exclude_content_ids and len(exclude_content_ids) > 0:
-                query += " AND c.contentID NOT IN (" + ','.join(['%s'] * len(exclude_content_ids)) + ")"
-                params.extend(exclude_content_ids)
-            
-            query += " ORDER BY RANDOM() LIMIT %s;"
-            params.append(limitnum)
-            cur.execute(query, tuple(params))
-            rows = cur.fetchall()
-        return rows
-    except psycopg2.Error as e:
-        return []
-    finally:
-        if conn:
-            release_connection(conn)
-
 def update_last_contetid(uid,contentid):
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(immediate=True)
         with conn.cursor() as cur:
             cur.execute("""
                 UPDATE "user"
@@ -175,7 +30,7 @@ def get_one_content(uid,contentid):
             cur.execute("""
                 SELECT c.title, c.contentpath, c.spotlightnum, c.posttimestamp, 
                     c.playnum, c.link, u1.username, u1.userID, u1.iconimgpath, c.textflag, c.thumbnailpath,
-                    cu.spotlightflag, COALESCE((SELECT COUNT(*) FROM comment WHERE contentID = c.contentID) ,0)AS commentnum, c.contentid
+                    COALESCE(cu.spotlightflag, FALSE) AS spotlightflag, c.commentnum, c.contentid
                 FROM content c
                 JOIN "user" u1 ON c.userID = u1.userID
                 LEFT JOIN contentuser cu 
@@ -195,127 +50,343 @@ def get_one_content(uid,contentid):
 #新しい順lastcontentid更新
 
 # ========================================
-# 共通：ブロックリスト取得（CTEで最適化）
+# 完全ランダム取得（フィードカーソル版）
 # ========================================
-def _get_blocked_users_cte():
-    """
-    ブロックリストを取得するCTE（Common Table Expression）
-    両方向ブロック（自分がブロックしたユーザー + 自分をブロックしたユーザー）
-    パフォーマンス向上のため、サブクエリをCTEに変更
-    """
-    return """
-        WITH blocked_users AS (
-            SELECT blockedUserID AS userID
-            FROM blocklist
-            WHERE userID = %s
-            UNION
-            SELECT userID
-            FROM blocklist
-            WHERE blockedUserID = %s
+FEED_PAGE_SIZE = 3
+# 1回の問い合わせで置換から取り出す候補数（ページサイズに対する倍率）
+FEED_CANDIDATE_FACTOR = 4
+# フィード対象のインデックス（utils/content_index.py）がある場合に、メモリ上で1回に調べる候補数
+FEED_INDEX_SCAN_SIZE = 256
+# 次回以降のために置換から先に取り出しておく候補数（feedcursor.prefetch）
+# これが残っている間は1回の問い合わせでページを返せる（_get_feed_page_prefetched）
+FEED_PREFETCH_SIZE = 60
+# クライアントから受け取る除外IDの上限（feedSession を送らない旧クライアント用。新しい方から使う）
+FEED_EXCLUDE_MAX = 100
+# 1リクエストで置換から取り出して調べる回数の上限（1回ごとに詳細取得の問い合わせが最大1回）
+# 閲覧できる候補が少なく上限に達した場合は、件数が足りなくても返し、続きは次のリクエストで調べる
+FEED_MAX_BATCHES = 8
+# エポックの途中で増えた投稿（contentID が置換の範囲より大きいもの）を1回に調べる件数
+FEED_TAIL_SIZE = 20
+
+# 投稿一覧の行（旧 get_content_random_5 と同じ並び）
+_FEED_COLUMNS = """
+            c.title, 
+            c.contentpath, 
+            c.spotlightnum, 
+            c.posttimestamp, 
+            c.playnum, 
+            c.link, 
+            u1.username, 
+            u1.userID, 
+            u1.iconimgpath, 
+            c.textflag, 
+            c.thumbnailpath,
+            COALESCE(cu.spotlightflag, FALSE) AS spotlightflag, 
+            c.commentnum, 
+            c.contentID,
+            c.renditions,
+            c.thumbnailvariants,
+            u1.iconvariants
+"""
+
+
+def _get_feed_cursor(cur, uid):
+    """フィードカーソルを行ロック付きで取得（同一ユーザの同時リクエストを直列化）"""
+    cur.execute("""
+        SELECT seed, epoch, position, domainsize, prefetch, tailcontentid
+        FROM feedcursor
+        WHERE userID = %s
+        FOR UPDATE;
+    """, (uid,))
+    return cur.fetchone()
+
+
+def _new_feed_epoch(cur, epoch):
+    """新しいエポックを開始（シードを引き直し、対象範囲を現在の最大contentIDにする）"""
+    cur.execute("SELECT COALESCE(MAX(contentID), 0) FROM content;")
+    domainsize = cur.fetchone()[0]
+    return random.getrandbits(62), epoch + 1, 0, domainsize
+
+
+def _save_feed_cursor(cur, uid, seed, epoch, position, domainsize, prefetch, tailcontentid, lastcontentid):
+    """カーソルと最後に返したcontentIDを保存し、ログ用に閲覧ユーザのusernameを返す"""
+    cur.execute("""
+        WITH saved AS (
+            INSERT INTO feedcursor (userID, seed, epoch, position, domainsize, prefetch, tailcontentid, updatedtimestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (userID) DO UPDATE
+            SET seed = EXCLUDED.seed,
+                epoch = EXCLUDED.epoch,
+                position = EXCLUDED.position,
+                domainsize = EXCLUDED.domainsize,
+                prefetch = EXCLUDED.prefetch,
+                tailcontentid = EXCLUDED.tailcontentid,
+                updatedtimestamp = NOW()
         )
+        UPDATE "user"
+        SET lastcontetid = COALESCE(%s, lastcontetid)
+        WHERE userID = %s
+        RETURNING username;
+    """, (uid, seed, epoch, position, domainsize, prefetch, tailcontentid, lastcontentid, uid))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _take_feed_tail(cur, tailcontentid, prefetch):
     """
+    エポックの開始後に増えた投稿（置換の範囲外）を prefetch のランダムな位置に混ぜる
+    contentID 順に FEED_TAIL_SIZE 件ずつ調べ、調べた最後の contentID を返す（次回はその続きから）
+    """
+    cur.execute("""
+        SELECT contentID, (textflag = FALSE OR textflag IS NULL)
+        FROM content
+        WHERE contentID > %s
+        ORDER BY contentID
+        LIMIT %s;
+    """, (tailcontentid, FEED_TAIL_SIZE))
+    for cid, visible in cur.fetchall():
+        tailcontentid = cid
+        if visible:
+            prefetch.insert(random.randint(0, len(prefetch)), cid)
+    return tailcontentid
+
 
-def _get_one_way_blocked_users_cte():
+def _hydrate_feed_contents(cur, uid, content_ids, blocked_user_ids):
     """
-    片方向ブロックリストを取得するCTE（Common Table Expression）
-    自分がブロックしたユーザーのみを除外
-    パフォーマンス向上のため、サブクエリをCTEに変更
+    候補のcontentIDのうち閲覧可能なものだけを詳細付きで取得
+    片方向ブロック（自分がブロックしたユーザーのみ除外。blocked_user_ids はキャッシュから取得したもの）
+    戻り値は {contentID: row}（行の並びは旧 get_content_random_5 と同じ）
     """
-    return """
-        WITH blocked_users AS (
-            SELECT blockedUserID AS userID
-            FROM blocklist
-            WHERE userID = %s
-        )
+    query = """
+        SELECT """ + _FEED_COLUMNS + """
+        FROM content c
+        JOIN "user" u1 ON c.userID = u1.userID
+        LEFT JOIN contentuser cu 
+            ON cu.contentID = c.contentID AND cu.userID = %s
+        WHERE c.contentID = ANY(%s)
+        AND (c.textflag = FALSE OR c.textflag IS NULL)
+        AND c.userID <> ALL(%s::varchar[])
     """
+    cur.execute(query, (uid, content_ids, blocked_user_ids))
+    return {row[13]: row for row in cur.fetchall()}
 
-# ========================================
-# 完全ランダム取得（最適化版）
-# ========================================
-def get_content_random_5(uid, exclude_content_ids=None):
+
+def _take_feed_contents(cur, uid, content_ids, need, blocked_user_ids, index, blocked_ordinals, skip):
     """
-    完全ランダムで3件取得（重複なし、ループ対応）
-    片方向ブロック（自分がブロックしたユーザーのみ除外）
-    最適化: CTE使用、コメント数はLEFT JOINで取得
+    候補を順に見て、閲覧可能なものを need 件まで詳細付きで取得
+    インデックスがあればフィード対象・ブロックの判定はメモリ上で行い、選んだ分だけDBから取得する
+    Returns: (rows, consumed) consumed は見た候補の数（残りは次回に回す）
     """
-    conn = None
-    try:
-        conn = get_connection()
-        with conn.cursor() as cur:
-            # パラメータ構築
-            params = [uid]  # blocked_users CTE用（片方向ブロック）
-            
-            # 除外IDの条件
-            exclude_condition = ""
-            if exclude_content_ids and len(exclude_content_ids) > 0:
-                placeholders = ','.join(['%s'] * len(exclude_content_ids))
-                exclude_condition = f" AND c.contentID NOT IN ({placeholders})"
-                params.extend(exclude_content_ids)
-            
-            params.extend([uid])  # contentuser JOIN用
-            
-            query = _get_one_way_blocked_users_cte() + """
-                SELECT 
-                    c.title, 
-                    c.contentpath, 
-                    c.spotlightnum, 
-                    c.posttimestamp, 
-                    c.playnum, 
-                    c.link, 
-                    u1.username, 
-                    u1.userID, 
-                    u1.iconimgpath, 
-                    c.textflag, 
-                    c.thumbnailpath,
-                    cu.spotlightflag, 
-                    COALESCE(comment_counts.commentnum, 0) AS commentnum, 
-                    COALESCE(c.contentID, 0) AS contentID
-                FROM content c
-                JOIN "user" u1 ON c.userID = u1.userID
-                LEFT JOIN contentuser cu 
-                    ON cu.contentID = c.contentID AND cu.userID = %s
-                LEFT JOIN (
-                    SELECT contentID, COUNT(*) AS commentnum
-                    FROM comment
-                    GROUP BY contentID
-                ) comment_counts ON c.contentID = comment_counts.contentID
-                WHERE (c.textflag = FALSE OR c.textflag IS NULL)
-                AND c.userID NOT IN (SELECT userID FROM blocked_users)
-            """ + exclude_condition + """
-                ORDER BY RANDOM()
-                LIMIT 3;
-            """
-            cur.execute(query, tuple(params))
-            rows = cur.fetchall()
-        return rows
-    except psycopg2.Error as e:
-        return []
-    finally:
-        if conn:
-            release_connection(conn)
+    if index is not None:
+        wanted = []
+        consumed = 0
+        for cid in content_ids:
+            consumed += 1
+            if cid in skip or not index.visible(cid, blocked_ordinals):
+                continue
+            wanted.append(cid)
+            if len(wanted) >= need:
+                break
+    else:
+        consumed = len(content_ids)
+        wanted = [cid for cid in content_ids if cid not in skip]
+    hydrated = _hydrate_feed_contents(cur, uid, wanted, blocked_user_ids) if wanted else {}
+
+    rows = []
+    for i, cid in enumerate(content_ids[:consumed]):
+        content = hydrated.get(cid)
+        if content is None or cid in skip:
+            continue
+        rows.append(content)
+        if len(rows) >= need:
+            consumed = i + 1
+            break
+    return rows, consumed
+
 
-# 最小・最大のcontentIDを取得（ループ判定用・最適化版）
-def get_content_id_range(uid):
+def _get_feed_page_prefetched(cur, uid, limit, excluded, blocked_user_ids):
     """
-    ユーザーが閲覧可能なコンテンツの最小・最大contentIDを取得
-    片方向ブロック（自分がブロックしたユーザーのみ除外）
-    最適化: CTE使用
+    feedcursor.prefetch に取り出し済みの候補だけで1ページ分を取得（1回の問い合わせ）
+    - カーソルの行ロック・候補の詳細取得・prefetch の消費・lastcontetid の更新を1文で行う
+    - 閲覧可能な候補が limit 件に満たない場合は何も更新せず None（置換を進める通常の処理に任せる）
+    Returns: (rows, username, epoch) または None
+    """
+    cur.execute("""
+        WITH cursor AS (
+            SELECT prefetch, epoch
+            FROM feedcursor
+            WHERE userID = %(uid)s
+            FOR UPDATE
+        ), picked AS (
+            SELECT """ + _FEED_COLUMNS + """, p.ord
+            FROM cursor
+            CROSS JOIN LATERAL unnest(cursor.prefetch) WITH ORDINALITY AS p(contentID, ord)
+            JOIN content c ON c.contentID = p.contentID
+            JOIN "user" u1 ON c.userID = u1.userID
+            LEFT JOIN contentuser cu 
+                ON cu.contentID = c.contentID AND cu.userID = %(uid)s
+            WHERE (c.textflag = FALSE OR c.textflag IS NULL)
+            AND c.userID <> ALL(%(blocked)s::varchar[])
+            AND c.contentID <> ALL(%(excluded)s::int[])
+            ORDER BY p.ord
+            LIMIT %(limit)s
+        ), enough AS (
+            SELECT MAX(ord) AS lastord
+            FROM picked
+            HAVING COUNT(*) >= %(limit)s
+        ), advanced AS (
+            UPDATE feedcursor f
+            SET prefetch = f.prefetch[(enough.lastord + 1)::int:],
+                updatedtimestamp = NOW()
+            FROM enough
+            WHERE f.userID = %(uid)s
+        ), viewer AS (
+            UPDATE "user"
+            SET lastcontetid = (SELECT contentID FROM picked ORDER BY ord DESC LIMIT 1)
+            WHERE userID = %(uid)s AND EXISTS (SELECT 1 FROM enough)
+            RETURNING username
+        )
+        SELECT picked.*, (SELECT username FROM viewer), (SELECT epoch FROM cursor)
+        FROM picked
+        WHERE EXISTS (SELECT 1 FROM enough)
+        ORDER BY picked.ord;
+    """, {"uid": uid, "blocked": blocked_user_ids, "excluded": list(excluded), "limit": limit})
+    rows = cur.fetchall()
+    if len(rows) < limit:
+        return None
+    return [row[:17] for row in rows], rows[0][18], rows[0][19]
+
+
+def _to_content_ids(values):
+    """クライアントから受け取った除外IDのうち整数にできるものだけを集める（新しい方から FEED_EXCLUDE_MAX 件）"""
+    ids = set()
+    for value in (values or [])[-FEED_EXCLUDE_MAX:]:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+def get_feed_page(uid, blocked_user_ids, limit=FEED_PAGE_SIZE, exclude_content_ids=None):
+    """
+    ユーザごとの擬似ランダム置換をカーソルで進めてフィードを取得（重複なし、ループ対応）
+
+    置換はエポックごとのシードで決まり、カーソル位置から候補IDを順に取り出して
+    閲覧可能なものだけを詳細取得する。全件ソートしないため1回あたりの処理量は
+    ページサイズに比例する。カーソルが末尾に達したら新しいエポックで最初から。
+    置換から先に取り出した候補（prefetch）で足りる間は、問い合わせ1回で返す。
+    置換を調べるのは1リクエストで FEED_MAX_BATCHES 回までで、閲覧できる候補が少なく
+    limit 件に届かない場合も途中で返す（続きの位置はカーソルに残る）。
+    置換の範囲はエポック開始時の最大contentIDまでなので、その後の投稿は
+    prefetch を補充するときに tailcontentid から順に調べて混ぜる。
+
+    Args:
+        uid: ユーザーID
+        blocked_user_ids: 除外するユーザー（自分がブロックしたユーザー）のuserID
+        limit: 取得件数
+        exclude_content_ids: 除外するコンテンツIDのリスト（後方互換用。同じエポック内はカーソルで重複しない）
+
+    Returns:
+        tuple: (rows, is_looped, username, epoch) is_looped はこのリクエスト中にカーソルが一周したか。
+               username はログ用の閲覧ユーザ名、epoch は現在のエポック（feedSession 用）
     """
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(immediate=True)
+        blocked_user_ids = list(blocked_user_ids)
+        excluded = _to_content_ids(exclude_content_ids)
         with conn.cursor() as cur:
-            query = _get_one_way_blocked_users_cte() + """
-                SELECT MIN(c.contentID), MAX(c.contentID), COUNT(*)
-                FROM content c
-                WHERE (c.textflag = FALSE OR c.textflag IS NULL)
-                AND c.userID NOT IN (SELECT userID FROM blocked_users)
-            """
-            cur.execute(query, (uid,))
-            row = cur.fetchone()
-        return (row[0], row[1], row[2]) if row else (None, None, 0)
+            fast = _get_feed_page_prefetched(cur, uid, limit, excluded, blocked_user_ids)
+            if fast is not None:
+                rows, username, epoch = fast
+                conn.commit()
+                return rows, False, username, epoch
+
+            row = _get_feed_cursor(cur, uid)
+            if row is None or row[3] <= 0:
+                seed, epoch, position, domainsize = _new_feed_epoch(cur, row[1] if row else 0)
+                prefetch = []
+                tailcontentid = domainsize
+            else:
+                seed, epoch, position, domainsize = row[:4]
+                prefetch = list(row[4] or [])
+                tailcontentid = max(row[5] or 0, domainsize)
+
+            result = []
+            picked = set()
+            is_looped = False
+            # フィード対象のインデックスが読み込み済みなら、候補の絞り込みはメモリ上で行う
+            index = get_content_index()
+            blocked_ordinals = index.blocked_ordinals(blocked_user_ids) if index is not None else None
+
+            # 取り出し済みの候補から使う（使わなかった分は残す）
+            if prefetch:
+                rows, used = _take_feed_contents(
+                    cur, uid, prefetch, limit, blocked_user_ids, index, blocked_ordinals, excluded
+                )
+                result.extend(rows)
+                picked.update(r[13] for r in rows)
+                prefetch = prefetch[used:]
+
+            batches = 0
+            if index is not None:
+                batch_size = FEED_INDEX_SCAN_SIZE
+            else:
+                batch_size = max(limit * FEED_CANDIDATE_FACTOR, 1)
+
+            # 空振りが続いても FEED_MAX_BATCHES 回で打ち切る（残りは次のリクエストで続きから）
+            while len(result) < limit and domainsize > 0 and batches < FEED_MAX_BATCHES:
+                if position >= domainsize:
+                    seed, epoch, position, domainsize = _new_feed_epoch(cur, epoch)
+                    # 前のエポックの置換から取り出した候補・範囲外の投稿の位置は引き継がない
+                    # （新しいエポックの最初のページに前のエポックの投稿が重複して出ないように）
+                    prefetch = []
+                    tailcontentid = domainsize
+                    is_looped = True
+                    # 一周したらクライアント側の除外リストは無効（ページ内の重複のみ防ぐ）
+                    excluded = set()
+                    if domainsize <= 0:
+                        break
+
+                permutation = FeedPermutation(seed, domainsize)
+                end = min(position + batch_size, domainsize)
+                candidates = [permutation[pos] + 1 for pos in range(position, end)]
+                rows, used = _take_feed_contents(
+                    cur, uid, candidates, limit - len(result), blocked_user_ids,
+                    index, blocked_ordinals, excluded | picked
+                )
+                result.extend(rows)
+                picked.update(r[13] for r in rows)
+                # 使わなかった候補は次回に回す
+                position += used
+                batches += 1
+
+            # 次回以降の分を置換から取り出しておく（エポックの終わりまで）
+            # インデックスがあればフィード対象外（テキスト投稿・削除済み）は入れない
+            if len(prefetch) < FEED_PREFETCH_SIZE and position < domainsize:
+                permutation = FeedPermutation(seed, domainsize)
+                walked = 0
+                while (len(prefetch) < FEED_PREFETCH_SIZE and position < domainsize
+                       and walked < FEED_INDEX_SCAN_SIZE * 4):
+                    cid = permutation[position] + 1
+                    position += 1
+                    walked += 1
+                    if index is None or index.visible(cid, ()):
+                        prefetch.append(cid)
+                # エポック開始後の投稿を混ぜる（エポックの終わりなら次の置換に含まれる）
+                tailcontentid = _take_feed_tail(cur, tailcontentid, prefetch)
+
+            lastcontentid = result[-1][13] if result else None
+            username = _save_feed_cursor(
+                cur, uid, seed, epoch, position, domainsize, prefetch, tailcontentid, lastcontentid
+            )
+        conn.commit()
+        return result, is_looped, username, epoch
     except psycopg2.Error as e:
-        return None, None, 0
+        if conn:
+            conn.rollback()
+        return [], False, None, None
     finally:
         if conn:
             release_connection(conn)
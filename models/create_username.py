@@ -198,12 +198,13 @@ def create_username():
     return name
 
 import psycopg2
+from psycopg2 import errors
 import os
-from models.connection_pool import get_connection, release_connection
+from models.db_session import get_connection, release_connection
 
 
 def register_username(userID, token):
-    """ユーザ名が存在しなければ登録し、全コンテンツと紐付け"""
+    """ユーザ名が存在しなければ登録（contentuserは疎な構造のため紐付けは行わない）"""
     conn = None
     try:
         conn = get_connection()
@@ -229,13 +230,6 @@ def register_username(userID, token):
             VALUES (%s, %s, %s);
         """, (userID, username, token))
 
-        # ====== 全コンテンツと自動紐付け（CROSS JOINで高速化） ======
-        cur.execute("""
-            INSERT INTO contentuser (contentID, userID)
-            SELECT c.contentID, %s AS userID
-            FROM content AS c;
-        """, (userID,))
-
         conn.commit()
 
     except psycopg2.Error as e:
@@ -243,4 +237,77 @@ def register_username(userID, token):
             conn.rollback()
     finally:
         if conn:
-            release_connection(conn)
\ No newline at end of file
+            release_connection(conn)
+
+# login_user で候補を作り直す回数
+LOGIN_USERNAME_ATTEMPTS = 3
+
+
+def _username_candidates():
+    """register_username と同じく、重複したら作り直し、最後の候補には数字を付ける"""
+    candidates = [create_username() for _ in range(3)]
+    candidates.append(f"{create_username()}{random.randint(1, 999)}")
+    return candidates
+
+
+def login_user(userID, token, iconimgpath):
+    """
+    ログイン時のユーザー取得・新規登録を1文で行う
+    存在しなければユーザ名（重複しない候補から選ぶ）・通知用トークン・デフォルトアイコンで登録する
+    候補がすべて使われていた・同時に同じユーザ名が登録された（一意制約違反）場合は候補を作り直す
+
+    Returns:
+        dict: username / iconimgpath / admin / bio / is_new（失敗時は None）
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        row = None
+        for _ in range(LOGIN_USERNAME_ATTEMPTS):
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        WITH candidate AS (
+                            SELECT t.name
+                            FROM unnest(%(candidates)s::varchar[]) WITH ORDINALITY AS t(name, ord)
+                            WHERE NOT EXISTS (SELECT 1 FROM "user" u WHERE u.username = t.name)
+                            ORDER BY t.ord
+                            LIMIT 1
+                        ), ins AS (
+                            INSERT INTO "user" (userID, username, token, iconimgpath)
+                            SELECT %(uid)s, name, %(token)s, %(icon)s FROM candidate
+                            ON CONFLICT (userID) DO NOTHING
+                            RETURNING username, iconimgpath, admin, bio
+                        )
+                        SELECT username, iconimgpath, admin, bio, TRUE FROM ins
+                        UNION ALL
+                        SELECT username, iconimgpath, admin, bio, FALSE
+                        FROM "user"
+                        WHERE userID = %(uid)s AND NOT EXISTS (SELECT 1 FROM ins);
+                    """, {"candidates": _username_candidates(), "uid": userID,
+                          "token": token, "icon": iconimgpath})
+                    row = cur.fetchone()
+            except errors.UniqueViolation:
+                # 同時に同じユーザ名が登録された（migrations/019_user_username_unique.sql）
+                conn.rollback()
+                continue
+            # 同時に（同じ userID で）登録された場合は、この文のスナップショットから見えないので取り直す
+            if row is not None:
+                break
+        conn.commit()
+        if row is None:
+            return None
+        return {
+            "username": row[0],
+            "iconimgpath": row[1],
+            "admin": row[2],
+            "bio": row[3],
+            "is_new": row[4],
+        }
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
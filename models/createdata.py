@@ -1,30 +1,30 @@
 import psycopg2
-from models.connection_pool import get_connection, release_connection
+from models.db_session import get_connection, release_connection
+from models.blocklist_cache import invalidate_blocklist
 
 
 #実装済み
 #----------------コンテンツを追加----------------
-def add_content_and_link_to_users(contentpath, link, title, userID, thumbnailpath=None, textflag=None, tag=None, orientation=None):
-    """コンテンツを追加し、全ユーザと紐付け"""
+def add_content_and_link_to_users(contentpath, link, title, userID, thumbnailpath=None, textflag=None, tag=None, orientation=None,
+                                  thumbnailvariants=False):
+    """
+    コンテンツを追加
+    contentuserは疎な構造（スポットライト・通知が発生した時点で作成）のため、
+    全ユーザとの紐付けは行わない（関数名は互換性のため維持）
+    thumbnailvariants: サムネイルの縮小版を作成できたか
+    """
     conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
             # コンテンツ追加
             cur.execute("""
-                INSERT INTO content (contentpath, thumbnailpath, link, title, userID, textflag, tag, orientation)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO content (contentpath, thumbnailpath, link, title, userID, textflag, tag, orientation, thumbnailvariants)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING contentID;
-            """, (contentpath, thumbnailpath, link, title, userID, textflag, tag, orientation))
+            """, (contentpath, thumbnailpath, link, title, userID, textflag, tag, orientation, bool(thumbnailvariants)))
             content_id = cur.fetchone()[0]
 
-            # 全ユーザと紐付け（CROSS JOINで一括登録）
-            cur.execute("""
-                INSERT INTO contentuser (contentID, userID)
-                SELECT %s AS contentID, u.userID
-                FROM "user" AS u;
-            """, (content_id,))
-
             conn.commit()
         return content_id
 
@@ -36,13 +36,47 @@ def add_content_and_link_to_users(contentpath, link, title, userID, thumbnailpat
             release_connection(conn)
 
 
+def add_uploaded_content(uploadkey, contentpath, link, title, userID, thumbnailpath=None, tag=None, orientation=None,
+                         thumbnailvariants=False):
+    """
+    署名付きURLでアップロードされたコンテンツを追加（同じ uploadkey は1回だけ登録する）
+    Returns: (contentID, 今回追加したか)。失敗した場合は (None, False)
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO content (contentpath, thumbnailpath, link, title, userID, tag, orientation, thumbnailvariants, uploadkey)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (uploadkey) DO NOTHING
+                RETURNING contentID;
+            """, (contentpath, thumbnailpath, link, title, userID, tag, orientation, bool(thumbnailvariants), uploadkey))
+            row = cur.fetchone()
+            created = row is not None
+            if not created:
+                # 同時に登録された分は、その確定を待ってから新しい文で取得する
+                cur.execute("SELECT contentID FROM content WHERE uploadkey = %s;", (uploadkey,))
+                row = cur.fetchone()
+            conn.commit()
+        return (row[0] if row else None), created
+
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        return None, False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
 #実装済み
 #----------------コメントを追加----------------
 def insert_comment(contentID, userID, commenttext, parentcommentID=None):
     """コメントを追加"""
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(immediate=True)
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO comment (contentID, userID, commenttext, parentcommentID)
@@ -50,6 +84,12 @@ def insert_comment(contentID, userID, commenttext, parentcommentID=None):
                 RETURNING commentID;
             """, (contentID, userID, commenttext, parentcommentID))
             comment_id = cur.fetchone()[0]
+            # コメント数を同じトランザクションで更新
+            cur.execute("""
+                UPDATE content
+                SET commentnum = commentnum + 1
+                WHERE contentID = %s;
+            """, (contentID,))
             conn.commit()
         return comment_id
     except psycopg2.Error as e:
@@ -239,6 +279,7 @@ def insert_block(userID, blockedUserID):
                 ON CONFLICT (userID, blockedUserID) DO NOTHING;
             """, (userID, blockedUserID))
             conn.commit()
+        invalidate_blocklist(userID, blockedUserID)
         return True
     except psycopg2.Error:
         if conn:
@@ -260,6 +301,7 @@ def delete_block(userID, blockedUserID):
                 WHERE userID = %s AND blockedUserID = %s;
             """, (userID, blockedUserID))
             conn.commit()
+        invalidate_blocklist(userID, blockedUserID)
         return True
     except psycopg2.Error:
         if conn:
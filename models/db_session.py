@@ -0,0 +1,207 @@
+"""
+リクエスト単位のDBセッション
+
+1リクエストの中で models/* の関数を何度呼んでも、プールから借りるコネクションは1本だけにする。
+- 最初の get_connection() で遅延的にプールから取得し、flask.g に保持する
+- 各関数（ユニット）には UnitConnection を返す。既にトランザクションが開いていれば
+  SAVEPOINT を切るので、あるユニットの失敗・rollback() が他のユニットの結果を巻き込まない
+- ユニットの commit() は実際にはCOMMITせず、リクエスト終了時（after_request）に一度だけCOMMITする
+- ただしCOMMITまで行ロックが残るので、他のリクエストと取り合う行（feedcursor・content のカウンタ・
+  contentuser など）をロックするユニットは get_connection(immediate=True) で取得し、
+  commit() の時点でCOMMITする（それまでに確定したユニットの分も一緒にCOMMITされる）
+- リクエスト外（バックグラウンドスレッド・スクリプト）ではこれまで通りプールから直接取得する
+"""
+from flask import g, has_request_context, jsonify
+from psycopg2 import extensions
+import psycopg2
+
+from models.connection_pool import (
+    get_connection as _pool_get_connection,
+    release_connection as _pool_release_connection,
+)
+
+
+class _RequestSession:
+    """リクエストに紐づくコネクションと状態"""
+
+    def __init__(self):
+        self.conn = None
+        self.dirty = False      # いずれかのユニットが commit() した
+        self.units = 0          # 払い出したユニット数（SAVEPOINT名に使用）
+        self.checkouts = 0
+        self.after_commit = []  # COMMIT後に実行する処理 [(func, args), ...]
+
+
+class UnitConnection:
+    """
+    models/* の関数1回分（ユニット）に渡すコネクション
+    cursor() などはそのまま実コネクションに委譲し、commit / rollback だけを置き換える
+    """
+
+    def __init__(self, session, immediate=False):
+        self._session = session
+        self._conn = session.conn
+        self._immediate = immediate
+        session.units += 1
+        self._savepoint = None
+        if self._conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INTRANS:
+            self._set_savepoint()
+
+    def _set_savepoint(self):
+        name = f"unit_{self._session.units}"
+        with self._conn.cursor() as cur:
+            cur.execute(f"SAVEPOINT {name}")
+        self._savepoint = name
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        """
+        確定はリクエスト終了時に行う。以降の rollback() で確定分が消えないよう SAVEPOINT を切り直す
+        immediate のユニットはここでCOMMITして行ロックを解放する
+        """
+        if self._conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+            # エラー後のCOMMITはPostgreSQL上ROLLBACKになるのと同じ扱い
+            self.rollback()
+            return
+        self._session.dirty = True
+        if self._immediate:
+            _commit_session(self._session)
+            self._savepoint = None
+            return
+        self._set_savepoint()
+
+    def rollback(self):
+        """このユニットの変更だけを取り消す"""
+        if self._conn.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE:
+            # immediate のユニットがCOMMIT済み
+            return
+        if self._savepoint:
+            with self._conn.cursor() as cur:
+                cur.execute(f"ROLLBACK TO SAVEPOINT {self._savepoint}")
+        else:
+            # トランザクションを開始したのがこのユニットなので、他に取り消されるものは無い
+            self._conn.rollback()
+
+    def _release(self):
+        """ユニット終了。エラーで中断されたままならこのユニットの分だけ巻き戻す"""
+        if self._conn.closed:
+            return
+        if self._conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+            try:
+                self.rollback()
+            except psycopg2.Error:
+                self._conn.rollback()
+
+
+def get_connection(immediate=False):
+    """
+    リクエスト内ならリクエスト共有のコネクション（ユニット）、それ以外はプールから取得
+    immediate=True のユニットは commit() ですぐにCOMMITする（行ロックをリクエストの終わりまで持たない）
+    """
+    if not has_request_context():
+        return _pool_get_connection()
+    session = g.get("_db_session")
+    if session is None:
+        session = _RequestSession()
+        g._db_session = session
+    if session.conn is None or session.conn.closed:
+        if session.conn is not None:
+            _pool_release_connection(session.conn)
+        session.conn = _pool_get_connection()
+        session.dirty = False
+        session.checkouts += 1
+    return UnitConnection(session, immediate)
+
+
+def release_connection(conn):
+    """ユニットなら終了処理のみ（コネクションはリクエスト終了時に返却）"""
+    if isinstance(conn, UnitConnection):
+        conn._release()
+        return
+    _pool_release_connection(conn)
+
+
+def _commit_session(session):
+    """確定済みユニットをCOMMIT（無ければトランザクションを閉じる）し、COMMIT後の処理を実行"""
+    if session.dirty:
+        session.conn.commit()
+    else:
+        session.conn.rollback()
+    session.dirty = False
+    callbacks, session.after_commit = session.after_commit, []
+    for func, args in callbacks:
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"❌ COMMIT後の処理に失敗: {e}")
+
+
+def commit_db_session():
+    """
+    リクエスト内の確定済みユニットをまとめてCOMMITする
+    通常は after_request で呼ばれるが、別スレッドに処理を渡す前など、途中で確定させたい時にも呼べる
+    """
+    if not has_request_context():
+        return
+    session = g.get("_db_session")
+    if session is None or session.conn is None or session.conn.closed:
+        return
+    _commit_session(session)
+
+
+def after_commit(func, *args):
+    """
+    リクエストの変更がCOMMITされた後に func(*args) を実行する（キャッシュの破棄など）
+    リクエスト外、またはまだDBを使っていない場合はすぐに実行する
+    """
+    session = g.get("_db_session") if has_request_context() else None
+    if session is None or session.conn is None or session.conn.closed:
+        func(*args)
+        return
+    session.after_commit.append((func, args))
+
+
+def close_db_session(exc=None):
+    """未確定の変更を破棄してコネクションをプールへ返却"""
+    session = g.pop("_db_session", None)
+    if session is None or session.conn is None:
+        return
+    conn = session.conn
+    session.conn = None
+    try:
+        if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    _pool_release_connection(conn)
+
+
+def release_db_session():
+    """
+    ここまでの変更を確定してコネクションをプールへ返す
+    S3へのアップロードなど、DBを使わない長い処理の前に呼ぶ（以降に get_connection() すれば再取得される）
+    """
+    if not has_request_context():
+        return
+    commit_db_session()
+    close_db_session()
+
+
+def init_db_session(app):
+    """Flaskアプリにリクエスト終了時のCOMMIT・返却処理を登録"""
+
+    @app.after_request
+    def _commit_db_session(response):
+        try:
+            commit_db_session()
+        except psycopg2.Error as e:
+            close_db_session()
+            response = jsonify({"status": "error", "message": "データベースの更新に失敗しました"})
+            response.status_code = 500
+        return response
+
+    @app.teardown_request
+    def _close_db_session(exc):
+        close_db_session(exc)
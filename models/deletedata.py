@@ -1,7 +1,15 @@
 import psycopg2
 import os
-from models.connection_pool import get_connection, release_connection
-from utils.s3 import delete_file_from_url
+from models.db_session import get_connection, release_connection
+from utils.s3 import s3_key_from_path
+from utils.images import variant_keys
+from models.blocklist_cache import invalidate_blocklist
+from models.user_cache import invalidate_user_profile
+
+# S3削除キューの再試行回数の上限（超えたものはキューに残して手動で確認する）
+S3_DELETE_MAX_ATTEMPTS = int(os.getenv("S3_DELETE_MAX_ATTEMPTS", "10"))
+# 取り出したキーを他のワーカーが取り出さない秒数（この間に結果を反映できなければ再試行される）
+S3_DELETE_LEASE_SECONDS = int(os.getenv("S3_DELETE_LEASE_SECONDS", "300"))
 
 # ============================================
 # 1. 視聴履歴（playhistory）から特定の履歴を削除
@@ -150,7 +158,7 @@ def delete_notification(uid, notificationID):
 def delete_comment(contentID, commentID):
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(immediate=True)
         with conn.cursor() as cur:
 
             #repotsに紐づくデータ削除
@@ -164,12 +172,22 @@ def delete_comment(contentID, commentID):
                 DELETE FROM comment
                 WHERE contentID = %s AND parentcommentID = %s
             """, (contentID, commentID))
+            deleted = cur.rowcount
 
             # その後、コメント本体の削除
             cur.execute("""
                 DELETE FROM comment
                 WHERE contentID = %s AND commentID = %s
             """, (contentID, commentID))
+            deleted += cur.rowcount
+
+            # コメント数を削除した件数分減らす
+            if deleted > 0:
+                cur.execute("""
+                    UPDATE content
+                    SET commentnum = GREATEST(commentnum - %s, 0)
+                    WHERE contentID = %s
+                """, (deleted, contentID))
 
         conn.commit()
 
@@ -195,13 +213,13 @@ def delete_content(uid, contentID):
         with conn.cursor() as cur:
             # 削除前にコンテンツのURLを取得
             cur.execute("""
-                SELECT contentpath, thumbnailpath
+                SELECT contentpath, thumbnailpath, textflag, renditions
                 FROM content
                 WHERE userID = %s AND contentID = %s
             """, (uid, contentID))
             row = cur.fetchone()
             if row:
-                contentpath = row[0]
+                contentpath = None if row[2] else row[0]
                 thumbnailpath = row[1]
 
             #repotsに紐づくデータ削除
@@ -246,20 +264,11 @@ def delete_content(uid, contentID):
                 WHERE userID = %s AND contentID = %s
             """, (uid, contentID))
 
-        conn.commit()
-
-        # S3からファイルを削除
-        if contentpath and (contentpath.startswith('http://') or contentpath.startswith('https://')):
-            try:
-                delete_file_from_url(contentpath)
-            except Exception as e:
-                pass
+            # ⑦ S3のファイルは削除キューに登録（コミット後にバックグラウンドでまとめて削除）
+            if row:
+                queue_s3_deletions(cur, [contentpath, thumbnailpath] + list((row[3] or {}).values()))
 
-        if thumbnailpath and (thumbnailpath.startswith('http://') or thumbnailpath.startswith('https://')):
-            try:
-                delete_file_from_url(thumbnailpath)
-            except Exception as e:
-                pass
+        conn.commit()
 
     except psycopg2.Error as e:
         if conn:
@@ -278,13 +287,13 @@ def delete_content_by_admin(contentID):
         with conn.cursor() as cur:
             # 削除前にコンテンツのURLを取得
             cur.execute("""
-                SELECT contentpath, thumbnailpath
+                SELECT contentpath, thumbnailpath, textflag, renditions
                 FROM content
                 WHERE contentID = %s
             """, (contentID,))
             row = cur.fetchone()
             if row:
-                contentpath = row[0]
+                contentpath = None if row[2] else row[0]
                 thumbnailpath = row[1]
 
             #repotsに紐づくデータ削除
@@ -329,20 +338,11 @@ def delete_content_by_admin(contentID):
                 WHERE contentID = %s
             """, (contentID,))
 
-        conn.commit()
-
-        # S3からファイルを削除
-        if contentpath and (contentpath.startswith('http://') or contentpath.startswith('https://')):
-            try:
-                delete_file_from_url(contentpath)
-            except Exception as e:
-                pass
+            # ⑦ S3のファイルは削除キューに登録（コミット後にバックグラウンドでまとめて削除）
+            if row:
+                queue_s3_deletions(cur, [contentpath, thumbnailpath] + list((row[3] or {}).values()))
 
-        if thumbnailpath and (thumbnailpath.startswith('http://') or thumbnailpath.startswith('https://')):
-            try:
-                delete_file_from_url(thumbnailpath)
-            except Exception as e:
-                pass
+        conn.commit()
 
     except psycopg2.Error as e:
         if conn:
@@ -388,7 +388,7 @@ def delete_user_account(userID):
             # 削除前にユーザーのコンテンツ一覧とアイコンパスを取得
             # ① ユーザーの全コンテンツを取得（S3削除用）
             cur.execute("""
-                SELECT contentID, contentpath, thumbnailpath
+                SELECT contentID, contentpath, thumbnailpath, textflag, renditions
                 FROM content
                 WHERE userID = %s
             """, (userID,))
@@ -426,9 +426,21 @@ def delete_user_account(userID):
             """, (userID, userID, userID, userID))
             
             # 3. comment（そのユーザーのコメント）
+            #    他ユーザーのコンテンツのコメント数も削除件数分減らす
             cur.execute("""
-                DELETE FROM comment
-                WHERE userID = %s
+                WITH deleted AS (
+                    DELETE FROM comment
+                    WHERE userID = %s
+                    RETURNING contentID
+                )
+                UPDATE content c
+                SET commentnum = GREATEST(c.commentnum - d.num, 0)
+                FROM (
+                    SELECT contentID, COUNT(*) AS num
+                    FROM deleted
+                    GROUP BY contentID
+                ) d
+                WHERE c.contentID = d.contentID
             """, (userID,))
             
             # 4. contentuser（そのユーザーに関連するもの）
@@ -463,6 +475,17 @@ def delete_user_account(userID):
                 WHERE userID = %s
             """, (userID,))
             
+            # 8-2. blocklist（そのユーザーがブロックした/された関係）
+            #      相手側のブロックリストのキャッシュも破棄する
+            cur.execute("""
+                DELETE FROM blocklist
+                WHERE userID = %s OR blockedUserID = %s
+                RETURNING userID, blockedUserID
+            """, (userID, userID))
+            block_users = {userID}
+            for row in cur.fetchall():
+                block_users.update(row)
+            
             # 9. content（そのユーザーのコンテンツ）
             # 注: この時点でcontentuser, comment, notificationなどは既に削除済み
             cur.execute("""
@@ -476,43 +499,26 @@ def delete_user_account(userID):
                 WHERE userID = %s
             """, (userID,))
             
-        conn.commit()
-        
-        # ===== S3からファイルを削除 =====
-        # ① コンテンツファイルを削除
-        for content_row in contents_to_delete:
-            contentpath = content_row[1] if len(content_row) > 1 else None
-            thumbnailpath = content_row[2] if len(content_row) > 2 else None
-            
-            # contentpathを削除
-            if contentpath and (contentpath.startswith('http://') or contentpath.startswith('https://')):
-                try:
-                    delete_file_from_url(contentpath)
-                except Exception as e:
-                    pass
+            # ===== S3のファイルは削除キューに登録（コミット後にバックグラウンドでまとめて削除） =====
+            # ① コンテンツファイル（テキスト投稿の contentpath は本文なので除く）
+            s3_paths = []
+            for content_row in contents_to_delete:
+                if not content_row[3]:
+                    s3_paths.append(content_row[1])
+                s3_paths.append(content_row[2])
+                s3_paths.extend((content_row[4] or {}).values())
             
-            # thumbnailpathを削除
-            if thumbnailpath and (thumbnailpath.startswith('http://') or thumbnailpath.startswith('https://')):
-                try:
-                    delete_file_from_url(thumbnailpath)
-                except Exception as e:
-                    pass
-        
-        # ② アイコンファイルを削除（default_icon.pngは削除しない）
-        if iconpath:
-            from utils.s3 import extract_s3_key_from_url
-            icon_key = extract_s3_key_from_url(iconpath)
+            # ② アイコンファイル（default_icon.pngは削除しない）
+            if iconpath:
+                icon_key = s3_key_from_path(iconpath)
+                if icon_key and icon_key.split("/")[-1] != "default_icon.png":
+                    s3_paths.append(icon_key)
             
-            is_default_icon = False
-            if icon_key:
-                filename = icon_key.split("/")[-1] if "/" in icon_key else icon_key
-                is_default_icon = filename == "default_icon.png" or icon_key == "icon/default_icon.png"
+            queue_s3_deletions(cur, s3_paths)
             
-            if not is_default_icon and (iconpath.startswith('http://') or iconpath.startswith('https://')):
-                try:
-                    delete_file_from_url(iconpath)
-                except Exception as e:
-                    pass
+        conn.commit()
+        invalidate_blocklist(*block_users)
+        invalidate_user_profile(userID)
         
         return True
         
@@ -522,4 +528,147 @@ def delete_user_account(userID):
         return False
     finally:
         if conn:
-            release_connection(conn)
\ No newline at end of file
+            release_connection(conn)
+
+
+# ============================================
+# S3ファイル削除キュー
+#    → 削除するファイルのキーをDBの削除と同じトランザクションで登録
+#    → utils/s3_delete_queue.py のワーカーがまとめて削除
+# ============================================
+def queue_s3_deletions(cur, paths):
+    """
+    パス（URL・キー）を削除キューに登録。S3のファイルでないもの（テキストなど）は除く
+    呼び出し元のトランザクション内で実行するので、DBの削除と一緒に確定・取り消しされる
+    """
+    keys = {key for key in (s3_key_from_path(path) for path in paths) if key}
+    # サムネイル・アイコンの縮小版も一緒に削除
+    keys = sorted(keys.union(*(variant_keys(key) for key in keys)))
+    if not keys:
+        return 0
+    cur.execute("""
+        INSERT INTO s3deletequeue (s3key)
+        SELECT unnest(%s::text[])
+    """, (keys,))
+    return len(keys)
+
+
+def enqueue_s3_deletions(paths):
+    """S3のファイルを削除キューに登録（DBの削除を伴わない場合用：アイコン変更など）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            count = queue_s3_deletions(cur, paths)
+        conn.commit()
+        return count
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return 0
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def _lease_s3_deletions(batch_size):
+    """
+    再試行時刻が来たものを最大 batch_size 件取り出し、nextattempttimestamp を S3_DELETE_LEASE_SECONDS 秒後に
+    ずらしてすぐにCOMMITする（リース）。S3での削除中は行ロックもコネクションも持たない
+    Returns: [(queueID, s3key), ...]。DBエラーの場合はNone
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE s3deletequeue
+                SET nextattempttimestamp = NOW() + INTERVAL '1 second' * %s
+                WHERE queueID IN (
+                    SELECT queueID
+                    FROM s3deletequeue
+                    WHERE nextattempttimestamp <= NOW() AND attempts < %s
+                    ORDER BY nextattempttimestamp, queueID
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING queueID, s3key
+            """, (S3_DELETE_LEASE_SECONDS, S3_DELETE_MAX_ATTEMPTS, batch_size))
+            rows = cur.fetchall()
+        conn.commit()
+        return rows
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def _finish_s3_deletions(done_ids, failed_rows):
+    """削除できた行を消し、失敗した行は attempts を増やして再試行時刻を設定。成功したら True"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            if done_ids:
+                cur.execute("""
+                    DELETE FROM s3deletequeue
+                    WHERE queueID = ANY(%s)
+                """, (done_ids,))
+            if failed_rows:
+                # 再試行までの間隔は 1分, 2分, 4分 ... 最大1時間
+                cur.execute("""
+                    UPDATE s3deletequeue q
+                    SET attempts = q.attempts + 1,
+                        lasterror = f.lasterror,
+                        nextattempttimestamp = NOW() + LEAST(
+                            INTERVAL '1 minute' * POWER(2, q.attempts), INTERVAL '1 hour'
+                        )
+                    FROM unnest(%s::bigint[], %s::text[]) AS f(queueID, lasterror)
+                    WHERE q.queueID = f.queueID
+                """, ([r[0] for r in failed_rows], [r[1] for r in failed_rows]))
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def process_s3_delete_queue(delete_objects, batch_size=1000):
+    """
+    削除キューから再試行時刻が来たものを最大 batch_size 件取り出して delete_objects で削除
+    1. 取り出す行をリースしてすぐにCOMMIT（複数のワーカーが同時に実行しても FOR UPDATE SKIP LOCKED と
+       リースで同じ行を取り合わない）
+    2. DBのコネクションを持たずにS3で削除
+    3. 結果を別のトランザクションで反映（途中でワーカーが落ちた行はリースが切れたら再試行される）
+    
+    Args:
+        delete_objects: キーのリストを受け取り、失敗したキーとエラー内容の dict を返す関数
+    
+    Returns:
+        tuple: (削除した件数, 失敗した件数)。DBエラーの場合はNone
+    """
+    rows = _lease_s3_deletions(batch_size)
+    if not rows:
+        return None if rows is None else (0, 0)
+
+    try:
+        failed = delete_objects([row[1] for row in rows])
+    except Exception as e:
+        failed = {row[1]: str(e) for row in rows}
+
+    done_ids = [row[0] for row in rows if row[1] not in failed]
+    failed_rows = [(row[0], failed[row[1]]) for row in rows if row[1] in failed]
+
+    if not _finish_s3_deletions(done_ids, failed_rows):
+        return None
+    return (len(done_ids), len(failed_rows))
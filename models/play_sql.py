@@ -0,0 +1,110 @@
+import os
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from models.db_session import get_connection, release_connection
+
+# 再生履歴がこの件数を超えたユーザーは、新しい方から PLAY_HISTORY_KEEP 件だけ残す
+PLAY_HISTORY_MAX = int(os.getenv("PLAY_HISTORY_MAX", "500"))
+PLAY_HISTORY_KEEP = int(os.getenv("PLAY_HISTORY_KEEP", "300"))
+
+
+def flush_play_events(counts, history):
+    """
+    まとめた再生イベントを1トランザクションで反映
+    - counts : {contentID: 再生回数}  → コンテンツごとに1回の UPDATE（1文）
+    - history: [(userID, contentID), ...]（再生順）→ 複数行の INSERT（1文）
+    処理中に削除されたコンテンツの分は無視する
+    Returns: 成功したら True。イベントの値が不正（範囲外のIDなど）なら None、
+             それ以外の失敗（接続エラーなど）は False（どちらもロールバックする）
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            if counts:
+                # 複数プロセスが同時に反映してもデッドロックしないよう contentID 順にロックしてから更新
+                cur.execute(
+                    """
+                    SELECT contentID FROM content
+                     WHERE contentID = ANY(%s)
+                     ORDER BY contentID
+                       FOR UPDATE;
+                    """
+                ,(sorted(counts),))
+                execute_values(cur, """
+                    UPDATE content c
+                       SET playnum = c.playnum + v.n
+                      FROM (VALUES %s) AS v(contentID, n)
+                     WHERE c.contentID = v.contentID;
+                """, sorted(counts.items()), template="(%s::int, %s::int)", page_size=len(counts))
+            if history:
+                execute_values(cur, """
+                    INSERT INTO playhistory (userID, contentID)
+                    SELECT v.userID, v.contentID
+                      FROM (VALUES %s) AS v(ord, userID, contentID)
+                      JOIN content c ON c.contentID = v.contentID
+                     ORDER BY v.ord;
+                """, [(i, uid, cid) for i, (uid, cid) in enumerate(history)],
+                    template="(%s, %s, %s::int)", page_size=len(history))
+        conn.commit()
+        return True
+    except psycopg2.DataError as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return None
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def trim_play_history(userIDs):
+    """
+    指定ユーザーのうち再生履歴が PLAY_HISTORY_MAX 件を超えたユーザーの古い履歴を削除
+    （再生のたびに COUNT(*) していた処理を定期実行にまとめたもの）
+    Returns: 削除した件数（失敗時は None）
+    """
+    if not userIDs:
+        return 0
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM playhistory p
+                 USING (
+                        SELECT userID, playID,
+                               ROW_NUMBER() OVER (PARTITION BY userID ORDER BY playID DESC) AS rn
+                          FROM playhistory
+                         WHERE userID IN (
+                                SELECT userID
+                                  FROM playhistory
+                                 WHERE userID = ANY(%s)
+                                 GROUP BY userID
+                                HAVING COUNT(*) > %s
+                         )
+                 ) old
+                 WHERE old.rn > %s
+                   AND p.userID = old.userID
+                   AND p.playID = old.playID;
+                """
+            ,(list(userIDs), PLAY_HISTORY_MAX, PLAY_HISTORY_KEEP))
+            deleted = cur.rowcount
+        conn.commit()
+        return deleted
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
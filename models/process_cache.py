@@ -0,0 +1,70 @@
+"""
+DBから読み込んだ値のプロセス内キャッシュ（models/blocklist_cache.py・models/user_cache.py で共通）
+
+- 上限 maxsize 件の LRU、有効期限 ttl 秒
+- 更新する側は invalidate() で、このプロセスのキャッシュをその場とCOMMIT後に破棄する
+- 他のワーカープロセスのキャッシュは ttl 秒で期限切れになる
+"""
+import threading
+
+from cachetools import TTLCache
+
+from models.db_session import after_commit
+
+
+class ProcessCache:
+    """キーごとに loader(key) の結果を保持する"""
+
+    def __init__(self, loader, maxsize, ttl):
+        """
+        Args:
+            loader: キーを受け取って値を返す関数。偽の値（存在しない・取得に失敗した）はキャッシュしない
+        """
+        self.loader = loader
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        # 破棄のたびに増やす。読み込み中に破棄された場合、古い結果をキャッシュしないため
+        self._generation = 0
+
+    def get(self, key):
+        """キャッシュ優先で取得（loader の結果が偽なら None）"""
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._stats["hits"] += 1
+                return value
+            self._stats["misses"] += 1
+            generation = self._generation
+        value = self.loader(key)
+        if not value:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._cache[key] = value
+        return value
+
+    def invalidate(self, keys):
+        """
+        指定キーのキャッシュを破棄
+        COMMIT前に他のリクエストが読み込んだ古い値が残らないよう、COMMIT後にもう一度破棄する
+        """
+        self._invalidate(keys)
+        after_commit(self._invalidate, keys)
+
+    def _invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._cache.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._cache)
+        stats["ttl"] = self.ttl
+        stats["maxsize"] = self.maxsize
+        return stats
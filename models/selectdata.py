@@ -1,54 +1,48 @@
 import psycopg2
 import os
-from models.connection_pool import get_connection, release_connection
+from datetime import datetime
+from models.db_session import get_connection, release_connection
+from models.blocklist_cache import get_blocked_user_ids
+from models.user_cache import get_user_profile
+
+
+def _notify_target(profile):
+    """通知の送信先として使う項目だけを返す"""
+    return {
+        "userID": profile["userID"],
+        "username": profile["username"],
+        "iconimgpath": profile["iconimgpath"],
+        "token": profile["token"],
+        "notificationenabled": profile["notificationenabled"],
+    }
 
 
 def get_user_by_id(userID):
-    conn = None
-    try:
-        conn = get_connection()
-        with conn.cursor() as cur:
-            cur.execute(
-                'SELECT userID, username, iconimgpath, token, notificationenabled FROM "user" WHERE userID = %s',
-                (userID,)
-            )
-            row = cur.fetchone()
-        if row:
-            return {
-                "userID": row[0],
-                "username": row[1],
-                "iconimgpath": row[2],
-                "token": row[3],
-                "notificationenabled": row[4],
-            }
-        return None
-    except psycopg2.Error as e:
-        return None
-    finally:
-        if conn:
-            release_connection(conn)
+    """ユーザー情報を取得（models/user_cache.py のキャッシュ優先）"""
+    profile = get_user_profile(userID)
+    if profile:
+        return _notify_target(profile)
+    return None
 
 
 
 def get_user_by_content_id(contentID):
+    """投稿者の情報とタイトルを取得（投稿者の情報はキャッシュ優先）"""
     conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
             cur.execute(
-                'SELECT u.userID, u.username, u.iconimgpath, u.token, u.notificationenabled, c.title FROM content c JOIN "user" u ON c.userID = u.userID WHERE c.contentID = %s',
+                'SELECT userID, title FROM content WHERE contentID = %s',
                 (contentID,)
             )
             row = cur.fetchone()
         if row:
-            return {
-                "userID": row[0],
-                "username": row[1],
-                "iconimgpath": row[2],
-                "token": row[3],
-                "notificationenabled": row[4],
-                "title": row[5],
-            }
+            profile = get_user_profile(row[0])
+            if profile:
+                user = _notify_target(profile)
+                user["title"] = row[1]
+                return user
         return None
     except psycopg2.Error as e:
         return None
@@ -99,21 +93,11 @@ def user_exists(userID):
 
 
 def get_user_name_iconpath(userID):
-    """ユーザ名とアイコン画像パスを取得"""
-    conn = None
-    try:
-        conn = get_connection()
-        with conn.cursor() as cur:
-            cur.execute('SELECT username, iconimgpath, admin, bio FROM "user" WHERE userID = %s', (userID,))
-            row = cur.fetchone()
-        if row:
-            return row[0], row[1], row[2], row[3]
-        return None, None, None, None
-    except psycopg2.Error as e:
-        return None, None, None, None
-    finally:
-        if conn:
-            release_connection(conn)
+    """ユーザ名とアイコン画像パスを取得（models/user_cache.py のキャッシュ優先）"""
+    profile = get_user_profile(userID)
+    if profile:
+        return profile["username"], profile["iconimgpath"], profile["admin"], profile["bio"]
+    return None, None, None, None
 
 def get_user_spotlightnum(userID):
     """ユーザごとのスポットライト数を取得"""
@@ -228,7 +212,7 @@ def get_content_by_filename(folder, filename):
 
 
 def get_content_detail(contentID):
-    """指定コンテンツの詳細を取得し、再生数を+1"""
+    """指定コンテンツの詳細を取得（スポットライト数は spotlightcounter の未反映分も合計）"""
     conn = None
     try:
         conn = get_connection()
@@ -236,8 +220,12 @@ def get_content_detail(contentID):
             
             # 詳細情報を取得
             cur.execute("""
-                SELECT c.title, c.contentpath, c.spotlightnum, c.posttimestamp, 
-                       c.playnum, c.link, u.username, u.iconimgpath, c.textflag, c.thumbnailpath
+                SELECT c.title, c.contentpath,
+                       c.spotlightnum + COALESCE(
+                           (SELECT SUM(s.delta) FROM spotlightcounter s WHERE s.contentID = c.contentID), 0),
+                       c.posttimestamp, 
+                       c.playnum, c.link, u.username, u.iconimgpath, c.textflag, c.thumbnailpath,
+                       c.renditions
                 FROM content c
                 JOIN "user" u ON c.userID = u.userID
                 WHERE c.contentID = %s;
@@ -265,7 +253,8 @@ def get_user_spotlight_flag(userID, contentID):
                 WHERE userID = %s AND contentID = %s
             """, (userID, contentID))
             row = cur.fetchone()
-        return row[0] if row else False
+        # 行が無い＝まだ操作していない（スポットライトなし）
+        return bool(row[0]) if row else False
     except psycopg2.Error as e:
         return False
     finally:
@@ -281,7 +270,7 @@ def get_comments_by_content(contentID):
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT c.commentID, u.username, u.iconimgpath, 
-                       c.commenttimestamp, c.commenttext, c.parentcommentID
+                       c.commenttimestamp, c.commenttext, c.parentcommentID, c.userID
                 FROM comment c
                 JOIN "user" u ON c.userID = u.userID
                 WHERE c.contentID = %s
@@ -500,64 +489,110 @@ def get_playlists_with_thumbnail(userID):
 
 #実装済み
 # 検索一致コンテンツ一覧
-def get_search_contents(word, user_id):
-    conn = None
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_WORDS = 5
+# これより短い検索語は trigram が作れないので、1〜2文字の部分文字列の式インデックスで引く
+SEARCH_TRIGRAM_MIN_LENGTH = 3
+
+
+def _escape_like(word):
+    """LIKE のワイルドカードをエスケープ"""
+    return word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _encode_search_cursor(row):
+    """次ページ用カーソル（score, 並び替え用投稿日時, contentID）"""
+    return f"{row[9]}_{row[10].isoformat()}_{row[0]}"
+
+
+def decode_search_cursor(cursor):
+    """カーソル文字列を (score, 投稿日時, contentID) に戻す。不正なら None"""
     try:
-        conn = get_connection()
+        score, ts, content_id = cursor.split("_")
+        return int(score), datetime.fromisoformat(ts), int(content_id)
+    except (AttributeError, ValueError):
+        return None
 
-        # 空白で split（複数スペースもOK）
-        words = [w.strip() for w in word.split() if w.strip()]
-        if not words:
-            return []
 
-        # LIKE 条件を動的生成
-        like_clauses = []
-        params = [user_id, user_id]  # blocked_users CTE 用
+def get_search_contents(word, user_id, limit=SEARCH_PAGE_SIZE, cursor=None):
+    """
+    タイトル・タグの部分一致検索（pg_trgm の GIN インデックスを使用）
+    content.searchtext = lower(title || ' ' || tag) に対して単語ごとに LIKE で照合し、
+    1〜2文字の単語は search_grams(searchtext) の式インデックスで照合する（migrations/017_content_search_short.sql）
+    一致した単語数（title + tag）の多い順 → 新しい順に返す
 
-        for w in words:
-            like_clauses.append("COALESCE(c.title,'') ILIKE %s")
-            like_clauses.append("COALESCE(c.tag,'') ILIKE %s")
-            params.append(f"%{w}%")
-            params.append(f"%{w}%")
+    Args:
+        word: 検索ワード（空白区切りで複数指定、いずれかに一致すれば対象）
+        user_id: 検索したユーザー（ブロック関係のユーザーは除外）
+        limit: 取得件数
+        cursor: 前ページの nextCursor（None なら先頭から。不正な値かどうかは呼び出し側で decode_search_cursor で確認する）
 
-        # スコア算出：一致したワード数（title + tag）
+    Returns:
+        tuple: (rows, next_cursor)。次ページが無ければ next_cursor は None
+    """
+    conn = None
+    try:
+        # 空白で split（複数スペースもOK）
+        words = [w.strip().lower() for w in (word or "").split() if w.strip()]
+        words = list(dict.fromkeys(words))[:SEARCH_MAX_WORDS]
+        if not words:
+            return [], None
+        limit = max(1, min(int(limit or SEARCH_PAGE_SIZE), SEARCH_MAX_PAGE_SIZE))
+        patterns = [f"%{_escape_like(w)}%" for w in words]
+
+        # 候補の絞り込み：searchtext の trigram インデックス / 短い単語は部分文字列のインデックス（BitmapOr）で検索
+        where_sql = " OR ".join(
+            "c.searchtext LIKE %s" if len(w) >= SEARCH_TRIGRAM_MIN_LENGTH
+            else "search_grams(c.searchtext) @> ARRAY[%s]::text[]"
+            for w in words
+        )
+
+        # スコア算出：一致したワード数（title + tag）。候補行に対してのみ計算される
         score_cases = []
-        for w in words:
-            score_cases.append("CASE WHEN COALESCE(c.title,'') ILIKE %s THEN 1 ELSE 0 END")
-            score_cases.append("CASE WHEN COALESCE(c.tag,'') ILIKE %s THEN 1 ELSE 0 END")
-            params.append(f"%{w}%")
-            params.append(f"%{w}%")
-
-        where_sql = " OR ".join(like_clauses)
+        for _ in patterns:
+            score_cases.append("CASE WHEN lower(COALESCE(c.title,'')) LIKE %s THEN 1 ELSE 0 END")
+            score_cases.append("CASE WHEN lower(COALESCE(c.tag,'')) LIKE %s THEN 1 ELSE 0 END")
         score_sql = " + ".join(score_cases)
 
+        params = []
+        for p in patterns:
+            params.extend([p, p])
+        params.extend(p if len(w) >= SEARCH_TRIGRAM_MIN_LENGTH else w for w, p in zip(words, patterns))
+        # ブロック関係（両方向）のユーザーはキャッシュから取得して除外
+        params.append(list(get_blocked_user_ids(user_id, both_ways=True)))
+
+        cursor_sql = ""
+        decoded = decode_search_cursor(cursor) if cursor else None
+        if decoded:
+            cursor_sql = "WHERE (score, sortts, contentID) < (%s, %s, %s)"
+            params.extend(decoded)
+        params.append(limit + 1)
+
         sql = f"""
-            WITH blocked_users AS (
-                SELECT blockedUserID AS userID
-                FROM blocklist
-                WHERE userID = %s
-                UNION
-                SELECT userID
-                FROM blocklist
-                WHERE blockedUserID = %s
+            WITH matched AS (
+                SELECT 
+                    c.contentID, 
+                    c.title, 
+                    c.spotlightnum, 
+                    c.posttimestamp, 
+                    c.playnum, 
+                    c.link, 
+                    c.thumbnailpath,
+                    u.username,
+                    u.iconimgpath,
+                    ({score_sql}) AS score,
+                    COALESCE(c.posttimestamp, TIMESTAMP 'epoch') AS sortts
+                FROM content c
+                JOIN "user" u ON c.userID = u.userID
+                WHERE ({where_sql})
+                  AND c.userID <> ALL(%s::varchar[])
             )
-            SELECT 
-                c.contentID, 
-                c.title, 
-                c.spotlightnum, 
-                c.posttimestamp, 
-                c.playnum, 
-                c.link, 
-                c.thumbnailpath,
-                u.username,
-                u.iconimgpath,
-                ({score_sql}) AS score
-            FROM contentuser cu
-            JOIN content c ON cu.contentID = c.contentID
-            JOIN "user" u ON c.userID = u.userID
-            WHERE {where_sql}
-              AND c.userID NOT IN (SELECT userID FROM blocked_users)
-            ORDER BY score DESC, c.posttimestamp DESC
+            SELECT *
+            FROM matched
+            {cursor_sql}
+            ORDER BY score DESC, sortts DESC, contentID DESC
+            LIMIT %s
         """
 
         conn = get_connection()
@@ -565,9 +600,13 @@ def get_search_contents(word, user_id):
             cur.execute(sql, params)
             rows = cur.fetchall()
 
-        return rows
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_search_cursor(rows[-1])
+        return rows, next_cursor
     except psycopg2.Error as e:
-        return []
+        return [], None
     finally:
         if conn:
             release_connection(conn)
@@ -600,12 +639,61 @@ def get_search_contents(word, user_id):
 
 
 #通知の取得
-def get_notification(uid):
+# 通知一覧
+NOTIFICATION_PAGE_SIZE = 30
+NOTIFICATION_MAX_PAGE_SIZE = 100
+
+
+def _encode_notification_cursor(row):
+    """通知のカーソル（並び替え用通知日時, notificationID）"""
+    return f"{row[19].isoformat()}_{row[0]}"
+
+
+def decode_notification_cursor(cursor):
+    """カーソル文字列を (通知日時, notificationID) に戻す。不正なら None"""
+    try:
+        ts, notification_id = cursor.split("_")
+        return datetime.fromisoformat(ts), int(notification_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_notification(uid, limit=NOTIFICATION_PAGE_SIZE, cursor=None):
+    """
+    通知一覧を新しい順に1ページ取得（(通知日時, notificationID) のキーセットページング）
+    既読にはしない（mark_notifications_read）
+
+    Args:
+        limit: 取得件数（None なら全件。ページングしない旧クライアント用）
+        cursor: 前ページの nextCursor（None なら先頭から。不正な値かどうかは呼び出し側で decode_notification_cursor で確認する）
+
+    Returns:
+        tuple: (rows, next_cursor, read_cursor)
+               next_cursor は次ページが無ければ None、read_cursor は1ページ目の先頭の通知のカーソル（既読にする位置）
+    """
     conn = None
     try:
+        if limit is not None:
+            limit = max(1, min(int(limit), NOTIFICATION_MAX_PAGE_SIZE))
+        cursor_sql = ""
+        # LIMIT NULL は全件
+        params = {"uid": uid, "limit": limit + 1 if limit is not None else None}
+        decoded = decode_notification_cursor(cursor) if cursor else None
+        if decoded:
+            cursor_sql = "AND (COALESCE(notificationtimestamp, TIMESTAMP 'epoch'), notificationID) < (%(ts)s, %(id)s)"
+            params["ts"], params["id"] = decoded
         conn = get_connection()
         with conn.cursor() as cur:
-            cur.execute("""
+            # 先に1ページ分の通知を絞り込んでから、その分だけ結合する
+            cur.execute(f"""
+                WITH page AS (
+                    SELECT *, COALESCE(notificationtimestamp, TIMESTAMP 'epoch') AS sortts
+                    FROM notification
+                    WHERE userID = %(uid)s
+                    {cursor_sql}
+                    ORDER BY sortts DESC, notificationID DESC
+                    LIMIT %(limit)s
+                )
                 SELECT 
                     n.notificationID,
                     n.notificationtimestamp,
@@ -625,8 +713,13 @@ def get_notification(uid):
                     cuc.thumbnailpath as spotlight_thumbnailpath,
                     cmc.thumbnailpath as comment_thumbnailpath,
                     cuu.iconimgpath as spotlight_iconimgpath,
-                    cmu.iconimgpath as comment_iconimgpath
-                FROM notification n 
+                    cmu.iconimgpath as comment_iconimgpath,
+                    n.sortts,
+                    cuc.thumbnailvariants as spotlight_thumbnailvariants,
+                    cmc.thumbnailvariants as comment_thumbnailvariants,
+                    cuu.iconvariants as spotlight_iconvariants,
+                    cmu.iconvariants as comment_iconvariants
+                FROM page n 
                 LEFT JOIN "user" cuu ON n.contentuserUID = cuu.userID
                 LEFT JOIN content cuc ON n.contentuserCID = cuc.contentID
                 LEFT JOIN content cmc ON n.comCTID = cmc.contentID
@@ -634,19 +727,19 @@ def get_notification(uid):
                     ON n.comCTID = cm.contentID 
                     AND n.comCMID = cm.commentID
                 LEFT JOIN "user" cmu ON cm.userID = cmu.userID
-                WHERE n.userID = %s
-                ORDER BY n.notificationtimestamp DESC;
-            """, (uid,))
+                ORDER BY n.sortts DESC, n.notificationID DESC;
+            """, params)
             rows = cur.fetchall()
-            cur.execute("""
-                UPDATE notification
-                SET isread = TRUE
-                WHERE userID = %s
-            """, (uid,))
-            conn.commit()
-        return rows
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_notification_cursor(rows[-1])
+        # 既読にする位置は先頭ページの最新の通知（2ページ目以降は返さない）
+        read_cursor = _encode_notification_cursor(rows[0]) if rows and not decoded else None
+        return rows, next_cursor, read_cursor
     except psycopg2.Error as e:
-        return []
+        return [], None, None
     finally:
         if conn:
             release_connection(conn)
@@ -678,9 +771,8 @@ def get_comment_num(contentid):
         conn = get_connection()
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT 
-                    count(*)
-                FROM comment
+                SELECT commentnum
+                FROM content
                 WHERE contentid = %s
             """, (contentid,))
             row = cur.fetchone()
@@ -692,6 +784,27 @@ def get_comment_num(contentid):
             release_connection(conn)
 
 
+#アップロード済みファイルのパスからコンテンツIDを取得（署名付きアップロードの完了処理を冪等にする）
+def get_content_id_by_path(userid, contentpath):
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT contentID
+                FROM content
+                WHERE contentpath = %s AND userID = %s
+                LIMIT 1
+            """, (contentpath, userid))
+            row = cur.fetchone()
+        return row[0] if row else None
+    except psycopg2.Error as e:
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
 #ユーザごとのスポットライト数の取得
 def get_spotlight_num(userid):
     conn = None
@@ -783,18 +896,19 @@ def get_bio_by_username(username):
 
 
 def get_notified(contentid, uid):
+    """通知済みフラグを取得して通知済みにする（contentuserが無ければ作成）"""
     conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
             cur.execute('SELECT notified FROM contentuser WHERE contentID = %s AND userID = %s', (contentid,uid))
             row = cur.fetchone()
-            if row:
-                notified = row[0]
+            notified = bool(row[0]) if row else False
             cur.execute("""
-                UPDATE contentuser
-                SET notified = True
-                WHERE contentID = %s AND userID = %s
+                INSERT INTO contentuser (contentID, userID, notified)
+                VALUES (%s, %s, TRUE)
+                ON CONFLICT (contentID, userID) DO UPDATE
+                SET notified = TRUE
                 """, (contentid,uid))
             conn.commit()
         return notified
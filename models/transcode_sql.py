@@ -0,0 +1,183 @@
+import os
+
+import psycopg2
+from psycopg2.extras import Json
+
+from models.db_session import get_connection, release_connection
+from models.deletedata import queue_s3_deletions
+
+# ジョブの再試行回数の上限
+TRANSCODE_MAX_ATTEMPTS = int(os.getenv("TRANSCODE_MAX_ATTEMPTS", "3"))
+# running のまま更新が無いジョブを、ワーカーが落ちたとみなして再実行するまでの秒数
+TRANSCODE_STALE_SECONDS = int(os.getenv("TRANSCODE_STALE_SECONDS", "7200"))
+
+
+def create_transcode_job(contentID, sourcekey):
+    """動画のトランスコードジョブを登録してjobIDを返す"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO transcodejob (contentID, sourcekey)
+                VALUES (%s, %s)
+                RETURNING jobID;
+                """
+            ,(contentID, sourcekey))
+            job_id = cur.fetchone()[0]
+        conn.commit()
+        return job_id
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def claim_transcode_jobs(limit):
+    """
+    未処理のジョブを最大 limit 件取り出して running にする
+    複数のワーカーが同時に実行しても FOR UPDATE SKIP LOCKED で同じジョブを取り合わない
+    Returns: [(jobID, contentID, sourcekey), ...]
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE transcodejob
+                   SET status = 'running',
+                       attempts = attempts + 1,
+                       startedtimestamp = NOW()
+                 WHERE jobID IN (
+                        SELECT jobID
+                          FROM transcodejob
+                         WHERE (status = 'queued'
+                                OR (status = 'running'
+                                    AND startedtimestamp < NOW() - INTERVAL '1 second' * %s))
+                           AND attempts < %s
+                         ORDER BY jobID
+                         LIMIT %s
+                         FOR UPDATE SKIP LOCKED
+                 )
+                RETURNING jobID, contentID, sourcekey;
+                """
+            ,(TRANSCODE_STALE_SECONDS, TRANSCODE_MAX_ATTEMPTS, limit))
+            rows = cur.fetchall()
+        conn.commit()
+        return rows
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return []
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def finish_transcode_job(jobID, contentID, sourcekey, outputkey, renditions, probems, transcodems, uploadms):
+    """
+    トランスコード結果で content の contentpath / renditions を差し替えてジョブを完了
+    - 差し替えた元のファイルはS3削除キューに登録
+    - 処理中にコンテンツが削除・変更されていた場合は、作成したファイルの方を削除キューに登録
+    Returns: 差し替えたら True
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE content
+                   SET contentpath = %s,
+                       renditions = %s
+                 WHERE contentID = %s AND contentpath = %s;
+                """
+            ,(outputkey, Json(renditions) if renditions else None, contentID, sourcekey))
+            swapped = cur.rowcount > 0
+            if swapped:
+                if outputkey != sourcekey:
+                    queue_s3_deletions(cur, [sourcekey])
+            else:
+                created = list(renditions.values())
+                if outputkey != sourcekey:
+                    created.append(outputkey)
+                queue_s3_deletions(cur, created)
+
+            cur.execute(
+                """
+                UPDATE transcodejob
+                   SET status = 'done',
+                       outputkey = %s,
+                       probems = %s,
+                       transcodems = %s,
+                       uploadms = %s,
+                       errormessage = NULL,
+                       finishedtimestamp = NOW()
+                 WHERE jobID = %s;
+                """
+            ,(outputkey, probems, transcodems, uploadms, jobID))
+        conn.commit()
+        return swapped
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def fail_transcode_job(jobID, errormessage):
+    """ジョブを失敗にする（attempts が上限に達していなければ queued に戻して再試行）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE transcodejob
+                   SET status = CASE WHEN attempts < %s THEN 'queued' ELSE 'failed' END,
+                       errormessage = %s,
+                       finishedtimestamp = NOW()
+                 WHERE jobID = %s;
+                """
+            ,(TRANSCODE_MAX_ATTEMPTS, errormessage, jobID))
+        conn.commit()
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def count_transcode_jobs():
+    """状態ごとのジョブ数 {"queued": 3, "running": 1, ...}（完了済みは除く）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT status, COUNT(*)
+                  FROM transcodejob
+                 WHERE status <> 'done'
+                 GROUP BY status;
+                """
+            )
+            rows = cur.fetchall()
+        return {status: count for status, count in rows}
+    except psycopg2.Error:
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
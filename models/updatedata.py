@@ -1,5 +1,23 @@
+import os
+
 import psycopg2
-from models.connection_pool import get_connection, release_connection
+from models.db_session import get_connection, release_connection
+from models.user_cache import invalidate_user_profile
+
+# スポットライト数の分散カウンターのスロット数（migrations/010_spotlight_counter.sql）
+SPOTLIGHT_COUNTER_SLOTS = int(os.getenv("SPOTLIGHT_COUNTER_SLOTS", "16"))
+# fold を同時に1プロセスだけで実行するためのアドバイザリロックのID
+SPOTLIGHT_FOLD_LOCK_ID = 160016
+
+
+def add_spotlight_delta(cur, contentID, delta):
+    """スポットライト数の増減をランダムなスロットに加算（content の行はロックしない）"""
+    cur.execute("""
+        INSERT INTO spotlightcounter (contentID, slot, delta)
+        VALUES (%s, floor(random() * %s)::smallint, %s)
+        ON CONFLICT (contentID, slot) DO UPDATE
+        SET delta = spotlightcounter.delta + EXCLUDED.delta;
+    """, (contentID, SPOTLIGHT_COUNTER_SLOTS, delta))
 
 
 def update_FMCtoken(new_token, uid):
@@ -9,6 +27,7 @@ def update_FMCtoken(new_token, uid):
         with conn.cursor() as cur:
             cur.execute('UPDATE "user" SET token = %s WHERE userID = %s', (new_token, uid))
         conn.commit()
+        invalidate_user_profile(uid)
     except psycopg2.Error as e:
         if conn:
             conn.rollback()
@@ -16,27 +35,58 @@ def update_FMCtoken(new_token, uid):
         if conn:
             release_connection(conn)
 
+#----------------無効になったFCMトークンを削除----------------
+def clear_fcm_tokens(tokens):
+    """FCMから未登録と報告されたトークンを一括で削除"""
+    if not tokens:
+        return 0
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute('UPDATE "user" SET token = NULL WHERE token = ANY(%s) RETURNING userID', (list(tokens),))
+            userIDs = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        invalidate_user_profile(*userIDs)
+        cleared = len(userIDs)
+        return cleared
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        return 0
+    finally:
+        if conn:
+            release_connection(conn)
+
 #実装済み
 def spotlight_on(contentID, userID):
-    """スポットライトON：カウント+1 & ユーザフラグTrue"""
+    """
+    スポットライトON：ユーザフラグTrue（contentuserが無ければ作成）& カウント+1
+    既にONの場合は何もしない（連打してもカウントがずれない）
+    Returns: OFF→ONに変わったら True、既にONなら False、DBエラーの場合は None
+    """
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(immediate=True)
         with conn.cursor() as cur:
             cur.execute("""
-                UPDATE content
-                SET spotlightnum = spotlightnum + 1
-                WHERE contentID = %s;
-            """, (contentID,))
-            cur.execute("""
-                UPDATE contentuser
+                INSERT INTO contentuser (contentID, userID, spotlightflag)
+                VALUES (%s, %s, TRUE)
+                ON CONFLICT (contentID, userID) DO UPDATE
                 SET spotlightflag = TRUE
-                WHERE contentID = %s AND userID = %s;
+                WHERE contentuser.spotlightflag IS NOT TRUE
+                RETURNING 1;
             """, (contentID, userID))
+            changed = cur.fetchone() is not None
+            if changed:
+                add_spotlight_delta(cur, contentID, 1)
         conn.commit()
+        return changed
     except psycopg2.Error as e:
         if conn:
             conn.rollback()
+        print("エラー:", e)
+        return None
     finally:
         if conn:
             release_connection(conn)
@@ -45,26 +95,92 @@ def spotlight_on(contentID, userID):
 from models.deletedata import delete_notification_contentuser
 #実装済み
 def spotlight_off(contentID, userID):
-    """スポットライトOFF：カウント-1 & ユーザフラグFalse"""
+    """
+    スポットライトOFF：ユーザフラグFalse & カウント-1（contentuserが無い場合は未スポットライト扱い）
+    ONになっていない場合は何もしない（連打してもカウントがずれない）
+    Returns: ON→OFFに変わったら True、ONでなければ False、DBエラーの場合は None
+    """
     conn = None
     try:
-        conn = get_connection()
+        conn = get_connection(immediate=True)
         with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE content
-                SET spotlightnum = GREATEST(spotlightnum - 1, 0)
-                WHERE contentID = %s;
-            """, (contentID,))
             cur.execute("""
                 UPDATE contentuser
                 SET spotlightflag = FALSE
-                WHERE contentID = %s AND userID = %s;
+                WHERE contentID = %s AND userID = %s AND spotlightflag
+                RETURNING 1;
             """, (contentID, userID))
+            changed = cur.fetchone() is not None
+            if changed:
+                add_spotlight_delta(cur, contentID, -1)
         conn.commit()
         delete_notification_contentuser(contentID,userID)
+        return changed
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print("エラー:", e)
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+#----------------スポットライト数の未反映分を content.spotlightnum へ反映----------------
+def fold_spotlight_counters(limit):
+    """
+    spotlightcounter から最大 limit 件のコンテンツについて全スロットを取り出して削除し、合計を spotlightnum に加算
+    コンテンツのスロットは必ずまとめて反映する（+1 と -1 が別のバッチに分かれると途中の値が負になるため）
+    他のプロセスが実行中の場合は何もしない（content を違う順にロックしてデッドロックしないように）
+    Returns: (取り出したスロット数, 更新したコンテンツ数, 対象のコンテンツ数)。実行しなかった・失敗した場合は None
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (SPOTLIGHT_FOLD_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return None
+            cur.execute("""
+                WITH targets AS (
+                    SELECT DISTINCT contentID
+                      FROM spotlightcounter
+                     ORDER BY contentID
+                     LIMIT %s
+                ), batch AS (
+                    SELECT s.contentID, s.slot
+                      FROM spotlightcounter s
+                      JOIN targets t ON t.contentID = s.contentID
+                     ORDER BY s.contentID, s.slot
+                       FOR UPDATE OF s
+                ), drained AS (
+                    DELETE FROM spotlightcounter s
+                     USING batch b
+                     WHERE s.contentID = b.contentID AND s.slot = b.slot
+                    RETURNING s.contentID, s.delta
+                ), sums AS (
+                    SELECT contentID, SUM(delta) AS delta
+                      FROM drained
+                     GROUP BY contentID
+                ), updated AS (
+                    UPDATE content c
+                       SET spotlightnum = c.spotlightnum + sums.delta
+                      FROM sums
+                     WHERE c.contentID = sums.contentID AND sums.delta <> 0
+                    RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM drained), (SELECT COUNT(*) FROM updated),
+                       (SELECT COUNT(*) FROM targets);
+            """, (limit,))
+            drained, updated, contents = cur.fetchone()
+        conn.commit()
+        return drained, updated, contents
     except psycopg2.Error as e:
         if conn:
             conn.rollback()
+        print("エラー:", e)
+        return None
     finally:
         if conn:
             release_connection(conn)
@@ -82,6 +198,7 @@ def enable_notification(userID):
                 WHERE userID = %s;
             """, (userID,))
         conn.commit()
+        invalidate_user_profile(userID)
     except psycopg2.Error as e:
         pass
     finally:
@@ -102,6 +219,7 @@ def disable_notification(userID):
                 WHERE userID = %s;
             """, (userID,))
         conn.commit()
+        invalidate_user_profile(userID)
     except psycopg2.Error as e:
         pass
     finally:
@@ -111,14 +229,17 @@ def disable_notification(userID):
 
 #実装済み
 #----------------アイコンを変更----------------
-def chenge_icon(userID, iconimgpath):
+def chenge_icon(userID, iconimgpath, iconvariants=False):
+    """アイコンを変更（iconvariants: 縮小版を作成できたか）"""
+    conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
             cur.execute("""
-                UPDATE "user" SET iconimgpath = %s WHERE userID = %s;
-            """, (iconimgpath, userID))
+                UPDATE "user" SET iconimgpath = %s, iconvariants = %s WHERE userID = %s;
+            """, (iconimgpath, bool(iconvariants), userID))
         conn.commit()
+        invalidate_user_profile(userID)
     except psycopg2.Error as e:
         pass
     finally:
@@ -128,6 +249,7 @@ def chenge_icon(userID, iconimgpath):
 
 #----------------再生回数を追加----------------
 def add_playnum(contentID):
+    conn = None
     try:
         conn = get_connection()
         with conn.cursor() as cur:
@@ -181,6 +303,36 @@ def update_content_title_tag(contentID, userID, title=None, tag=None):
             release_connection(conn)
 
 
+#----------------通知を既読にする----------------
+def mark_notifications_read(userID, ts, notificationID):
+    """
+    (通知日時, notificationID) が指定位置以前の未読通知を既読にする
+    （get_notification の read_cursor の位置。それより後に届いた通知は未読のまま）
+    Returns: 既読にした件数（失敗時は None）
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE notification
+                SET isread = TRUE
+                WHERE userID = %s
+                  AND isread = FALSE
+                  AND (COALESCE(notificationtimestamp, TIMESTAMP 'epoch'), notificationID) <= (%s, %s);
+            """, (userID, ts, notificationID))
+            updated = cur.rowcount
+        conn.commit()
+        return updated
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
 #----------------自己紹介文を更新----------------
 def update_bio(userID, bio):
     """自己紹介文を更新"""
@@ -192,6 +344,7 @@ def update_bio(userID, bio):
                 UPDATE "user" SET bio = %s WHERE userID = %s;
             """, (bio if bio else None, userID))
         conn.commit()
+        invalidate_user_profile(userID)
     except psycopg2.Error as e:
         if conn:
             conn.rollback()
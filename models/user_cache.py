@@ -0,0 +1,81 @@
+"""
+ユーザープロフィールのキャッシュ（プロセス内）
+
+ログ出力や通知の送信先の確認のため、ほぼ全てのエンドポイントで "user" を1行読んでいたので、
+userID ごとにプロフィール（username / iconimgpath / admin / bio / token / notificationenabled）を保持する。
+- 上限 USER_CACHE_SIZE 件の LRU、有効期限 USER_CACHE_TTL 秒
+- プロフィールを更新する関数（アイコン・自己紹介・FCMトークン・通知設定・管理者・退会）は
+  このプロセスのキャッシュをその場とCOMMIT後に破棄する
+- 他のワーカープロセスのキャッシュは USER_CACHE_TTL 秒で期限切れになる
+"""
+import os
+
+import psycopg2
+
+from models.db_session import get_connection, release_connection
+from models.process_cache import ProcessCache
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))        # 秒
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))    # ユーザー数
+
+
+def _load_profile(userID):
+    """"user" から1件取得（存在しなければ None、失敗したら False）"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT userID, username, iconimgpath, admin, bio, token, notificationenabled
+                FROM "user"
+                WHERE userID = %s;
+            """, (userID,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return {
+            "userID": row[0],
+            "username": row[1],
+            "iconimgpath": row[2],
+            "admin": row[3],
+            "bio": row[4],
+            "token": row[5],
+            "notificationenabled": row[6],
+        }
+    except psycopg2.Error:
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+# 存在しないユーザー・取得の失敗（_load_profile が None / False）はキャッシュしない
+_cache = ProcessCache(_load_profile, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def get_user_profile(userID):
+    """
+    ユーザーのプロフィールを取得（キャッシュ優先）
+
+    Returns:
+        dict: userID / username / iconimgpath / admin / bio / token / notificationenabled
+              （呼び出し側で変更してよいコピー）。存在しない・取得に失敗した場合は None
+    """
+    if not userID:
+        return None
+    profile = _cache.get(userID)
+    if profile is None:
+        return None
+    return dict(profile)
+
+
+def invalidate_user_profile(*userIDs):
+    """
+    指定ユーザーのキャッシュを破棄（プロフィールの更新時）
+    COMMIT前に他のリクエストが読み込んだ古い値が残らないよう、COMMIT後にもう一度破棄する
+    """
+    _cache.invalidate(userIDs)
+
+
+def get_user_cache_stats():
+    return _cache.stats()
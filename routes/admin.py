@@ -3,7 +3,7 @@
 """
 from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime
-from utils.auth import jwt_required
+from utils.auth import jwt_required, get_jwt_cache_stats
 from models.admin_sql import (
     get_all_user_data, uid_admin_auth, disable_admin, enable_admin, get_reports_data,process_report,unprocess_report,get_content_data
     ,statistics_data,get_users_desc_limit10,get_contents_desc_limit10
@@ -11,7 +11,19 @@ from models.admin_sql import (
 from models.deletedata import (
     delete_content_by_admin,delete_comment
 )
-from utils.s3 import upload_to_s3, get_cloudfront_url, delete_file_from_url, normalize_content_url
+from utils.s3 import upload_to_s3, get_cloudfront_url, delete_file_from_url, normalize_content_url, get_s3_stats
+from models.connection_pool import get_pool_stats
+from utils.notification import get_push_stats
+from utils.s3_delete_queue import get_s3_delete_stats
+from utils.play_buffer import get_play_buffer_stats
+from utils.spotlight_counter import get_spotlight_counter_stats
+from models.blocklist_cache import get_blocklist_cache_stats
+from models.user_cache import get_user_cache_stats
+from utils.content_index import get_content_index_stats
+from utils.rate_limit import get_rate_limit_stats
+from utils.firebase_token import get_firebase_token_stats
+from utils.transcode import get_transcode_stats
+from utils.broadcast import get_broadcast_stats
 
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
@@ -295,8 +307,9 @@ def content_management():
 
 
 from utils.notification import send_push_notification
+from utils.broadcast import start_broadcast
 from models.selectdata import get_user_by_id
-from models.admin_sql import get_all_user_token
+from models.admin_sql import get_broadcast_jobs
 from models.createdata import insert_notification
 #システムからの通知
 @admin_bp.route('/adminnotification', methods=['POST'])
@@ -310,26 +323,14 @@ def admin_send_notification():
             title = data.get("title")
             targetuid = data.get("targetuid")
             if targetuid == "all":
-                users = get_all_user_token()
-                tokens = []
-                for user in users:
-                    token = user.get("token")
-                    enabled = user.get("notificationenabled", True)
-                    if not token or not enabled:
-                        continue
-                    #同一端末に複数アカウントがある場合一度のみプッシュ通知を行う
-                    if not(token in tokens):
-                        send_push_notification(token, title, message)
-                        tokens.append(token)
-                        
-                    insert_notification(
-                        userID=user.get("userID"),
-                        notificationtext=message,
-                        notificationtitle=title
-                    )
+                #全員への送信はバックグラウンドジョブで行い、進捗は /adminnotification/status で確認
+                job_id = start_broadcast(uid, title, message)
+                if job_id is None:
+                    return jsonify({"status": "error", "message": "一斉通知ジョブの登録に失敗しました"}), 400
                 return jsonify({
                     "status": "success",
-                    "message": "通知を送信しました"
+                    "message": "一斉通知を開始しました",
+                    "jobID": job_id
                 }), 200
             else:
                 user = get_user_by_id(targetuid)
@@ -351,6 +352,43 @@ def admin_send_notification():
         return jsonify({"status": "error", "message": str(e)}), 400
 
 
+#一斉通知ジョブの進捗を取得
+@admin_bp.route('/adminnotification/status', methods=['POST'])
+@jwt_required
+def admin_notification_status():
+    try:
+        uid = request.user["firebase_uid"]
+        if uid_admin_auth(uid):
+            data = request.get_json(silent=True) or {}
+            job_id = data.get("jobID")
+            jobs = []
+            for row in get_broadcast_jobs(job_id):
+                jobs.append({
+                    "jobID": row[0],
+                    "adminuserID": row[1],
+                    "title": row[2],
+                    "message": row[3],
+                    "status": row[4],           #queued / running / done / failed
+                    "totaltokens": row[5],      #送信先トークン数（重複除く）
+                    "insertednum": row[6],      #登録した通知履歴の件数
+                    "sentnum": row[7],          #送信成功数
+                    "failednum": row[8],        #送信失敗数
+                    "errormessage": row[9],
+                    "createdtimestamp": row[10].strftime("%Y-%m-%d %H:%M:%S") if row[10] else None,
+                    "finishedtimestamp": row[11].strftime("%Y-%m-%d %H:%M:%S") if row[11] else None,
+                })
+            if job_id is not None and not jobs:
+                return jsonify({"status": "error", "message": "ジョブが見つかりません"}), 400
+            return jsonify({
+                "status": "success",
+                "jobs": jobs
+            }), 200
+        else:
+            return jsonify({"status": "error", "message": "管理者以外からのアクセス"}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
 #統計情報を取得
 @admin_bp.route('/statistics', methods=['POST'])
 @jwt_required
@@ -372,6 +410,36 @@ def get_statistics_api():
         return jsonify({"status": "error", "message": str(e)}), 400
 
 
+#サーバー内部のメトリクスを取得（DB接続プールなど）
+@admin_bp.route('/metrics', methods=['POST'])
+@jwt_required
+def get_metrics_api():
+    try:
+        uid = request.user["firebase_uid"]
+        if uid_admin_auth(uid):
+            return jsonify({
+                "status": "success",
+                "db_pool": get_pool_stats(),
+                "push": get_push_stats(),
+                "s3": get_s3_stats(),
+                "s3_delete_queue": get_s3_delete_stats(),
+                "transcode": get_transcode_stats(),
+                "broadcast": get_broadcast_stats(),
+                "play_buffer": get_play_buffer_stats(),
+                "spotlight_counter": get_spotlight_counter_stats(),
+                "blocklist_cache": get_blocklist_cache_stats(),
+                "user_cache": get_user_cache_stats(),
+                "content_index": get_content_index_stats(),
+                "rate_limit": get_rate_limit_stats(),
+                "jwt_cache": get_jwt_cache_stats(),
+                "firebase_token": get_firebase_token_stats()
+            }), 200
+        else:
+            return jsonify({"status": "error", "message": "管理者以外からのアクセス"}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
 #最新ユーザーを取得
 @admin_bp.route('/getusersdesclimit10', methods=['POST'])
 @jwt_required
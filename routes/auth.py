@@ -3,8 +3,7 @@
 ユーザー登録、ログイン、Google認証など
 """
 from flask import Blueprint, request, jsonify
-from models.create_username import register_username
-from models.selectdata import user_exists, get_user_name_iconpath
+from models.create_username import login_user
 from models.updatedata import update_FMCtoken
 #from utils.auth import generate_jwt_token, verify_google_token
 import jwt
@@ -12,10 +11,9 @@ import datetime
 from functools import wraps
 from dotenv import load_dotenv
 import os
-from firebase_admin import credentials, auth
 from utils.auth import jwt_required
 from utils.s3 import get_cloudfront_url
-from models.updatedata import chenge_icon
+from utils.firebase_token import verify_firebase_id_token
 
 
 # ====== 設定 ======
@@ -39,27 +37,22 @@ def handle_firebase_auth():
         return jsonify({"error": "id_token is required"}), 400
 
     try:
-        # Firebaseトークンを検証（Google/Apple/Twitter すべてOK）
-        decoded_token = auth.verify_id_token(id_token_str)
+        # Firebaseトークンを検証（Google/Apple/Twitter すべてOK。公開鍵はプロセス内にキャッシュ）
+        decoded_token = verify_firebase_id_token(id_token_str)
         firebase_uid = decoded_token["uid"]
 
-        #ユーザが存在するかを確認
-        is_new_user = not user_exists(firebase_uid)
-        if is_new_user:
-            # DBに登録（ユーザ作成 or 更新）
-            token = data.get("token")  # 通知用トークン
-            register_username(firebase_uid, token)
-            filename = "default_icon.png"
-            #デフォルトアイコンを設定
-            iconimgpath = get_cloudfront_url("icon", filename)
-            chenge_icon(firebase_uid, iconimgpath)
+        # ユーザを取得（存在しなければ通知用トークン・デフォルトアイコンで登録）を1回の問い合わせで行う
+        token = data.get("token")  # 通知用トークン
+        iconimgpath = get_cloudfront_url("icon", "default_icon.png")
+        user = login_user(firebase_uid, token, iconimgpath)
+        if user is None:
+            return jsonify({"error": "ユーザー登録に失敗しました"}), 400
+        if user["is_new"]:
             # 新規登録ログ
-            username, _, _, _ = get_user_name_iconpath(firebase_uid)
-            print(f"新規登録:{username}")
+            print(f"新規登録:{user['username']}")
         else:
             # ログインログ
-            username, _, _, _ = get_user_name_iconpath(firebase_uid)
-            print(f"ログイン:{username}")
+            print(f"ログイン:{user['username']}")
 
         # JWT発行
         jwt_token = jwt.encode({
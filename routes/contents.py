@@ -25,6 +25,28 @@ def truncate_title(title, max_length=15):
         return title
     return title[:max_length]
 
+# ========================================
+# ヘルパー関数：contentIDを検証
+# ========================================
+CONTENT_ID_MAX = 2147483647  # content.contentID（INTEGER）の上限
+
+def parse_content_id(value):
+    """
+    リクエストのcontentIDを整数に変換
+    
+    Returns:
+        int: 1〜CONTENT_ID_MAX の整数（数値でない・範囲外の場合は None）
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        contentID = int(value)
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= contentID <= CONTENT_ID_MAX:
+        return None
+    return contentID
+
 # ========================================
 # ヘルパー関数：コンテンツタイプを推測
 # ========================================
@@ -65,26 +87,45 @@ def infer_content_type(contentpath, textflag):
     # デフォルトはテキスト
     return "text"
 
-from models.updatedata import spotlight_on, spotlight_off, add_playnum, update_content_title_tag
+from models.updatedata import spotlight_on, spotlight_off, update_content_title_tag
 from models.selectdata import (
     get_content_detail,get_user_spotlight_flag,get_comments_by_content,get_play_content_id,
     get_search_contents, get_playlists_with_thumbnail, get_playlist_contents, get_user_name_iconpath,
-    get_user_by_content_id, get_user_by_id, get_user_by_parentcomment_id, get_comment_num, get_notified,get_blocked_users
+    get_user_by_content_id, get_user_by_id, get_user_by_parentcomment_id, get_comment_num, get_notified,
+    get_content_id_by_path, decode_search_cursor
 )
 from models.createdata import (
-    add_content_and_link_to_users, insert_comment, insert_playlist, insert_playlist_detail,
-    insert_search_history, insert_play_history, insert_notification
+    add_content_and_link_to_users, add_uploaded_content, insert_comment, insert_playlist, insert_playlist_detail,
+    insert_search_history, insert_notification
 )
 from models.content_get import(
-        update_last_contetid, get_content_random_5, get_content_id_range
+        get_feed_page
 )
+from models.deletedata import enqueue_s3_deletions
+from models.blocklist_cache import get_blocked_user_ids
 from utils.notification import send_push_notification
+from utils.upload import (
+    iter_multipart, open_upload_stream, make_upload_ticket, load_upload_ticket,
+    UPLOAD_MAX_SIZE, UPLOAD_MAX_THUMBNAIL_SIZE
+)
+from itsdangerous import BadSignature
+from models.db_session import release_db_session
+from models.transcode_sql import create_transcode_job
 
 import base64
 import os
 from datetime import datetime
 from flask import current_app
-from utils.s3 import upload_to_s3, get_cloudfront_url, get_content_type_from_extension, normalize_content_url
+from utils.s3 import (
+    upload_to_s3, get_cloudfront_url, get_content_type_from_extension, normalize_content_url, S3StreamingUpload,
+    generate_presigned_put, generate_presigned_multipart, complete_multipart_upload, abort_multipart_upload,
+    head_s3_object, download_from_s3, S3_MULTIPART_PART_SIZE, S3_PRESIGN_EXPIRES
+)
+from utils.images import upload_image_variants, image_variant_urls, IMAGE_VARIANTS_ENABLED
+from utils.play_buffer import record_play
+from utils.transcode import rendition_urls
+from utils.feed_session import make_feed_session, load_feed_session
+from werkzeug.exceptions import RequestEntityTooLarge
 
 
 content_bp = Blueprint('content', __name__, url_prefix='/api/content')
@@ -95,81 +136,117 @@ def clean_base64(b64_string):
     return b64_string
 
 
-import subprocess
-import tempfile
-
-MAX_BITRATE = 6000 * 1000  # 7000kbps = 7,000,000 bps
-
-def get_video_bitrate(file_path):
-    """ffprobeで動画ビットレートを取得"""
-    try:
-        result = subprocess.run(
-            [
-                "ffprobe", "-v", "error", "-select_streams", "v:0",
-                "-show_entries", "stream=bit_rate",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                file_path
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        bitrate = int(result.stdout.strip())
-        return bitrate
-    except:
-        return None
-
-
-def compress_video_if_needed(file_binary, max_bitrate=MAX_BITRATE):
-    """ビットレートが高い場合は7000kbpsに再エンコード"""
-    # 一時ファイル作成
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tmp_in:
-        tmp_in.write(file_binary)
-        input_path = tmp_in.name
-
-    output_path = input_path + "_compressed.mp4"
+# --- フォルダマッピング ---
+CONTENT_SUBDIRS = {
+    "video": "movie",
+    "image": "picture",
+    "audio": "audio",
+    "thumbnail": "thumbnail"
+}
+# --- ファイル拡張子設定 ---
+CONTENT_EXT_MAP = {"video": "mp4", "image": "jpg", "audio": "mp3"}
 
-    # 現在のビットレート取得
-    bitrate = get_video_bitrate(input_path)
-
-    if bitrate and bitrate > max_bitrate:
-
-        # ffmpegで7000kbpsに変換
-        cmd = [
-            "ffmpeg", "-i", input_path,
-            "-b:v", f"{max_bitrate}",
-            "-bufsize", f"{max_bitrate}",
-            "-maxrate", f"{max_bitrate}",
-            "-preset", "medium",
-            output_path
-        ]
-        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-        # 変換後ファイルを読み込み
-        with open(output_path, "rb") as f:
-            new_binary = f.read()
-        # 一時ファイル削除
-        os.remove(input_path)
-        os.remove(output_path)
+def normalize_orientation(content_type, orientation):
+    """orientation を保存用の値に変換（動画のみ portrait / landscape、それ以外は unknown）"""
+    if content_type != "video":
+        return "unknown"  # 画像・音声用デフォルト（DBのorientation NOT NULL対策）
+    orientation_str = str(orientation).strip().lower()
+    if orientation_str in ["portrait", "landscape"]:
+        return orientation_str
+    return "unknown"
 
-        return new_binary  # 変換後バイナリを返す
 
-    # 変換不要なら元のバイナリ返す
-    os.remove(input_path)
-    return file_binary
+def register_media_content(uid, username, content_type, title, link, tag, orientation_value,
+                           content_key, content_filename, thumb_filename, thumb_variants=False, upload_key=None):
+    """
+    S3へのアップロード後、動画・画像・音声の投稿をDBに登録してレスポンスを返す
+    thumb_variants: サムネイルの縮小版を作成できたか
+    upload_key: 署名付きURLでのアップロードの場合のS3キー（同じキーで登録済みならそのコンテンツを返す）
+    """
+    content_folder = CONTENT_SUBDIRS[content_type]
+
+    # --- CloudFront URL生成 ---
+    content_url = get_cloudfront_url(content_folder, content_filename)
+    thumb_url = get_cloudfront_url("thumbnail", thumb_filename)
+
+    # --- DB登録（contentpathはmp4キーを保存） ---
+    contentpath_to_save = content_key if content_type == "video" else content_url
+    if upload_key is None:
+        content_id = add_content_and_link_to_users(
+            contentpath=contentpath_to_save,
+            thumbnailpath=thumb_url,
+            link=link,
+            title=title,
+            userID=uid,
+            tag=tag,
+            orientation=orientation_value,
+            thumbnailvariants=thumb_variants
+        )
+        created = content_id is not None
+    else:
+        content_id, created = add_uploaded_content(
+            upload_key,
+            contentpath=contentpath_to_save,
+            thumbnailpath=thumb_url,
+            link=link,
+            title=title,
+            userID=uid,
+            tag=tag,
+            orientation=orientation_value,
+            thumbnailvariants=thumb_variants
+        )
+    if created:
+        print(f"投稿作成:{username}:\"{truncate_title(title)}\"")
+    if content_type == "video" and created:
+        # ビットレート制限・低解像度版の作成をジョブに登録（完了すると contentpath が差し替わる）
+        create_transcode_job(content_id, content_key)
+    return jsonify({
+        "status": "success",
+        "message": "コンテンツを追加しました。",
+        "data": {
+            "contentID": content_id,
+            "contentpath": contentpath_to_save,
+            "thumbnailpath": thumb_url,
+            "orientation": orientation_value
+        }
+    }), 200
+
+
+def register_text_content(uid, username, title, link, tag, text):
+    """テキスト投稿をDBに登録してレスポンスを返す"""
+    content_id = add_content_and_link_to_users(
+        contentpath=text,
+        link=link,
+        title=title,
+        userID=uid,
+        textflag="TRUE",
+        tag=tag
+    )
+    print(f"投稿作成:{username}:\"{truncate_title(title)}\"")
+    return jsonify({
+        "status": "success",
+        "message": "コンテンツを追加しました。",
+        "data": {
+            "contentID": content_id
+        }
+    }), 200
 
 
 # ===============================
 # 1️⃣ コンテンツ追加（動画・画像・音声に対応）
 # ===============================
 #フロント側ではテキスト投稿以外はfile,thumbnailを指定する。テキスト投稿の場合はtextにデータを含める
+#multipart/form-data で送った場合は add_content_multipart で処理する（ファイルをbase64にしない）
 @content_bp.route("/add", methods=["POST"])
 @jwt_required
 def add_content():
     try:
         uid = request.user["firebase_uid"]
-        data = request.get_json()
         username, iconimgpath, admin, _ = get_user_name_iconpath(uid)
+        if request.mimetype == "multipart/form-data":
+            return add_content_multipart(uid, username)
+        data = request.get_json()
 
         # --- 受信データ ---
         content_type = data.get("type")      # "video" | "image" | "audio" | "text"
@@ -180,135 +257,381 @@ def add_content():
         # デバッグ用のprint文を削除（コスト削減のため）
         if not(tag == None):
             tag = tag.replace("#", "")
-        if content_type != "text":
-
-            file_data = data.get("file")         # base64文字列（コンテンツ本体）
-            thumb_data = data.get("thumbnail")   # base64文字列（サムネイル）
-            file_data = clean_base64(file_data)
-            thumb_data = clean_base64(thumb_data)
-            if not all([content_type, title, file_data, thumb_data]):
-                return jsonify({
-                    "status": "error",
-                    "message": "必要なデータが不足しています"
-                }), 400
-
-            # --- orientationチェック（動画のみ必須、画像/音声はunknown） ---
-            orientation_value = "unknown"  # 画像・音声用デフォルト（DBのorientation NOT NULL対策）
-            if content_type == "video":
-                if orientation is None:
+        if content_type == "text":
+            #--- DB登録(text) ---
+            return register_text_content(uid, username, title, link, tag, data.get("text"))
+
+        file_data = data.get("file")         # base64文字列（コンテンツ本体）
+        thumb_data = data.get("thumbnail")   # base64文字列（サムネイル）
+        file_data = clean_base64(file_data)
+        thumb_data = clean_base64(thumb_data)
+        if not all([content_type, title, file_data, thumb_data]):
+            return jsonify({
+                "status": "error",
+                "message": "必要なデータが不足しています"
+            }), 400
+
+        # --- orientationチェック（動画のみ必須、画像/音声はunknown） ---
+        if content_type == "video" and orientation is None:
+            return jsonify({
+                "status": "error",
+                "message": "orientation が必要です"
+            }), 400
+        orientation_value = normalize_orientation(content_type, orientation)
+
+        # --- ファイル名作成 ---
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        filename_base = f"{username}_{timestamp}"
+        ext = CONTENT_EXT_MAP.get(content_type, "dat")
+
+        # --- ファイル名 ---
+        content_filename = f"{filename_base}.{ext}"
+        thumb_filename = f"{filename_base}_thumb.jpg"
+
+        # --- Base64 → バイナリ変換 ---
+        content_binary = base64.b64decode(file_data)
+        thumb_binary = base64.b64decode(thumb_data)
+        
+        # 動画のビットレート制限・低解像度版の作成は登録後にバックグラウンドで行う（utils/transcode.py）
+
+        # S3へのアップロード中にDBコネクションを占有しないよう返却しておく
+        release_db_session()
+
+        # --- S3にアップロード ---
+        content_folder = CONTENT_SUBDIRS[content_type]
+        content_bucket = None  # デフォルトバケット（spotlight-contents）を使用
+        content_mime = get_content_type_from_extension(content_type, ext)
+        
+        # コンテンツ本体をS3にアップロード
+        content_metadata = None
+        if content_type == "video":
+            content_metadata = {"orientation": orientation_value}
+        content_key = upload_to_s3(
+            file_data=content_binary,
+            folder=content_folder,
+            filename=content_filename,
+            content_type=content_mime,
+            bucket_name=content_bucket,
+            metadata=content_metadata
+        )
+
+        # サムネイルをS3にアップロード（縮小版も隣に保存）
+        thumb_key = upload_to_s3(
+            file_data=thumb_binary,
+            folder="thumbnail",
+            filename=thumb_filename,
+            content_type="image/jpeg"
+        )
+        thumb_variants = bool(upload_image_variants(thumb_binary, thumb_key, "thumbnail"))
+
+        return register_media_content(
+            uid, username, content_type, title, link, tag, orientation_value,
+            content_key, content_filename, thumb_filename, thumb_variants
+        )
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def add_content_multipart(uid, username):
+    """
+    multipart/form-data でのコンテンツ追加
+    file パートはチャンクごとにS3のマルチパートアップロードへ流すので、
+    1リクエストのメモリ使用量はパートサイズ程度に収まる（base64のデコードも不要）。
+    type / title / orientation（動画のみ）は file パートより前に送ること。
+    type を省略した場合は file パートの Content-Type（video/* など）から判定する。
+    """
+    boundary = request.mimetype_params.get("boundary")
+    if not boundary:
+        return jsonify({"status": "error", "message": "boundary が指定されていません"}), 400
+
+    # S3へのアップロード中にDBコネクションを占有しないよう返却しておく
+    release_db_session()
+
+    fields = {}
+    upload = None
+    completed = False
+    content_type = None
+    orientation_value = "unknown"
+    thumb_binary = bytearray()
+
+    # --- ファイル名作成 ---
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    filename_base = f"{username}_{timestamp}"
+    content_filename = None
+    thumb_filename = f"{filename_base}_thumb.jpg"
+
+    try:
+        for event in iter_multipart(open_upload_stream(request.environ), boundary):
+            kind, name = event[0], event[1]
+            if kind == "field":
+                fields[name] = event[2]
+            elif kind == "file_start" and name == "file":
+                if upload is not None:
+                    return jsonify({"status": "error", "message": "file は1つだけ指定してください"}), 400
+                content_type = fields.get("type") or (event[3] or "").split("/")[0]
+                if content_type not in CONTENT_EXT_MAP or not fields.get("title"):
+                    return jsonify({
+                        "status": "error",
+                        "message": "必要なデータが不足しています"
+                    }), 400
+                # --- orientationチェック（動画のみ必須、画像/音声はunknown） ---
+                if content_type == "video" and fields.get("orientation") is None:
                     return jsonify({
                         "status": "error",
                         "message": "orientation が必要です"
                     }), 400
-                orientation_str = str(orientation).strip().lower()
-                if orientation_str in ["portrait", "landscape"]:
-                    orientation_value = orientation_str
-                else:
-                    orientation_value = "unknown"
-
-            # --- フォルダマッピング ---
-            subdirs = {
-                "video": "movie",
-                "image": "picture",
-                "audio": "audio",
-                "thumbnail": "thumbnail"
-            }
+                orientation_value = normalize_orientation(content_type, fields.get("orientation"))
+
+                ext = CONTENT_EXT_MAP[content_type]
+                content_filename = f"{filename_base}.{ext}"
+                upload = S3StreamingUpload(
+                    folder=CONTENT_SUBDIRS[content_type],
+                    filename=content_filename,
+                    content_type=get_content_type_from_extension(content_type, ext),
+                    metadata={"orientation": orientation_value} if content_type == "video" else None
+                )
+            elif kind == "file_data":
+                if name == "file" and upload is not None:
+                    upload.write(event[2])
+                elif name == "thumbnail":
+                    thumb_binary += event[2]
+                    if len(thumb_binary) > UPLOAD_MAX_THUMBNAIL_SIZE:
+                        raise RequestEntityTooLarge("thumbnail が大きすぎます")
+
+        title = fields.get("title")
+        link = fields.get("link")
+        tag = fields.get("tag")
+        if not(tag == None):
+            tag = tag.replace("#", "")
 
-            # --- ファイル名作成 ---
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            filename_base = f"{username}_{timestamp}"
+        if upload is None and fields.get("type") == "text":
+            #--- DB登録(text) ---
+            return register_text_content(uid, username, title, link, tag, fields.get("text"))
 
-            # --- ファイル拡張子設定 ---
-            ext_map = {"video": "mp4", "image": "jpg", "audio": "mp3"}
-            ext = ext_map.get(content_type, "dat")
+        if upload is None or upload.size == 0 or not thumb_binary:
+            return jsonify({
+                "status": "error",
+                "message": "必要なデータが不足しています"
+            }), 400
+
+        content_key = upload.complete()
+        completed = True
+
+        # サムネイルをS3にアップロード（縮小版も隣に保存）
+        thumb_key = upload_to_s3(
+            file_data=bytes(thumb_binary),
+            folder="thumbnail",
+            filename=thumb_filename,
+            content_type="image/jpeg"
+        )
+        thumb_variants = bool(upload_image_variants(bytes(thumb_binary), thumb_key, "thumbnail"))
+    finally:
+        if upload is not None and not completed:
+            upload.abort()
 
-            # --- ファイル名 ---
-            content_filename = f"{filename_base}.{ext}"
-            thumb_filename = f"{filename_base}_thumb.jpg"
+    return register_media_content(
+        uid, username, content_type, title, link, tag, orientation_value,
+        content_key, content_filename, thumb_filename, thumb_variants
+    )
 
-            # --- Base64 → バイナリ変換 ---
-            content_binary = base64.b64decode(file_data)
-            thumb_binary = base64.b64decode(thumb_data)
-            
-            # ★★ 動画の場合はビットレートチェック & 圧縮する
-            # if content_type == "video":
-            #     content_binary = compress_video_if_needed(content_binary)
-
-            # --- S3にアップロード ---
-            content_folder = subdirs[content_type]
-            content_bucket = None  # デフォルトバケット（spotlight-contents）を使用
-            content_mime = get_content_type_from_extension(content_type, ext)
-            
-            # コンテンツ本体をS3にアップロード
-            content_metadata = None
-            if content_type == "video":
-                content_metadata = {"orientation": orientation_value}
-            content_key = upload_to_s3(
-                file_data=content_binary,
-                folder=content_folder,
+
+# マルチパートにするサイズの境目（これ以下は署名付きPUT 1回）
+S3_PRESIGN_MULTIPART_THRESHOLD = int(os.getenv("S3_PRESIGN_MULTIPART_THRESHOLD", str(64 * 1024 * 1024)))
+
+
+# ===============================
+# 1️⃣-2 署名付きURLでS3へ直接アップロード
+# ===============================
+#アップロードはクライアントからS3へ直接行い、アプリサーバーはURL発行と完了確認だけを行う
+#1. /upload/presign でアップロード先のURLとチケットを受け取る
+#2. クライアントが file / thumbnail をそれぞれのURLへPUT
+#3. /upload/complete にチケットと title などを送ると、S3上のファイルを確認してコンテンツを登録
+@content_bp.route("/upload/presign", methods=["POST"])
+@jwt_required
+def presign_upload():
+    try:
+        uid = request.user["firebase_uid"]
+        data = request.get_json() or {}
+        content_type = data.get("type")      # "video" | "image" | "audio"
+        orientation = data.get("orientation")
+        size = data.get("size")              # コンテンツ本体のバイト数（マルチパートの判定に使用）
+
+        if content_type not in CONTENT_EXT_MAP:
+            return jsonify({"status": "error", "message": "type は video / image / audio のいずれかです"}), 400
+        if content_type == "video" and orientation is None:
+            return jsonify({"status": "error", "message": "orientation が必要です"}), 400
+        try:
+            size = int(size) if size is not None else 0
+        except (TypeError, ValueError):
+            return jsonify({"status": "error", "message": "size が不正です"}), 400
+        if size > UPLOAD_MAX_SIZE:
+            return jsonify({"status": "error", "message": "ファイルサイズが上限を超えています"}), 400
+
+        username, _, _, _ = get_user_name_iconpath(uid)
+        orientation_value = normalize_orientation(content_type, orientation)
+
+        # --- ファイル名作成 ---
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        filename_base = f"{username}_{timestamp}"
+        ext = CONTENT_EXT_MAP[content_type]
+        content_filename = f"{filename_base}.{ext}"
+        thumb_filename = f"{filename_base}_thumb.jpg"
+        content_mime = get_content_type_from_extension(content_type, ext)
+        content_metadata = {"orientation": orientation_value} if content_type == "video" else None
+
+        # S3とのやり取りの間DBコネクションを占有しないよう返却しておく
+        release_db_session()
+
+        ticket = {
+            "uid": uid,
+            "type": content_type,
+            "orientation": orientation_value,
+            "file": content_filename,
+            "thumbnail": thumb_filename,
+        }
+        if size > S3_PRESIGN_MULTIPART_THRESHOLD:
+            part_count = -(-size // S3_MULTIPART_PART_SIZE)
+            if part_count > 10000:
+                return jsonify({"status": "error", "message": "ファイルサイズが上限を超えています"}), 400
+            file_upload = generate_presigned_multipart(
+                folder=CONTENT_SUBDIRS[content_type],
                 filename=content_filename,
+                part_count=part_count,
                 content_type=content_mime,
-                bucket_name=content_bucket,
                 metadata=content_metadata
             )
-
-            # サムネイルをS3にアップロード
-            thumb_key = upload_to_s3(
-                file_data=thumb_binary,
-                folder="thumbnail",
-                filename=thumb_filename,
-                content_type="image/jpeg"
-            )
-
-            # --- CloudFront URL生成 ---
-            content_url = get_cloudfront_url(content_folder, content_filename)
-            thumb_url = get_cloudfront_url("thumbnail", thumb_filename)
-
-            # --- DB登録（contentpathはmp4キーを保存） ---
-            contentpath_to_save = content_key if content_type == "video" else content_url
-            content_id = add_content_and_link_to_users(
-                contentpath=contentpath_to_save,
-                thumbnailpath=thumb_url,
-                link=link,
-                title=title,
-                userID=uid,
-                tag=tag,
-                orientation=orientation_value
-            )
-            print(f"投稿作成:{username}:\"{truncate_title(title)}\"")
+            file_upload["partSize"] = S3_MULTIPART_PART_SIZE
+            ticket["uploadId"] = file_upload["uploadId"]
         else:
-            text = data.get("text") 
-            #--- DB登録(text) ---
-            content_id = add_content_and_link_to_users(
-                contentpath=text,
-                link=link,
-                title=title,
-                userID=uid,
-                textflag="TRUE",
-                tag=tag
+            file_upload = generate_presigned_put(
+                folder=CONTENT_SUBDIRS[content_type],
+                filename=content_filename,
+                content_type=content_mime,
+                metadata=content_metadata
             )
-            print(f"投稿作成:{username}:\"{truncate_title(title)}\"")
+        thumb_upload = generate_presigned_put(
+            folder="thumbnail",
+            filename=thumb_filename,
+            content_type="image/jpeg"
+        )
+
+        ticket["key"] = file_upload["key"]
+        ticket["thumbKey"] = thumb_upload["key"]
+
+        return jsonify({
+            "status": "success",
+            "data": {
+                "uploadTicket": make_upload_ticket(ticket),
+                "expiresIn": S3_PRESIGN_EXPIRES,
+                "file": file_upload,
+                "thumbnail": thumb_upload
+            }
+        }), 200
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
 
-        if content_type != "text":
+@content_bp.route("/upload/complete", methods=["POST"])
+@jwt_required
+def complete_upload():
+    try:
+        uid = request.user["firebase_uid"]
+        data = request.get_json() or {}
+        try:
+            # 完了通知はURLの期限切れ直前にPUTし終えた場合も受け付ける
+            ticket = load_upload_ticket(data.get("uploadTicket") or "", max_age=S3_PRESIGN_EXPIRES * 2)
+        except BadSignature:
+            return jsonify({"status": "error", "message": "uploadTicket が無効です"}), 400
+        if ticket.get("uid") != uid:
+            return jsonify({"status": "error", "message": "uploadTicket が無効です"}), 403
+
+        title = data.get("title")
+        link = data.get("link")
+        tag = data.get("tag")
+        if not title:
+            return jsonify({"status": "error", "message": "必要なデータが不足しています"}), 400
+        if not(tag == None):
+            tag = tag.replace("#", "")
+
+        content_type = ticket["type"]
+        content_folder = CONTENT_SUBDIRS[content_type]
+        content_key = ticket["key"]
+        thumb_key = ticket["thumbKey"]
+
+        # 同じチケットで再送された場合は登録済みのコンテンツを返す
+        contentpath = content_key if content_type == "video" else get_cloudfront_url(content_folder, ticket["file"])
+        content_id = get_content_id_by_path(uid, contentpath)
+        if content_id is not None:
             return jsonify({
                 "status": "success",
                 "message": "コンテンツを追加しました。",
                 "data": {
                     "contentID": content_id,
-                    "contentpath": contentpath_to_save,
-                    "thumbnailpath": thumb_url,
-                    "orientation": orientation_value
-                }
-            }), 200
-        else:
-            return jsonify({
-                "status": "success",
-                "message": "コンテンツを追加しました。",
-                "data": {
-                    "contentID": content_id
+                    "contentpath": contentpath,
+                    "thumbnailpath": get_cloudfront_url("thumbnail", ticket["thumbnail"]),
+                    "orientation": ticket["orientation"]
                 }
             }), 200
 
+        # S3とのやり取りの間DBコネクションを占有しないよう返却しておく
+        release_db_session()
+
+        if ticket.get("uploadId"):
+            parts = data.get("parts") or []
+            try:
+                parts = [{"PartNumber": int(p["partNumber"]), "ETag": p["etag"]} for p in parts]
+            except (KeyError, TypeError, ValueError):
+                return jsonify({"status": "error", "message": "parts が不正です"}), 400
+            if not parts:
+                return jsonify({"status": "error", "message": "parts が必要です"}), 400
+            if head_s3_object(content_key) is None:
+                complete_multipart_upload(content_key, ticket["uploadId"], parts)
+
+        # --- S3上のファイルを確認 ---
+        content_head = head_s3_object(content_key)
+        thumb_head = head_s3_object(thumb_key)
+        if not content_head or not thumb_head or content_head["size"] == 0 or thumb_head["size"] == 0:
+            return jsonify({"status": "error", "message": "ファイルのアップロードが完了していません"}), 400
+        if content_head["size"] > UPLOAD_MAX_SIZE or thumb_head["size"] > UPLOAD_MAX_THUMBNAIL_SIZE:
+            # 削除はキューに任せる（S3の削除をリクエスト中に待たない・失敗しても再試行される）
+            enqueue_s3_deletions([content_key, thumb_key])
+            return jsonify({"status": "error", "message": "ファイルサイズが上限を超えています"}), 400
+
+        # サムネイルの縮小版を作成（サムネイルだけはサーバーで読み込む）
+        thumb_variants = False
+        if IMAGE_VARIANTS_ENABLED:
+            thumb_variants = bool(upload_image_variants(download_from_s3(thumb_key), thumb_key, "thumbnail"))
+
+        username, _, _, _ = get_user_name_iconpath(uid)
+        # 同時に送られた完了通知と重なっても、uploadkey で1件だけ登録される
+        return register_media_content(
+            uid, username, content_type, title, link, tag, ticket["orientation"],
+            content_key, ticket["file"], ticket["thumbnail"], thumb_variants, upload_key=content_key
+        )
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@content_bp.route("/upload/abort", methods=["POST"])
+@jwt_required
+def abort_upload():
+    """署名付きマルチパートアップロードを中止（アップロード済みのパートを破棄）"""
+    try:
+        uid = request.user["firebase_uid"]
+        data = request.get_json() or {}
+        try:
+            ticket = load_upload_ticket(data.get("uploadTicket") or "", max_age=S3_PRESIGN_EXPIRES * 2)
+        except BadSignature:
+            return jsonify({"status": "error", "message": "uploadTicket が無効です"}), 400
+        if ticket.get("uid") != uid:
+            return jsonify({"status": "error", "message": "uploadTicket が無効です"}), 403
+        if ticket.get("uploadId"):
+            abort_multipart_upload(ticket["key"], ticket["uploadId"])
+        return jsonify({"status": "success"}), 200
+
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
 
@@ -472,7 +795,9 @@ def content_detail():
                 "spotlightflag": spotlightflag,
                 "textflag":detail[8],
                 "nextcontentid": nextcontentID,
-                "commentnum":commentnum
+                "commentnum":commentnum,
+                # 動画の低解像度版のURL（"720p" などのラベル→URL。無ければ空）
+                "renditions": rendition_urls(detail[10]) if len(detail) > 10 else {}
             }
         }), 200
     except Exception as e:
@@ -493,14 +818,13 @@ def playnum_add_route():
         if not contentID:
             return jsonify({"status": "error", "message": "contentIDが指定されていません"}), 400
         
-        add_playnum(contentID)
-        insert_play_history(userID=uid, contentID=contentID)
-        # 投稿タイトルを取得
-        detail = get_content_detail(contentID)
-        if detail:
-            content_title = detail[0]
-            username, _, _, _ = get_user_name_iconpath(uid)
-            print(f"再生:{username}:\"{truncate_title(content_title)}\"")
+        # 不正なIDをバッファに入れると、まとめて反映する際に他の再生まで失敗させるためここで弾く
+        contentID = parse_content_id(contentID)
+        if contentID is None:
+            return jsonify({"status": "error", "message": "contentIDが不正です"}), 400
+        
+        # 再生回数・再生履歴はバッファにためてまとめて反映（utils/play_buffer.py）
+        record_play(uid, contentID)
         return jsonify({"status": "success", "message": "再生回数を追加"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
@@ -516,7 +840,12 @@ def spotlight_on_route():
         uid = request.user["firebase_uid"]
         data = request.get_json()
         contentID = data.get("contentID")
-        spotlight_on(contentID, uid)
+        changed = spotlight_on(contentID, uid)
+        if changed is None:
+            return jsonify({"status": "error", "message": "スポットライトの更新に失敗しました"}), 500
+        if not changed:
+            # 既にONの場合（連打・再送）はカウントも通知も変えない
+            return jsonify({"status": "success", "message": "スポットライトをONにしました"}), 200
         #投稿元のユーザに通知を送信
         content_user_data = get_user_by_content_id(contentID)
         spotlight_user = get_user_by_id(uid)  # if文の外で定義
@@ -547,7 +876,11 @@ def spotlight_off_route():
         uid = request.user["firebase_uid"]
         data = request.get_json()
         contentID = data.get("contentID")
-        spotlight_off(contentID, uid)
+        changed = spotlight_off(contentID, uid)
+        if changed is None:
+            return jsonify({"status": "error", "message": "スポットライトの更新に失敗しました"}), 500
+        if not changed:
+            return jsonify({"status": "success", "message": "スポットライトをOFFにしました"}), 200
         # 投稿タイトルを取得
         content_user_data = get_user_by_content_id(contentID)
         spotlight_user = get_user_by_id(uid)
@@ -573,10 +906,8 @@ def get_comments():
             return jsonify({"status": "error", "message": "contentIDが指定されていません"}), 400
 
         rows = get_comments_by_content(content_id)
-        blocked_users = get_blocked_users(uid)
-
-        # ブロックしたユーザーのusernameのセットを作成
-        blocked_usernames = {blocked_user[1] for blocked_user in blocked_users} if blocked_users else set()
+        # ブロックしたユーザーのuserIDのセット（キャッシュ）
+        blocked_user_ids = get_blocked_user_ids(uid)
 
         # コメントを辞書リストに変換
         comments = [
@@ -597,9 +928,9 @@ def get_comments():
         blocked_comment_ids = set()
         filtered_comments = []
         
-        for c in comments:
-            # ブロックしたユーザーのコメントを除外
-            if c["username"] in blocked_usernames:
+        for row, c in zip(rows, comments):
+            # ブロックしたユーザーのコメントを除外（usernameは変更されうるのでuserIDで判定）
+            if row[6] in blocked_user_ids:
                 blocked_comment_ids.add(c["commentID"])
                 continue
             filtered_comments.append(c)
@@ -719,17 +1050,22 @@ def serch():
         uid = request.user["firebase_uid"]
         data = request.get_json()
         serchword = data.get("word")
-        #検索履歴を保存
-        insert_search_history(userID=uid,serchword=serchword)
-        username, _, _, _ = get_user_name_iconpath(uid)
-        print(f"検索:{username}:{serchword}")
+        limit = data.get("limit")
+        cursor = data.get("cursor")
+        if cursor and decode_search_cursor(cursor) is None:
+            return jsonify({"status": "error", "message": "cursorが不正です"}), 400
+        #検索履歴を保存（2ページ目以降は保存しない）
+        if not cursor:
+            insert_search_history(userID=uid,serchword=serchword)
+            username, _, _, _ = get_user_name_iconpath(uid)
+            print(f"検索:{username}:{serchword}")
 
         # モデル関数から検索結果を取得
-        rows = get_search_contents(serchword, uid)
+        rows, next_cursor = get_search_contents(serchword, uid, limit=limit, cursor=cursor)
 
         # データが存在しない場合
         if not rows:
-            return jsonify({"status": "success", "message": "該当するコンテンツがありません", "data": []}), 200
+            return jsonify({"status": "success", "message": "該当するコンテンツがありません", "data": [], "nextCursor": None}), 200
 
         # Dartで扱いやすいように整形（視聴履歴APIと同じ形式で posttimestamp を文字列化）
         result = []
@@ -754,128 +1090,13 @@ def serch():
         return jsonify({
             "status": "success",
             "message": f"{len(result)}件のコンテンツが見つかりました。",
-            "data": result
+            "data": result,
+            "nextCursor": next_cursor
         }), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
         
 
-# #コンテンツのランダム取得API
-# @content_bp.route('/getcontents', methods=['POST'])
-# @jwt_required
-# @debounce_request(ttl=2.0)  # 2秒以内の重複リクエストを無視（スクロール中の重複取得を防ぐ）
-# def get_content_random_5():
-#     try:
-#         uid = request.user["firebase_uid"]
-#         data = request.get_json() or {}
-#         # スクロール中の重複取得を防ぐため、既に取得したコンテンツIDを除外
-#         exclude_content_ids = data.get("excludeContentIDs", [])
-        
-#         rows = get_recent_history_ids(uid, exclude_content_ids=exclude_content_ids)
-#         lastcontentid = None
-#         # Dartで扱いやすいように整形
-#         result = []
-#         # 既に取得したcontentIDを追跡（重複防止用）
-#         fetched_content_ids = set()
-
-#         for row in rows:
-#             content_id = row[13]
-#             # 重複チェック
-#             if content_id in fetched_content_ids:
-#                 continue
-#             fetched_content_ids.add(content_id)
-            
-#             # DBから取得したパスをCloudFront URLに正規化
-#             contentpath = normalize_content_url(row[1]) if row[1] else None
-#             thumbnailpath = normalize_content_url(row[10]) if len(row) > 10 and row[10] else None
-#             iconimgpath = normalize_content_url(row[8]) if len(row) > 8 and row[8] else None
-#             result.append({
-#                 "title": row[0],
-#                 "contentpath": contentpath,
-#                 "thumbnailpath": thumbnailpath,
-#                 "spotlightnum": row[2],
-#                 "posttimestamp": row[3].isoformat(),
-#                 "playnum": row[4],
-#                 "link": row[5],
-#                 "username": row[6],
-#                 "user_id": row[7],  # userIDを追加
-#                 "iconimgpath": iconimgpath,
-#                 "spotlightflag": row[11],
-#                 "textflag":row[9],
-#                 "commentnum":row[12],
-#                 "contentID":row[13]
-#             })
-#             lastcontentid = row[13]
-#         # printtext = "ランダム取得したコンテンツ"
-#         # for i in range(len(result)):
-#         #     printtext += str(result[i]["contentID"]) + ":" +str(result[i]["title"]) +","
-#         # print(printtext)
-
-#         resultnum = len(result)
-#         shortagenum = 5 - resultnum
-#         # 不足分がある場合、既に取得したcontentIDを除外して追加取得
-#         while shortagenum > 0:
-#             rows2 = get_history_ran(uid, limitnum=shortagenum, exclude_content_ids=list(fetched_content_ids))
-#             if not rows2:
-#                 # これ以上取得できるコンテンツがない場合
-#                 break
-            
-#             for row in rows2:
-#                 content_id = row[13]
-#                 # 重複チェック（念のため）
-#                 if content_id in fetched_content_ids:
-#                     continue
-#                 fetched_content_ids.add(content_id)
-                
-#                 # DBから取得したパスをCloudFront URLに正規化
-#                 contentpath = normalize_content_url(row[1]) if row[1] else None
-#                 thumbnailpath = normalize_content_url(row[10]) if len(row) > 10 and row[10] else None
-#                 iconimgpath = normalize_content_url(row[8]) if len(row) > 8 and row[8] else None
-                
-#                 # コンテンツタイプを推測
-#                 content_type = infer_content_type(contentpath, row[9])
-                
-#                 result.append({
-#                     "title": row[0],
-#                     "contentpath": contentpath,
-#                     "thumbnailpath": thumbnailpath,
-#                     "type": content_type,
-#                     "spotlightnum": row[2],
-#                     "posttimestamp": row[3].isoformat(),
-#                     "playnum": row[4],
-#                     "link": row[5],
-#                     "username": row[6],
-#                     "user_id": row[7],  # userIDを追加
-#                     "iconimgpath": iconimgpath,
-#                     "spotlightflag": row[11],
-#                     "textflag":row[9],
-#                     "commentnum":row[12],
-#                     "contentID":row[13]
-#                 })
-#                 lastcontentid = row[13]
-#                 shortagenum -= 1
-
-#                 # 5件取得できたら終了
-#                 if len(result) >= 5:
-#                     break
-#             # デバッグ用のprint文を削除（コスト削減のため）
-#             # 5件取得できたか、これ以上取得できない場合は終了
-#             if len(result) >= 5 or not rows2:
-#                 break
-        
-#         if lastcontentid:
-#             update_last_contetid(uid, lastcontentid)
-
-#         return jsonify({
-#             "status": "success",
-#             "message": f"{len(result)}件のコンテンツを取得",
-#             "data": result
-#         }), 200
-#     except Exception as e:
-#         return jsonify({"status": "error", "message": str(e)}), 400
-
-
-
 
 
 # ========================================
@@ -886,34 +1107,31 @@ def serch():
 @debounce_request(ttl=0.3)  # 3秒以内の重複リクエストを無視（スクロール中の重複取得を防ぐ）
 def get_content_random_api():
     """
-    完全ランダムで3件取得（重複なし、ループ対応）
-    最後まで行ったら最初に戻る
+    ユーザごとのシャッフル順で3件取得（重複なし、ループ対応）
+    サーバー側のフィードカーソルを進め、最後まで行ったら新しい順序で最初に戻る
     """
     try:
         uid = request.user["firebase_uid"]
         data = request.get_json() or {}
-        exclude_content_ids = data.get("excludeContentIDs", [])  # フロントから除外IDリストを受け取る
+        # 前回のレスポンスの feedSession があれば、取得済みかどうかはサーバー側のカーソルで判定する
+        session_epoch = load_feed_session(data.get("feedSession"), uid)
+        if session_epoch is None:
+            # feedSession を送らない旧クライアントは除外IDリストを受け取る（新しい方から上限件数まで）
+            exclude_content_ids = data.get("excludeContentIDs", [])
+        else:
+            exclude_content_ids = None
         
-        # ランダムで3件取得
-        rows = get_content_random_5(uid, exclude_content_ids=exclude_content_ids)
+        # フィードカーソルを進めて3件取得（一周した場合は is_looped=True）
+        # 最後のcontentIDの更新・ログ用のusernameの取得も同じ問い合わせで行う
+        rows, is_looped, username, epoch = get_feed_page(
+            uid, get_blocked_user_ids(uid), exclude_content_ids=exclude_content_ids
+        )
+        if session_epoch is not None and epoch is not None and epoch != session_epoch:
+            # 前回の取得以降に（別の端末などで）一周している
+            is_looped = True
         
         result = []
-        fetched_content_ids = set()
-        min_content_id = None
-        max_content_id = None
-        
         for row in rows:
-            content_id = row[13]
-            if content_id in fetched_content_ids:
-                continue
-            fetched_content_ids.add(content_id)
-            
-            # 最小・最大IDを記録（ループ判定用）
-            if min_content_id is None or content_id < min_content_id:
-                min_content_id = content_id
-            if max_content_id is None or content_id > max_content_id:
-                max_content_id = content_id
-            
             # DBから取得したパスをCloudFront URLに正規化
             contentpath = normalize_content_url(row[1]) if row[1] else None
             thumbnailpath = normalize_content_url(row[10]) if len(row) > 10 and row[10] else None
@@ -937,70 +1155,23 @@ def get_content_random_api():
                 "spotlightflag": row[11],
                 "textflag": row[9],
                 "commentnum": row[12],
-                "contentID": row[13]
+                "contentID": row[13],
+                # 縮小版のURL（サイズ→URL）。表示サイズに合ったものを使う
+                "thumbnailpaths": image_variant_urls(thumbnailpath, "thumbnail", row[15]),
+                "iconimgpaths": image_variant_urls(iconimgpath, "icon", row[16]),
+                # 動画の低解像度版のURL（"720p" などのラベル→URL。無ければ空）
+                "renditions": rendition_urls(row[14])
             })
         
-        # 不足分がある場合、ループして最初から取得
-        if len(result) < 3:
-            # 既に取得したIDを除外して追加取得
-            additional_exclude = list(fetched_content_ids) + exclude_content_ids
-            additional_rows = get_content_random_5(uid, exclude_content_ids=additional_exclude)
-            
-            for row in additional_rows:
-                if len(result) >= 3:
-                    break
-                content_id = row[13]
-                if content_id in fetched_content_ids:
-                    continue
-                fetched_content_ids.add(content_id)
-                
-                contentpath = normalize_content_url(row[1]) if row[1] else None
-                thumbnailpath = normalize_content_url(row[10]) if len(row) > 10 and row[10] else None
-                iconimgpath = normalize_content_url(row[8]) if len(row) > 8 and row[8] else None
-                
-                # コンテンツタイプを推測
-                content_type = infer_content_type(contentpath, row[9])
-                
-                result.append({
-                    "title": row[0],
-                    "contentpath": contentpath,
-                    "thumbnailpath": thumbnailpath,
-                    "type": content_type,
-                    "spotlightnum": row[2],
-                    "posttimestamp": row[3].isoformat(),
-                    "playnum": row[4],
-                    "link": row[5],
-                    "username": row[6],
-                    "user_id": row[7],
-                    "iconimgpath": iconimgpath,
-                    "spotlightflag": row[11],
-                    "textflag": row[9],
-                    "commentnum": row[12],
-                    "contentID": row[13]
-                })
-        
-        # 最後のcontentIDを更新（ループ判定用）
-        if result:
-            last_content_id = result[-1]["contentID"]
-            update_last_contetid(uid, last_content_id)
-            
-            # ループ判定：取得可能なコンテンツ数と比較
-            from models.content_get import get_content_id_range
-            min_id, max_id, total_count = get_content_id_range(uid)
-            # 取得件数が少ない場合、または取得したIDが範囲外の場合はループした可能性
-            is_looped = (total_count > 0 and len(result) < 3) or \
-                       (min_id is not None and last_content_id < min_id) or \
-                       (max_id is not None and last_content_id > max_id)
-        
         # 投稿一覧取得ログ（デバウンス確認用：実際に処理されたリクエストのみログ出力）
-        username, _, _, _ = get_user_name_iconpath(uid)
         print(f"投稿一覧取得:{username}")
         
         return jsonify({
             "status": "success",
             "message": f"{len(result)}件のコンテンツを取得",
             "data": result,
-            "isLooped": is_looped if result else False
+            "isLooped": is_looped,
+            "feedSession": make_feed_session(uid, epoch) if epoch is not None else None
         }), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
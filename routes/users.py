@@ -7,17 +7,19 @@ from utils.auth import jwt_required
 from models.selectdata import (
     get_user_name_iconpath,get_search_history,get_user_contents,get_spotlight_contents,
     get_play_history,get_user_spotlightnum,get_notification,get_unloaded_num,get_spotlight_num,
+    decode_notification_cursor, NOTIFICATION_PAGE_SIZE,
     get_spotlight_num_by_username, get_user_contents_by_username, get_bio_by_username, get_user_by_content_id,
     get_blocked_users, get_achievements_value
 )
-from models.deletedata import delete_user_account
-from models.updatedata import enable_notification, disable_notification,chenge_icon, update_bio
+from models.deletedata import delete_user_account, enqueue_s3_deletions
+from models.updatedata import enable_notification, disable_notification,chenge_icon, update_bio, mark_notifications_read
 from models.createdata import (
     add_content_and_link_to_users, insert_comment, insert_playlist, insert_playlist_detail,
     insert_search_history, insert_play_history, insert_notification, insert_report,
     insert_block, delete_block
 )
-from utils.s3 import upload_to_s3, get_cloudfront_url, delete_file_from_url, normalize_content_url
+from utils.s3 import upload_to_s3, get_cloudfront_url, normalize_content_url
+from utils.images import upload_image_variants, image_variant_urls
 import os
 import re
 import base64
@@ -360,11 +362,8 @@ def change_icon():
                 is_default_icon = filename == "default_icon.png" or old_icon_key == "icon/default_icon.png"
             
             if not is_default_icon:
-                try:
-                    delete_file_from_url(old_icon_url)
-                except Exception as e:
-                    # S3削除エラーは無視（ファイルが既に存在しない場合など）
-                    pass
+                # S3の削除はキューに登録してバックグラウンドで行う
+                enqueue_s3_deletions([old_icon_url])
         
         # fileが空文字列、None、または空の場合はデフォルトアイコンに設定
         if file and file.strip() and file != "default_icon.jpg":
@@ -378,12 +377,14 @@ def change_icon():
             filename = f"{username}_{timestamp}_icon.png"
             
             # ===== S3にアップロード（既存ファイルがある場合は上書き） =====
-            upload_to_s3(
+            icon_key = upload_to_s3(
                 file_data=icon_binary,
                 folder="icon",
                 filename=filename,
                 content_type="image/png"
             )
+            # 一覧表示用の縮小版（48 / 96 / 192）も隣に保存
+            iconvariants = bool(upload_image_variants(icon_binary, icon_key, "icon"))
             
             # ===== CloudFront URL生成 =====
             iconimgpath = get_cloudfront_url("icon", filename)
@@ -391,9 +392,10 @@ def change_icon():
             # デフォルトアイコンの場合（fileが空、None、またはdefault_icon.jpgの場合）
             filename = "default_icon.png"
             iconimgpath = get_cloudfront_url("icon", filename)
+            iconvariants = False
 
         # ===== DBにCloudFront URLを保存 =====
-        chenge_icon(uid, iconimgpath)
+        chenge_icon(uid, iconimgpath, iconvariants)
         print(f"アイコン変更:{username}")
         return jsonify({
             "status": "success",
@@ -408,13 +410,41 @@ def change_icon():
         }), 400
 
 
-#通知一覧の取得処理
+# システム通知のアイコン
+DEFAULT_NOTIFICATION_ICON = "https://d30se1secd7t6t.cloudfront.net/icon/default_icon.png"
+
+#通知一覧の取得処理（既読にはしない。既読は /notification/read）
+#cursor も limit も送らない旧クライアントには、これまで通り全件を返して全件を既読にする
 @users_bp.route('/notification', methods=['POST'])
 @jwt_required
 def get_notification_api():
     try:
         uid = request.user["firebase_uid"]
-        rows = get_notification(uid)
+        data = request.get_json(silent=True) or {}
+        limit = data.get("limit")
+        cursor = data.get("cursor")
+        if limit is not None:
+            if isinstance(limit, bool):
+                return jsonify({"status": "error", "message": "limitが不正です"}), 400
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                return jsonify({"status": "error", "message": "limitが不正です"}), 400
+            if limit < 1:
+                return jsonify({"status": "error", "message": "limitが不正です"}), 400
+        if cursor and decode_notification_cursor(cursor) is None:
+            return jsonify({"status": "error", "message": "cursorが不正です"}), 400
+
+        if limit is None and cursor is None:
+            rows, next_cursor, read_cursor = get_notification(uid, limit=None)
+            if read_cursor:
+                # 返した通知までを既読にする（取得後に届いた通知は未読のまま）
+                mark_notifications_read(uid, *decode_notification_cursor(read_cursor))
+                read_cursor = None
+        else:
+            rows, next_cursor, read_cursor = get_notification(
+                uid, limit=limit or NOTIFICATION_PAGE_SIZE, cursor=cursor
+            )
 
         notification_list = []
         for row in rows:
@@ -437,7 +467,12 @@ def get_notification_api():
                 spotlight_thumbnailpath,
                 comment_thumbnailpath,
                 spotlight_iconimgpath,
-                comment_iconimgpath
+                comment_iconimgpath,
+                _,
+                spotlight_thumbnailvariants,
+                comment_thumbnailvariants,
+                spotlight_iconvariants,
+                comment_iconvariants
             ) = row
 
             # 日付フォーマット
@@ -445,7 +480,11 @@ def get_notification_api():
                 timestamp.strftime("%Y-%m-%d %H:%M:%S") if timestamp else None
             )
 
-            # 通知タイプ判定
+            # 通知タイプ判定（いずれにも当てはまらない通知は本文なしのシステム通知として返す）
+            nt_type = "system"
+            contenttitle = title = text = thumbnailpath = contentID = None
+            iconpath = DEFAULT_NOTIFICATION_ICON
+            thumbnailvariants = iconvariants = False
             if contentuserCID:  # スポットライト通知
                 contenttitle = spotlight_title
                 title = "スポットライトが当てられました"
@@ -453,16 +492,13 @@ def get_notification_api():
                 nt_type = "spotlight"
                 iconpath = spotlight_iconimgpath
                 thumbnailpath = spotlight_thumbnailpath
+                iconvariants = spotlight_iconvariants
+                thumbnailvariants = spotlight_thumbnailvariants
                 contentID = contentuserCID
             #システム通知等のカスタム可能な通知
             elif notificationtext:
-                nt_type = "system"
-                contenttitle = None
                 title = notificationtitle
                 text = notificationtext
-                thumbnailpath = None
-                iconpath = "https://d30se1secd7t6t.cloudfront.net/icon/default_icon.png"
-                contentID = None
             elif comCTID:  # コメント通知
                 contenttitle = comment_content_title
                 if parentcommentID:
@@ -475,10 +511,11 @@ def get_notification_api():
                     title = "新しいコメント"
                 iconpath = comment_iconimgpath
                 thumbnailpath = comment_thumbnailpath
+                iconvariants = comment_iconvariants
+                thumbnailvariants = comment_thumbnailvariants
                 contentID = comCTID
 
             # アイコンパスとサムネイルパスをCloudFront URLに正規化
-            from utils.s3 import normalize_content_url
             normalized_iconpath = normalize_content_url(iconpath) if iconpath else None
             normalized_thumbnailpath = normalize_content_url(thumbnailpath) if thumbnailpath else None
             
@@ -490,13 +527,41 @@ def get_notification_api():
                 "contenttitle":contenttitle,
                 "iconpath":normalized_iconpath,
                 "thumbnailpath":normalized_thumbnailpath,
+                "iconpaths":image_variant_urls(normalized_iconpath, "icon", iconvariants),
+                "thumbnailpaths":image_variant_urls(normalized_thumbnailpath, "thumbnail", thumbnailvariants),
                 "contentID":contentID,
                 "timestamp": timestamp_str,
                 "isread":isread,
                 
             })
 
-        return jsonify({"status": "success", "data": notification_list}), 200
+        return jsonify({
+            "status": "success",
+            "data": notification_list,
+            "nextCursor": next_cursor,
+            "readCursor": read_cursor
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+#通知を既読にする（readCursor までの通知）
+@users_bp.route('/notification/read', methods=['POST'])
+@jwt_required
+def read_notification_api():
+    try:
+        uid = request.user["firebase_uid"]
+        data = request.get_json(silent=True) or {}
+        decoded = decode_notification_cursor(data.get("readCursor"))
+        if decoded is None:
+            return jsonify({"status": "error", "message": "readCursorが不正です"}), 400
+        updated = mark_notifications_read(uid, *decoded)
+        if updated is None:
+            return jsonify({"status": "error", "message": "既読にできませんでした"}), 400
+        return jsonify({"status": "success", "updated": updated}), 200
 
     except Exception as e:
         return jsonify({
@@ -0,0 +1,57 @@
+"""
+utils/s3.py の S3ClientManager のメトリクス
+botocore（client.py:_make_api_call）と同じ引数でイベントを発火して確認する
+"""
+from botocore.exceptions import EndpointConnectionError
+
+from utils.s3 import S3ClientManager
+
+
+def _client(manager):
+    return manager.get_client("ap-northeast-1", "test-access-key", "test-secret-key")
+
+
+def _operation(client, name):
+    return client.meta.service_model.operation_model(name)
+
+
+def test_after_call_error_counts_transport_error():
+    manager = S3ClientManager()
+    client = _client(manager)
+    events = client.meta.events
+    context = {}
+
+    events.emit(
+        "before-call.s3.PutObject",
+        model=_operation(client, "PutObject"),
+        params={},
+        request_signer=None,
+        context=context,
+    )
+    # 通信エラー時、botocore は exception と context だけを渡す
+    events.emit(
+        "after-call-error.s3.PutObject",
+        exception=EndpointConnectionError(endpoint_url="https://s3.example.invalid"),
+        context=context,
+    )
+
+    stat = manager.stats()["operations"]["PutObject"]
+    assert stat["calls"] == 1
+    assert stat["errors"] == 1
+
+
+def test_after_call_counts_http_status():
+    manager = S3ClientManager()
+    client = _client(manager)
+    events = client.meta.events
+
+    for status in (200, 503):
+        context = {}
+        model = _operation(client, "HeadObject")
+        events.emit("before-call.s3.HeadObject", model=model, params={}, request_signer=None, context=context)
+        response = type("Response", (), {"status_code": status})()
+        events.emit("after-call.s3.HeadObject", http_response=response, parsed={}, model=model, context=context)
+
+    stat = manager.stats()["operations"]["HeadObject"]
+    assert stat["calls"] == 2
+    assert stat["errors"] == 1
@@ -0,0 +1,63 @@
+"""
+utils/s3.py の署名付きURLでの直接アップロード（/api/content/upload/presign・complete で使う処理）
+moto のS3に対して、発行したURLへのPUT・マルチパートの完了・HEADでの確認を行う
+"""
+import pytest
+import requests
+from moto import mock_aws
+
+from utils.s3 import (
+    generate_presigned_put, generate_presigned_multipart, complete_multipart_upload, head_s3_object,
+    get_s3_client, S3_MULTIPART_PART_SIZE
+)
+
+BUCKET = "spotlight-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test-access-key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test-secret-key")
+    monkeypatch.setenv("S3_REGION", "ap-northeast-1")
+    monkeypatch.setenv("S3_BUCKET_NAME", BUCKET)
+    with mock_aws():
+        client = get_s3_client()
+        client.create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"}
+        )
+        yield client
+
+
+def test_presigned_put_and_head(s3):
+    upload = generate_presigned_put(
+        "movie", "user_20250101000000.mp4", content_type="video/mp4", metadata={"orientation": "portrait"}
+    )
+    assert upload["key"] == "movie/user_20250101000000.mp4"
+    assert head_s3_object(upload["key"]) is None
+
+    response = requests.put(upload["url"], data=b"video-bytes", headers=upload["headers"])
+    assert response.status_code == 200
+
+    head = head_s3_object(upload["key"])
+    assert head["size"] == len(b"video-bytes")
+    assert head["content_type"] == "video/mp4"
+    assert head["metadata"] == {"orientation": "portrait"}
+
+
+def test_presigned_multipart_complete(s3):
+    upload = generate_presigned_multipart("movie", "user_20250101000001.mp4", 2, content_type="video/mp4")
+    assert [p["partNumber"] for p in upload["parts"]] == [1, 2]
+
+    bodies = [b"a" * S3_MULTIPART_PART_SIZE, b"b" * 10]
+    parts = []
+    # 完了時にはパート番号順に並べ直す
+    for part, body in reversed(list(zip(upload["parts"], bodies))):
+        response = requests.put(part["url"], data=body)
+        assert response.status_code == 200
+        parts.append({"PartNumber": part["partNumber"], "ETag": response.headers["ETag"]})
+    assert head_s3_object(upload["key"]) is None
+
+    complete_multipart_upload(upload["key"], upload["uploadId"], parts)
+
+    head = head_s3_object(upload["key"])
+    assert head["size"] == sum(len(body) for body in bodies)
@@ -0,0 +1,87 @@
+"""
+バックグラウンドの定期実行タスク
+
+gunicorn のワーカーごとにデーモンスレッドを1本起動し、interval 秒ごとに処理を実行する。
+- fork前に起動したスレッドは子プロセスに引き継がれないため、ensure_started() をリクエストごとに呼んで
+  プロセスが変わっていれば起動し直す
+- 処理が True を返した場合（まだ残りがある場合）は待たずに続けて実行する
+"""
+import os
+import threading
+import time
+
+
+class PeriodicTask:
+    """interval 秒ごとに func を実行するスレッド"""
+
+    def __init__(self, name, interval, func, app=None):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.app = app              # 指定するとアプリケーションコンテキスト内で実行する
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "errors": 0, "last_run_ms": 0.0, "last_error": None}
+
+    def ensure_started(self):
+        """このプロセスでスレッドが動いていなければ起動"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """次の実行を待たずにすぐ実行させる"""
+        self._wakeup.set()
+
+    def run_once(self):
+        """1回実行。まだ残りがあれば True"""
+        start = time.monotonic()
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    more = self.func()
+            else:
+                more = self.func()
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["last_run_ms"] = round((time.monotonic() - start) * 1000, 3)
+            return bool(more)
+        except Exception as e:
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(e)
+            print(f"❌ バックグラウンド処理失敗:{self.name}: {e}")
+            return False
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self.run_once():
+                continue
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["running"] = self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        stats["interval"] = self.interval
+        return stats
@@ -0,0 +1,91 @@
+"""
+管理者からの一斉通知（バックグラウンドジョブ）
+
+リクエストではジョブを登録してすぐに jobID を返し、送信はスレッドで行う。
+1. 通知履歴を INSERT ... SELECT 1回で全員分登録
+2. 送信先トークンをサーバーサイドカーソルで500件ずつ（トークン順に）読み、multicast でまとめて送信
+3. バッチごとに broadcastjob の進捗・送信済みの最後のトークン・heartbeattimestamp を更新
+   （/api/admin/adminnotification/status で確認）
+再起動などで送信中のスレッドが止まった場合は、heartbeattimestamp が BROADCAST_STALE_SECONDS 秒
+更新されていないジョブを各ワーカープロセスのバックグラウンドスレッドが引き取り、続きから送信する。
+"""
+import atexit
+import os
+import threading
+
+from models.admin_sql import (
+    create_broadcast_job, update_broadcast_job, count_broadcast_tokens,
+    insert_broadcast_notifications, iter_broadcast_tokens, claim_stale_broadcast_jobs
+)
+from models.db_session import commit_db_session
+from utils.background import PeriodicTask
+from utils.notification import get_dispatcher
+
+BROADCAST_BATCH_SIZE = 500
+BROADCAST_RECLAIM_INTERVAL = float(os.getenv("BROADCAST_RECLAIM_INTERVAL", "60"))   # 止まったジョブを確認する間隔（秒）
+
+_task = None
+
+
+def start_broadcast(adminuserID, title, message):
+    """一斉通知ジョブを登録してスレッドで開始。jobID を返す（登録失敗時は None）"""
+    job_id = create_broadcast_job(adminuserID, title, message)
+    if job_id is None:
+        return None
+    # ジョブの行をスレッド側から更新できるよう、ここで確定させておく
+    commit_db_session()
+    t = threading.Thread(
+        target=run_broadcast, args=(job_id, title, message), name=f"broadcast-{job_id}", daemon=True
+    )
+    t.start()
+    return job_id
+
+
+def run_broadcast(job_id, title, message, lasttoken=None, sent=0, failed=0):
+    """一斉通知ジョブ本体（引き取ったジョブは lasttoken より後のトークンから、件数を引き継いで送信）"""
+    try:
+        update_broadcast_job(job_id, status="running", totaltokens=count_broadcast_tokens())
+
+        inserted = insert_broadcast_notifications(job_id, title, message)
+        if inserted is None:
+            raise Exception("通知履歴の登録に失敗しました")
+
+        dispatcher = get_dispatcher()
+        for tokens in iter_broadcast_tokens(BROADCAST_BATCH_SIZE, after=lasttoken):
+            s, f = dispatcher.send_batch(tokens, title, message)
+            sent += s
+            failed += f
+            update_broadcast_job(job_id, sentnum=sent, failednum=failed, lasttoken=tokens[-1])
+
+        update_broadcast_job(job_id, status="done", finished=True)
+        print(f"一斉通知:job{job_id}:成功{sent}件:失敗{failed}件")
+    except Exception as e:
+        print(f"❌ 一斉通知失敗:job{job_id}: {e}")
+        update_broadcast_job(job_id, status="failed", errormessage=str(e), finished=True)
+
+
+def reclaim_broadcast_jobs():
+    """止まったジョブを1件引き取って続きから送信。引き取った（まだ残っていそう）なら True"""
+    rows = claim_stale_broadcast_jobs(1)
+    for job_id, title, message, lasttoken, sent, failed in rows:
+        print(f"一斉通知再開:job{job_id}")
+        run_broadcast(job_id, title, message, lasttoken=lasttoken, sent=sent, failed=failed)
+    return bool(rows)
+
+
+def init_broadcast(app):
+    """止まったジョブを引き取るワーカーを登録（gunicornのfork後に各プロセスで起動されるよう、リクエスト時に起動を確認する）"""
+    global _task
+    _task = PeriodicTask("broadcast-reclaim", BROADCAST_RECLAIM_INTERVAL, reclaim_broadcast_jobs, app=app)
+    atexit.register(_task.stop)
+
+    @app.before_request
+    def _start_broadcast_reclaim():
+        _task.ensure_started()
+
+
+def get_broadcast_stats():
+    """引き取りワーカーのメトリクスを取得（未起動ならNone）"""
+    if _task is None:
+        return None
+    return _task.stats()
@@ -0,0 +1,228 @@
+"""
+フィード対象コンテンツのインデックス（ワーカーごとのメモリ上）
+
+フィードの対象（テキスト投稿以外の、削除されていない投稿）を contentID で引ける配列で持ち、
+候補の絞り込み（対象外・ブロックしたユーザーの投稿の除外）をDBに問い合わせずに行う。
+DBから詳細を取得するのは選んだcontentIDだけになる（models/content_get.py:get_feed_page）。
+- _creators[contentID] = 投稿者の番号（対象外なら -1）。投稿者の userID は _users[番号]
+- 起動後の最初のリクエストでバックグラウンドスレッドを起動し、専用コネクションで LISTEN してから全件を読み込む
+- 以降は content の変更通知（migrations/012_content_index_notify.sql）で差分だけ更新する
+- 接続が切れた場合は再接続して全件を読み込み直す。CONTENT_INDEX_RELOAD_INTERVAL ごとにも読み込み直す
+- 読み込みが終わるまで（ready でない間）は、これまで通りDBで絞り込む
+"""
+import atexit
+import os
+import select
+import threading
+import time
+from array import array
+
+import psycopg2
+
+from models.connection_pool import open_dedicated_connection
+from utils.background import PeriodicTask
+
+CONTENT_INDEX_ENABLED = os.getenv("CONTENT_INDEX_ENABLED", "True") == "True"
+CONTENT_INDEX_RELOAD_INTERVAL = float(os.getenv("CONTENT_INDEX_RELOAD_INTERVAL", "3600"))   # 秒
+CONTENT_INDEX_CHANNEL = "content_index"
+# 通知を待つ1回あたりの秒数（この間隔で停止・再読み込みを確認する）
+_LISTEN_TIMEOUT = 5.0
+# 接続に失敗した場合に再接続するまでの秒数
+_RETRY_INTERVAL = 10.0
+
+
+class ContentIndex:
+    """フィード対象の contentID → 投稿者 の配列"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._creators = array("i")
+        self._users = []            # 番号 → userID
+        self._user_ord = {}         # userID → 番号
+        self._count = 0
+        self.ready = False
+        self.loaded_at = None
+        self._stats = {"loads": 0, "events": 0, "last_load_ms": 0.0}
+
+    def _ordinal(self, userID):
+        ordinal = self._user_ord.get(userID)
+        if ordinal is None:
+            ordinal = len(self._users)
+            self._users.append(userID)
+            self._user_ord[userID] = ordinal
+        return ordinal
+
+    def _grow(self, contentID):
+        if contentID >= len(self._creators):
+            # 投稿が増えるたびに作り直さないよう、余裕を持って伸ばす
+            size = max(contentID + 1, len(self._creators) * 5 // 4 + 1024)
+            self._creators.extend([-1] * (size - len(self._creators)))
+
+    def load(self, rows, elapsed_ms=0.0):
+        """全件を読み込み直す rows: [(contentID, userID), ...]"""
+        creators = array("i")
+        users, user_ord = [], {}
+        max_id = max((row[0] for row in rows), default=0)
+        creators.extend([-1] * (max_id + 1024))
+        for contentID, userID in rows:
+            ordinal = user_ord.get(userID)
+            if ordinal is None:
+                ordinal = len(users)
+                users.append(userID)
+                user_ord[userID] = ordinal
+            creators[contentID] = ordinal
+        with self._lock:
+            self._creators, self._users, self._user_ord = creators, users, user_ord
+            self._count = len(rows)
+            self.ready = True
+            self.loaded_at = time.time()
+            self._stats["loads"] += 1
+            self._stats["last_load_ms"] = round(elapsed_ms, 3)
+
+    def add(self, contentID, userID):
+        with self._lock:
+            self._grow(contentID)
+            if self._creators[contentID] < 0:
+                self._count += 1
+            self._creators[contentID] = self._ordinal(userID)
+            self._stats["events"] += 1
+
+    def remove(self, contentID):
+        with self._lock:
+            if contentID < len(self._creators) and self._creators[contentID] >= 0:
+                self._creators[contentID] = -1
+                self._count -= 1
+            self._stats["events"] += 1
+
+    def blocked_ordinals(self, userIDs):
+        """userID の集合を投稿者の番号の集合にする（visible に渡す用）"""
+        with self._lock:
+            return {self._user_ord[u] for u in userIDs if u in self._user_ord}
+
+    def visible(self, contentID, blocked_ordinals):
+        """フィードの対象で、かつブロックしたユーザーの投稿でないか"""
+        creators = self._creators
+        if contentID <= 0 or contentID >= len(creators):
+            return False
+        ordinal = creators[contentID]
+        return ordinal >= 0 and ordinal not in blocked_ordinals
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["ready"] = self.ready
+            stats["contents"] = self._count
+            stats["users"] = len(self._users)
+            stats["capacity"] = len(self._creators)
+            stats["memory_bytes"] = self._creators.buffer_info()[1] * self._creators.itemsize
+        return stats
+
+
+content_index = ContentIndex()
+
+
+class _Listener:
+    """専用コネクションで LISTEN して content_index を更新する"""
+
+    def __init__(self, index):
+        self.index = index
+        self._conn = None
+        self._pid = None
+        self._reconnects = 0
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _connect_and_load(self):
+        """LISTEN してから全件を読み込む（読み込み中の変更は後から届く通知で反映される）"""
+        start = time.monotonic()
+        conn = open_dedicated_connection()
+        # LISTEN・読み込みに失敗した場合も listen_once の _close() で閉じられるよう先に保持する
+        self._conn = conn
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CONTENT_INDEX_CHANNEL};")
+            cur.execute("""
+                SELECT contentID, userID
+                FROM content
+                WHERE textflag = FALSE OR textflag IS NULL;
+            """)
+            rows = cur.fetchall()
+        self.index.load(rows, (time.monotonic() - start) * 1000)
+
+    def _apply(self, payload):
+        parts = payload.split(" ", 2)
+        if parts[0] == "A" and len(parts) == 3:
+            self.index.add(int(parts[1]), parts[2])
+        elif parts[0] == "D" and len(parts) >= 2:
+            self.index.remove(int(parts[1]))
+
+    def listen_once(self):
+        """通知を最大 _LISTEN_TIMEOUT 秒待って反映。続けて呼んでほしいので True を返す"""
+        try:
+            if self._pid != os.getpid():
+                # fork前のプロセスのコネクションは閉じずに手放す（閉じると親プロセス側が切断される）
+                self._conn = None
+                self._pid = os.getpid()
+            loaded_at = self.index.loaded_at or 0
+            if self._conn is None or self._conn.closed or time.time() - loaded_at > CONTENT_INDEX_RELOAD_INTERVAL:
+                if self._conn is not None:
+                    self._reconnects += 1
+                self._close()
+                self._connect_and_load()
+            if select.select([self._conn], [], [], _LISTEN_TIMEOUT) != ([], [], []):
+                self._conn.poll()
+                while self._conn.notifies:
+                    self._apply(self._conn.notifies.pop(0).payload)
+            return True
+        except (psycopg2.Error, OSError):
+            # 切断された間の通知は届かないので、再接続して全件を読み込み直すまではDBで絞り込む
+            self.index.ready = False
+            self._close()
+            raise
+
+    def stop(self):
+        self._close()
+
+
+_listener = _Listener(content_index)
+_task = None
+
+
+def _shutdown():
+    if _task is not None:
+        _task.stop(timeout=_LISTEN_TIMEOUT + 1)
+    _listener.stop()
+
+
+def init_content_index(app):
+    """インデックスの更新スレッドを登録（gunicornのfork後に各プロセスで起動されるよう、リクエスト時に起動を確認する）"""
+    global _task
+    if not CONTENT_INDEX_ENABLED:
+        return
+    _task = PeriodicTask("content-index", _RETRY_INTERVAL, _listener.listen_once, app=app)
+    atexit.register(_shutdown)
+
+    @app.before_request
+    def _start_content_index():
+        _task.ensure_started()
+
+
+def get_content_index():
+    """読み込み済みならインデックス、まだなら None（DBで絞り込む）"""
+    return content_index if content_index.ready else None
+
+
+def get_content_index_stats():
+    """インデックスのメトリクスを取得（無効ならNone）"""
+    if _task is None:
+        return None
+    stats = content_index.stats()
+    stats["task"] = _task.stats()
+    stats["reconnects"] = _listener._reconnects
+    return stats
@@ -0,0 +1,89 @@
+"""
+FCM（firebase_admin.messaging）のローカル代替
+
+ネットワークに出ずに send / send_each / send_each_for_multicast の応答を返す。
+通知ディスパッチャのスループット計測や開発環境での動作確認に使う（PUSH_USE_STUB=True）。
+
+- 1回のAPI呼び出しごとに latency 秒 + 1件あたり per_message_latency 秒待つ
+- unregistered_prefix で始まるトークンは UnregisteredError を返す
+- transient_failure_rate の確率で UnavailableError を返す（再送の確認用）
+"""
+from firebase_admin import messaging
+from firebase_admin import exceptions as firebase_exceptions
+import itertools
+import random
+import threading
+import time
+
+
+class StubSendResponse:
+    """messaging.SendResponse と同じ属性を持つ応答"""
+
+    def __init__(self, message_id=None, exception=None):
+        self.message_id = message_id
+        self.exception = exception
+
+    @property
+    def success(self):
+        return self.exception is None
+
+
+class StubBatchResponse:
+    """messaging.BatchResponse と同じ属性を持つ応答"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.success_count = sum(1 for r in responses if r.success)
+        self.failure_count = len(responses) - self.success_count
+
+
+class StubMessaging:
+    """firebase_admin.messaging の送信APIの代替"""
+
+    def __init__(self, latency=0.05, per_message_latency=0.0002, unregistered_prefix="unregistered",
+                 transient_failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.per_message_latency = per_message_latency
+        self.unregistered_prefix = unregistered_prefix
+        self.transient_failure_rate = transient_failure_rate
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.messages = 0
+
+    def _deliver(self, token):
+        with self._lock:
+            self.messages += 1
+            failed = self._random.random() < self.transient_failure_rate
+            message_id = f"projects/stub/messages/{next(self._ids)}"
+        if token.startswith(self.unregistered_prefix):
+            return StubSendResponse(exception=messaging.UnregisteredError("Requested entity was not found."))
+        if failed:
+            return StubSendResponse(exception=firebase_exceptions.UnavailableError("The service is currently unavailable."))
+        return StubSendResponse(message_id=message_id)
+
+    def _wait(self, count):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self.per_message_latency * count)
+
+    def send(self, message, dry_run=False, app=None):
+        self._wait(1)
+        response = self._deliver(message.token)
+        if response.exception:
+            raise response.exception
+        return response.message_id
+
+    def send_each(self, messages, dry_run=False, app=None):
+        if len(messages) > 500:
+            raise ValueError("messages must not contain more than 500 elements.")
+        self._wait(len(messages))
+        return StubBatchResponse([self._deliver(m.token) for m in messages])
+
+    def send_each_for_multicast(self, multicast_message, dry_run=False, app=None):
+        tokens = multicast_message.tokens
+        if len(tokens) > 500:
+            raise ValueError("tokens must not contain more than 500 elements.")
+        self._wait(len(tokens))
+        return StubBatchResponse([self._deliver(t) for t in tokens])
@@ -0,0 +1,38 @@
+"""
+ランダムフィードのセッショントークン（feedSession）
+
+どの投稿を返したかはサーバー側のフィードカーソル（feedcursor）が覚えているので、
+同じエポック（一周）の間は重複しない。クライアントは取得済みIDの一覧（excludeContentIDs）の代わりに
+前回のレスポンスの feedSession を送ればよい。
+- トークンには userID とエポックを署名して入れる（FEED_SESSION_TTL 秒で期限切れ）
+- 受け取ったトークンのエポックが現在のエポックと違う場合は、別の端末などで一周したとみなす
+"""
+import os
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+FEED_SESSION_TTL = int(os.getenv("FEED_SESSION_TTL", str(24 * 3600)))
+FEED_SESSION_SALT = "feed-session"
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=FEED_SESSION_SALT)
+
+
+def make_feed_session(uid, epoch):
+    """レスポンスで返す feedSession を作成"""
+    return _serializer().dumps({"uid": uid, "epoch": epoch})
+
+
+def load_feed_session(token, uid):
+    """feedSession を検証してエポックを返す（不正・期限切れ・別ユーザーのものは None）"""
+    if not token or not isinstance(token, str):
+        return None
+    try:
+        payload = _serializer().loads(token, max_age=FEED_SESSION_TTL)
+    except BadSignature:
+        return None
+    if payload.get("uid") != uid:
+        return None
+    return payload.get("epoch")
@@ -0,0 +1,53 @@
+"""
+フィード用の擬似ランダム置換
+ユーザ・エポックごとのシードから [0, size) の並べ替えを作り、
+全件をソートせずに i 番目の要素を O(1) で求める
+"""
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(x):
+    """splitmix64 の最終ミキサー（ラウンド関数用）"""
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class FeedPermutation:
+    """
+    Feistel ネットワーク + cycle-walking による [0, size) の置換
+
+    Args:
+        seed: ユーザ・エポックごとのシード（整数）
+        size: 置換する範囲の大きさ
+    """
+    ROUNDS = 4
+
+    def __init__(self, seed, size):
+        self.size = max(int(size), 0)
+        bits = max((self.size - 1).bit_length(), 2)
+        if bits % 2:
+            bits += 1
+        self._half_bits = bits // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._keys = [_mix64((int(seed) + r * 0x9E3779B97F4A7C15) & _MASK64) for r in range(self.ROUNDS)]
+
+    def _encrypt(self, x):
+        left = x >> self._half_bits
+        right = x & self._half_mask
+        for key in self._keys:
+            left, right = right, left ^ (_mix64(right ^ key) & self._half_mask)
+        return (left << self._half_bits) | right
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.size:
+            raise IndexError(index)
+        # 定義域（2の偶数乗）は size の高々4倍なので、平均数回で範囲内に戻る
+        x = self._encrypt(index)
+        while x >= self.size:
+            x = self._encrypt(x)
+        return x
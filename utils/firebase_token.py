@@ -0,0 +1,167 @@
+"""
+Firebase IDトークンの検証（プロセス内）
+
+ログインのたびに firebase_admin の verify_id_token を呼ぶ代わりに、Googleの公開鍵（JWK）を
+プロセス内にキャッシュしてPyJWTで署名・クレームを検証する。
+- 公開鍵はレスポンスの Cache-Control（max-age − Age）の間キャッシュし、期限が切れたら取り直す
+- 知らない kid のトークンが来た場合は、鍵が更新された可能性があるので取り直す（_MIN_REFRESH_INTERVAL 秒に1回まで）
+- 公開鍵を取得できない・プロジェクトIDが分からない場合は firebase_admin の verify_id_token で検証する
+"""
+import os
+import re
+import threading
+import time
+
+import jwt
+import requests
+from firebase_admin import auth
+
+FIREBASE_JWKS_URL = "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+# Cache-Control が無い場合のキャッシュ秒数
+_DEFAULT_MAX_AGE = 3600
+_MIN_REFRESH_INTERVAL = 60
+_FETCH_TIMEOUT = 5
+# 発行時刻などの時計のずれの許容（秒）
+_CLOCK_SKEW = 60
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class _KeyCache:
+    """kid → 公開鍵"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 取得は1スレッドずつ（通信中も _lock は持たないので、有効な鍵の参照は待たされない）
+        self._fetch_lock = threading.Lock()
+        self._generation = 0
+        self._keys = {}
+        self._expires = 0.0
+        self._fetched_at = 0.0
+        self._stats = {"fetches": 0, "fetch_errors": 0}
+
+    def _fetch(self):
+        response = requests.get(FIREBASE_JWKS_URL, timeout=_FETCH_TIMEOUT)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            if jwk.get("kid"):
+                keys[jwk["kid"]] = jwt.PyJWK(jwk, algorithm="RS256").key
+        match = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else _DEFAULT_MAX_AGE
+        age = response.headers.get("Age", "0")
+        max_age -= int(age) if age.isdigit() else 0
+        return keys, max(max_age, _MIN_REFRESH_INTERVAL)
+
+    def get(self, kid):
+        """kid の公開鍵（無ければ None）。取得に失敗した場合は例外を送出"""
+        now = time.monotonic()
+        with self._lock:
+            key = self._keys.get(kid)
+            if key is not None and now < self._expires:
+                return key
+            # 期限切れ、または知らない kid（鍵の更新直後）の場合に取り直す
+            if now < self._expires and now - self._fetched_at < _MIN_REFRESH_INTERVAL:
+                return None
+            generation = self._generation
+        with self._fetch_lock:
+            with self._lock:
+                if self._generation != generation:
+                    # 待っている間に他のスレッドが取り直した
+                    return self._keys.get(kid)
+            try:
+                keys, max_age = self._fetch()
+            except Exception:
+                with self._lock:
+                    self._stats["fetch_errors"] += 1
+                raise
+            fetched_at = time.monotonic()
+            with self._lock:
+                self._stats["fetches"] += 1
+                self._keys = keys
+                self._fetched_at = fetched_at
+                self._expires = fetched_at + max_age
+                self._generation += 1
+            return keys.get(kid)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._keys)
+            stats["expires_in"] = round(max(self._expires - time.monotonic(), 0), 1)
+        return stats
+
+
+_keys = _KeyCache()
+_lock = threading.Lock()
+_stats = {"local": 0, "fallback": 0}
+
+
+def _project_id():
+    if FIREBASE_PROJECT_ID:
+        return FIREBASE_PROJECT_ID
+    try:
+        import firebase_admin
+        return firebase_admin.get_app().project_id
+    except Exception:
+        return None
+
+
+def _verify_locally(id_token, project_id):
+    """署名とクレームを検証。検証できない（鍵が取れない）場合は LookupError"""
+    try:
+        kid = jwt.get_unverified_header(id_token).get("kid")
+    except jwt.InvalidTokenError as e:
+        raise auth.InvalidIdTokenError(str(e)) from e
+    try:
+        key = _keys.get(kid)
+    except Exception as e:
+        raise LookupError(str(e)) from e
+    if key is None:
+        raise auth.InvalidIdTokenError("Firebase ID token has an unknown kid")
+    try:
+        claims = jwt.decode(
+            id_token, key, algorithms=["RS256"],
+            audience=project_id,
+            issuer=f"https://securetoken.google.com/{project_id}",
+            leeway=_CLOCK_SKEW,
+            options={"require": ["exp", "iat", "sub"]},
+        )
+    except jwt.ExpiredSignatureError as e:
+        raise auth.ExpiredIdTokenError(str(e), e) from e
+    except jwt.InvalidTokenError as e:
+        raise auth.InvalidIdTokenError(str(e)) from e
+    sub = claims.get("sub")
+    if not isinstance(sub, str) or not sub or len(sub) > 128:
+        raise auth.InvalidIdTokenError("Firebase ID token has an invalid subject")
+    if claims.get("auth_time", 0) > time.time() + _CLOCK_SKEW:
+        raise auth.InvalidIdTokenError("Firebase ID token has an invalid auth_time")
+    claims["uid"] = sub
+    return claims
+
+
+def verify_firebase_id_token(id_token):
+    """
+    Firebase IDトークンを検証してクレームを返す（auth.verify_id_token と同じく "uid" を含む）
+    不正・期限切れのトークンは firebase_admin と同じ例外を送出する
+    """
+    project_id = _project_id()
+    if project_id:
+        try:
+            claims = _verify_locally(id_token, project_id)
+            with _lock:
+                _stats["local"] += 1
+            return claims
+        except LookupError:
+            pass
+    with _lock:
+        _stats["fallback"] += 1
+    return auth.verify_id_token(id_token)
+
+
+def get_firebase_token_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats["keys"] = _keys.stats()
+    return stats
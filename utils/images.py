@@ -0,0 +1,123 @@
+"""
+サムネイル・アイコンの縮小版
+
+アップロードされた画像から決まったサイズの縮小版を作り、元画像と同じフォルダに保存する。
+キーは元画像から決まるので（thumbnail/xxx_thumb.jpg → thumbnail/xxx_thumb_320.webp）、
+DBには作成できたかどうか（content.thumbnailvariants / "user".iconvariants）だけを保存し、レスポンスでURLを組み立てる。
+作成していない画像（デフォルトアイコン・作成に失敗した画像など）は、全サイズとも元画像のURLを返す。
+- サムネイル: 幅 160 / 320 / 640（縦横比はそのまま、元より大きくはしない）
+- アイコン  : 48 / 96 / 192 の正方形（中央で切り抜き）
+Pillow が入っていない環境では縮小版を作らない。
+既存の画像は migrations/009_backfill_image_derivatives.py で作成する。
+"""
+import io
+import os
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow なし
+    Image = None
+
+from utils.s3 import upload_to_s3
+
+THUMBNAIL_SIZES = (160, 320, 640)
+ICON_SIZES = (48, 96, 192)
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_VARIANTS_ENABLED = Image is not None and os.getenv("IMAGE_VARIANTS_ENABLED", "True") == "True"
+
+# WebP に対応していない Pillow では JPEG にする（キーが変わるので全サーバーで揃えること）
+if Image is not None and features.check("webp"):
+    VARIANT_FORMAT, VARIANT_EXT, VARIANT_MIME = "WEBP", "webp", "image/webp"
+else:
+    VARIANT_FORMAT, VARIANT_EXT, VARIANT_MIME = "JPEG", "jpg", "image/jpeg"
+
+_SIZES = {"thumbnail": THUMBNAIL_SIZES, "icon": ICON_SIZES}
+
+
+def variant_key(key, size):
+    """元画像のキー（またはURL）から縮小版のキー（URL）を作る"""
+    head, _, filename = key.rpartition("/")
+    stem = filename.rsplit(".", 1)[0]
+    return f"{head}/{stem}_{size}.{VARIANT_EXT}" if head else f"{stem}_{size}.{VARIANT_EXT}"
+
+
+def variant_keys(key):
+    """元画像のキーに対応する縮小版のキー一覧（thumbnail / icon 以外は空）"""
+    folder = key.split("/", 1)[0]
+    return [variant_key(key, size) for size in _SIZES.get(folder, ())]
+
+
+def image_variant_urls(url, kind, generated):
+    """
+    レスポンス用に縮小版のURLを返す
+
+    Args:
+        url: 正規化済みのCloudFront URL
+        kind: "thumbnail" | "icon"
+        generated: 縮小版を作成済みか（content.thumbnailvariants / "user".iconvariants）
+
+    Returns:
+        dict: {"160": URL, "320": URL, ...}。縮小版が無い場合は全サイズとも元画像のURL、画像が無い場合はNone
+    """
+    if not url or not isinstance(url, str):
+        return None
+    if not generated or not url.startswith(("http://", "https://")) or f"/{kind}/" not in url:
+        return {str(size): url for size in _SIZES[kind]}
+    return {str(size): variant_key(url, size) for size in _SIZES[kind]}
+
+
+def make_image_variants(data, kind):
+    """
+    画像の縮小版を作成
+
+    Returns:
+        list: [(サイズ, バイナリ), ...]
+    """
+    image = Image.open(io.BytesIO(data))
+    # JPEG は縮小を前提にデコードすると速い
+    largest = max(_SIZES[kind])
+    image.draft("RGB", (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    keep_alpha = VARIANT_FORMAT == "WEBP" and image.mode in ("RGBA", "LA", "P")
+    image = image.convert("RGBA" if keep_alpha else "RGB")
+
+    variants = []
+    for size in _SIZES[kind]:
+        if kind == "icon":
+            resized = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        else:
+            if image.width > size:
+                resized = image.resize((size, max(1, round(image.height * size / image.width))), Image.LANCZOS)
+            else:
+                resized = image
+        buf = io.BytesIO()
+        resized.save(buf, VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY)
+        variants.append((size, buf.getvalue()))
+    return variants
+
+
+def upload_image_variants(data, key, kind):
+    """
+    縮小版を作成して元画像の隣に保存
+    失敗しても元画像のアップロードは成功扱いにするため、例外は出さない
+
+    Returns:
+        list: 保存した縮小版のキー（全サイズ保存できた場合だけ。失敗した場合は空）
+    """
+    if not IMAGE_VARIANTS_ENABLED or not data or not key:
+        return []
+    try:
+        keys = []
+        folder = key.split("/", 1)[0]
+        for size, body in make_image_variants(data, kind):
+            filename = variant_key(key, size).split("/", 1)[1]
+            keys.append(upload_to_s3(
+                file_data=body,
+                folder=folder,
+                filename=filename,
+                content_type=VARIANT_MIME
+            ))
+        return keys
+    except Exception as e:
+        print(f"❌ 縮小版の作成に失敗: {key}: {e}")
+        return []
@@ -1,24 +1,307 @@
 from firebase_admin import messaging
+from firebase_admin import exceptions as firebase_exceptions
+from collections import namedtuple
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+
+# ========================================
+# プッシュ通知の非同期送信
+# ========================================
+# リクエスト処理中は送信キューに積むだけにして、FCMへの送信はワーカースレッドがまとめて行う。
+# - キューから最大 PUSH_BATCH_SIZE 件（FCMの上限は500件）をまとめて send_each / send_each_for_multicast で送信
+# - 一時的なエラー（UNAVAILABLE / INTERNAL / クォータ超過など）は指数バックオフで再送
+# - 未登録（アンインストール済みなど）と報告されたトークンはDBから削除
+# PUSH_USE_STUB=True にするとFCMの代わりに utils/fcm_stub.py を使う（オフラインでの計測用）
+
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", "2"))
+PUSH_QUEUE_MAX = int(os.getenv("PUSH_QUEUE_MAX", "10000"))
+PUSH_BATCH_SIZE = min(int(os.getenv("PUSH_BATCH_SIZE", "500")), 500)
+PUSH_LINGER = float(os.getenv("PUSH_LINGER", "0.05"))          # バッチが埋まるのを待つ最大秒数
+PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", "3"))
+PUSH_BACKOFF = float(os.getenv("PUSH_BACKOFF", "0.5"))         # 初回再送までの秒数（以降2倍ずつ）
+PUSH_USE_STUB = os.getenv("PUSH_USE_STUB", "False") == "True"
+
+# 再送しても成功しないトークン（DBから削除する）
+UNREGISTERED_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+# 時間をおけば成功する可能性があるエラー
+RETRYABLE_ERRORS = (
+    firebase_exceptions.UnavailableError,
+    firebase_exceptions.InternalError,
+    firebase_exceptions.DeadlineExceededError,
+    firebase_exceptions.ResourceExhaustedError,
+)
+
+PushItem = namedtuple("PushItem", ["token", "title", "body", "data"])
+
+
+def _clear_unregistered_tokens(tokens):
+    """未登録トークンをDBから削除（ワーカースレッドから呼ばれる）"""
+    from models.updatedata import clear_fcm_tokens
+    clear_fcm_tokens(tokens)
+
+
+class NotificationDispatcher:
+    """送信キューとワーカースレッドプール"""
+
+    def __init__(self, sender=None, workers=PUSH_WORKERS, maxsize=PUSH_QUEUE_MAX, batch_size=PUSH_BATCH_SIZE,
+                 linger=PUSH_LINGER, max_retries=PUSH_MAX_RETRIES, backoff=PUSH_BACKOFF,
+                 on_unregistered=_clear_unregistered_tokens):
+        self.sender = sender or messaging
+        self.workers = workers
+        self.batch_size = min(batch_size, 500)
+        self.linger = linger
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_unregistered = on_unregistered
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "unregistered": 0,
+            "batches": 0,
+            "api_calls": 0,
+            "api_time": 0.0,
+        }
+
+    def _count(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self._stats[key] += value
+
+    def start(self):
+        """ワーカースレッドを起動（gunicornのfork後に各プロセスで起動されるよう、初回送信時に呼ぶ）"""
+        with self._start_lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"push-dispatcher-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def enqueue(self, token, title, body, data=None):
+        """送信キューに積む。キューが満杯なら破棄して False を返す"""
+        if not token:
+            return False
+        if self._pid != os.getpid() or not self._threads:
+            self.start()
+        try:
+            self._queue.put_nowait(PushItem(token, title, body, {k: str(v) for k, v in (data or {}).items()}))
+        except queue.Full:
+            self._count(dropped=1)
+            print(f"❌ 通知キューが満杯のため破棄: {repr(token)}")
+            return False
+        self._count(enqueued=1)
+        return True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                self._count(failed=len(batch))
+                print(f"❌ 通知送信失敗Failed to send push notification batch: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send_batch(self, batch):
+        """バッチを送信し、一時的なエラーの分だけバックオフして再送。(成功数, 失敗数) を返す"""
+        self._count(batches=1)
+        sent = failed = 0
+        pending = batch
+        attempt = 0
+        while pending:
+            retry = []
+            unregistered = []
+            for group in self._group(pending):
+                for item, exc in zip(group, self._send_group(group)):
+                    if exc is None:
+                        sent += 1
+                    elif isinstance(exc, UNREGISTERED_ERRORS):
+                        unregistered.append(item.token)
+                    elif isinstance(exc, RETRYABLE_ERRORS):
+                        retry.append(item)
+                    else:
+                        failed += 1
+                        print(f"❌ 通知送信失敗Failed to send push notification: {exc}")
+            if unregistered:
+                failed += len(unregistered)
+                self._count(unregistered=len(unregistered))
+                if self.on_unregistered:
+                    try:
+                        self.on_unregistered(list(set(unregistered)))
+                    except Exception as e:
+                        print(f"❌ 無効トークンの削除に失敗: {e}")
+            if not retry:
+                break
+            attempt += 1
+            if attempt > self.max_retries:
+                failed += len(retry)
+                break
+            self._count(retried=len(retry))
+            delay = self.backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.5)
+            if self._stopping.wait(delay):
+                failed += len(retry)
+                break
+            pending = retry
+        self._count(sent=sent, failed=failed)
+        return sent, failed
+
+    def send_batch(self, tokens, title, body, data=None):
+        """
+        同じ内容の通知を呼び出し元のスレッドでまとめて送信（一斉通知用）
+        キューを経由しないので、大量送信でもキューの上限に影響しない。(成功数, 失敗数) を返す
+        """
+        data = {k: str(v) for k, v in (data or {}).items()}
+        sent = failed = 0
+        for i in range(0, len(tokens), self.batch_size):
+            items = [PushItem(token, title, body, data) for token in tokens[i:i + self.batch_size]]
+            s, f = self._send_batch(items)
+            sent += s
+            failed += f
+        return sent, failed
+
+    def _group(self, items):
+        """同じ内容の通知は multicast にまとめ、それ以外は send_each 用に1グループにまとめる"""
+        same_payload = {}
+        for item in items:
+            key = (item.title, item.body, tuple(sorted(item.data.items())))
+            same_payload.setdefault(key, []).append(item)
+        singles = []
+        for group in same_payload.values():
+            if len(group) > 1:
+                yield group
+            else:
+                singles.extend(group)
+        if singles:
+            yield singles
+
+    def _send_group(self, group):
+        """1回のAPI呼び出しで送信し、各通知の例外（成功ならNone）を返す"""
+        first = group[0]
+        start = time.monotonic()
+        try:
+            if len(group) > 1 and all(
+                (i.title, i.body, i.data) == (first.title, first.body, first.data) for i in group
+            ):
+                response = self.sender.send_each_for_multicast(messaging.MulticastMessage(
+                    tokens=[i.token for i in group],
+                    notification=messaging.Notification(title=first.title, body=first.body),
+                    data=first.data,
+                ))
+            else:
+                response = self.sender.send_each([
+                    messaging.Message(
+                        notification=messaging.Notification(title=i.title, body=i.body),
+                        token=i.token,
+                        data=i.data,
+                    )
+                    for i in group
+                ])
+            return [None if r.success else r.exception for r in response.responses]
+        except Exception as e:
+            # 呼び出し自体の失敗（通信エラーなど）はグループ全体に同じ例外を返す
+            return [e] * len(group)
+        finally:
+            self._count(api_calls=1, api_time=time.monotonic() - start)
+
+    def flush(self, timeout=None):
+        """キューが空になるまで待つ。timeout 内に空になれば True"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout=5.0):
+        """残りを送信してからワーカーを止める"""
+        if self._threads and self._pid == os.getpid():
+            self.flush(timeout)
+        self._stopping.set()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        api_time = stats.pop("api_time")
+        stats["queue_depth"] = self._queue.qsize()
+        stats["workers"] = len(self._threads)
+        stats["avg_batch_size"] = round(stats["sent"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["api_avg_ms"] = round(api_time / stats["api_calls"] * 1000, 3) if stats["api_calls"] else 0.0
+        return stats
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """プロセス共通のディスパッチャを取得"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                sender = None
+                if PUSH_USE_STUB:
+                    from utils.fcm_stub import StubMessaging
+                    sender = StubMessaging()
+                _dispatcher = NotificationDispatcher(sender=sender)
+                atexit.register(_dispatcher.stop)
+    return _dispatcher
+
+
+def get_push_stats():
+    """送信キューのメトリクスを取得（未使用ならNone）"""
+    if _dispatcher is None:
+        return None
+    return _dispatcher.stats()
+
 
 def send_push_notification(token: str, title: str, body: str, data: dict = None):
     """
     FCMトークンに対してプッシュ通知を送信する関数
+    送信キューに積むだけで、実際の送信はワーカースレッドが行う（積めたら True）
     """
     try:
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            token=token,
-            data=data or {},  # 任意の追加データ
-        )
-
-        response = messaging.send(message)
-        #print(f"📩通知送信できてる！！！！！！！！ Push Notification Sent! Response ID: {response}")
-        return response
-
+        return get_dispatcher().enqueue(token, title, body, data)
     except Exception as e:
         print(f"❌ 通知送信失敗Failed to send push notification: {e}")
         print("Token received:", repr(token))
-        return None
\ No newline at end of file
+        return False
@@ -0,0 +1,192 @@
+"""
+再生回数・再生履歴の書き込みバッファ
+
+/api/content/playnum のたびに content の同じ行を UPDATE すると、再生の多い投稿で行ロックの待ちが発生する。
+再生イベントはプロセス内のバッファに溜め、PLAY_FLUSH_INTERVAL_MS ごと（または PLAY_FLUSH_MAX_EVENTS 件たまったら）に
+コンテンツごとにまとめた UPDATE と複数行 INSERT で反映する（models/play_sql.py:flush_play_events）。
+- 反映に失敗したイベントはバッファに戻して次回に再試行する（PLAY_BUFFER_MAX_EVENTS を超えた分は捨てる）
+- 値が不正（範囲外のIDなど）で失敗した場合は半分ずつに分けて反映し直し、不正なイベントだけを捨てる
+  （1件のせいでまとめて戻し続け、再生回数の反映が止まらないようにする）
+- 再生履歴の上限（古い履歴の削除）は、再生のあったユーザーを対象に PLAY_HISTORY_TRIM_INTERVAL ごとにまとめて行う
+- 反映されるまで最大 PLAY_FLUSH_INTERVAL_MS 遅れる。プロセス終了時には残りを反映する
+"""
+import atexit
+import os
+import threading
+
+from models.play_sql import flush_play_events, trim_play_history
+from utils.background import PeriodicTask
+
+PLAY_FLUSH_INTERVAL_MS = int(os.getenv("PLAY_FLUSH_INTERVAL_MS", "500"))
+PLAY_FLUSH_MAX_EVENTS = int(os.getenv("PLAY_FLUSH_MAX_EVENTS", "1000"))
+PLAY_BUFFER_MAX_EVENTS = int(os.getenv("PLAY_BUFFER_MAX_EVENTS", "100000"))
+PLAY_HISTORY_TRIM_INTERVAL = float(os.getenv("PLAY_HISTORY_TRIM_INTERVAL", "600"))   # 秒
+
+
+def _count_contents(history):
+    """再生履歴からコンテンツごとの再生回数を集計"""
+    counts = {}
+    for _, contentID in history:
+        counts[contentID] = counts.get(contentID, 0) + 1
+    return counts
+
+
+class PlayBuffer:
+    """再生イベントをためておき、まとめてDBに反映する"""
+
+    def __init__(self, max_events=PLAY_BUFFER_MAX_EVENTS):
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._counts = {}           # {contentID: 再生回数}
+        self._history = []          # [(userID, contentID), ...]
+        self._users = set()         # 前回の履歴削除以降に再生したユーザー
+        self._stats = {"events": 0, "flushed": 0, "flushes": 0, "failed_flushes": 0,
+                       "dropped": 0, "invalid": 0, "trimmed": 0}
+
+    def add(self, userID, contentID):
+        """再生を1件追加。PLAY_FLUSH_MAX_EVENTS 件たまったら True（すぐ反映させる）"""
+        with self._lock:
+            self._stats["events"] += 1
+            if len(self._history) >= self.max_events:
+                self._stats["dropped"] += 1
+                return True
+            self._counts[contentID] = self._counts.get(contentID, 0) + 1
+            self._history.append((userID, contentID))
+            self._users.add(userID)
+            return len(self._history) >= PLAY_FLUSH_MAX_EVENTS
+
+    def pending(self):
+        with self._lock:
+            return len(self._history)
+
+    def flush(self):
+        """たまっているイベントをDBに反映。反映後もまだ PLAY_FLUSH_MAX_EVENTS 件以上残っていれば True"""
+        with self._lock:
+            if not self._history:
+                return False
+            counts, history = self._counts, self._history
+            self._counts, self._history = {}, []
+
+        result = flush_play_events(counts, history)
+        if result:
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["flushed"] += len(history)
+                return len(self._history) >= PLAY_FLUSH_MAX_EVENTS
+
+        flushed, invalid, retry = 0, 0, history
+        if result is None:
+            # 値が不正なイベントが混ざっている → 分けて反映し、不正なイベントだけ捨てる
+            flushed, invalid, retry = self._flush_split(history)
+
+        with self._lock:
+            self._stats["flushed"] += flushed
+            self._stats["invalid"] += invalid
+            if not retry:
+                self._stats["flushes"] += 1
+                return len(self._history) >= PLAY_FLUSH_MAX_EVENTS
+            self._stats["failed_flushes"] += 1
+            self._requeue(retry)
+        return False
+
+    def _flush_split(self, history):
+        """
+        値の不正で反映できなかったイベントを半分ずつに分けて反映し直す（1件で失敗したイベントは捨てる）
+        Returns: (反映した件数, 捨てた件数, 不正以外の理由で失敗して再試行するイベント)
+        """
+        if len(history) == 1:
+            print(f"不正な再生イベントを破棄: {history[0]}")
+            return 0, 1, []
+        flushed, invalid, retry = 0, 0, []
+        mid = len(history) // 2
+        for half in (history[:mid], history[mid:]):
+            result = flush_play_events(_count_contents(half), half)
+            if result:
+                flushed += len(half)
+            elif result is None:
+                f, i, r = self._flush_split(half)
+                flushed += f
+                invalid += i
+                retry.extend(r)
+            else:
+                retry.extend(half)
+        return flushed, invalid, retry
+
+    def _requeue(self, history):
+        """反映できなかったイベントを戻す（新しく来た分より前に戻す）。ロックを取ってから呼ぶ"""
+        overflow = len(history) + len(self._history) - self.max_events
+        if overflow > 0:
+            self._stats["dropped"] += overflow
+            history = history[overflow:]
+        counts = _count_contents(history)
+        for contentID, n in self._counts.items():
+            counts[contentID] = counts.get(contentID, 0) + n
+        self._counts = counts
+        self._history = history + self._history
+
+    def trim(self):
+        """再生のあったユーザーの古い再生履歴を削除"""
+        with self._lock:
+            users, self._users = self._users, set()
+        if not users:
+            return False
+        deleted = trim_play_history(users)
+        with self._lock:
+            if deleted is None:
+                self._users |= users
+            else:
+                self._stats["trimmed"] += deleted
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._history)
+        return stats
+
+
+_buffer = PlayBuffer()
+_flush_task = None
+_trim_task = None
+
+
+def record_play(userID, contentID):
+    """再生を記録（DBへの反映は後でまとめて行う）"""
+    if _flush_task is None:
+        # ワーカー未起動（スクリプトなど）ではその場で反映
+        flush_play_events({contentID: 1}, [(userID, contentID)])
+        return
+    if _buffer.add(userID, contentID):
+        _flush_task.wake()
+
+
+def _shutdown():
+    """プロセス終了時に残りを反映"""
+    if _flush_task is not None:
+        _flush_task.stop()
+        _flush_task.run_once()
+    if _trim_task is not None:
+        _trim_task.stop()
+
+
+def init_play_buffer(app):
+    """反映・履歴削除のワーカーを登録（gunicornのfork後に各プロセスで起動されるよう、リクエスト時に起動を確認する）"""
+    global _flush_task, _trim_task
+    _flush_task = PeriodicTask("play-buffer-flush", PLAY_FLUSH_INTERVAL_MS / 1000, _buffer.flush, app=app)
+    _trim_task = PeriodicTask("play-history-trim", PLAY_HISTORY_TRIM_INTERVAL, _buffer.trim, app=app)
+    atexit.register(_shutdown)
+
+    @app.before_request
+    def _start_play_buffer():
+        _flush_task.ensure_started()
+        _trim_task.ensure_started()
+
+
+def get_play_buffer_stats():
+    """再生バッファのメトリクスを取得（未起動ならNone）"""
+    if _flush_task is None:
+        return None
+    stats = _buffer.stats()
+    stats["flush_task"] = _flush_task.stats()
+    stats["trim_task"] = _trim_task.stats()
+    return stats
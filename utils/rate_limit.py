@@ -0,0 +1,260 @@
+"""
+レート制限（トークンバケット）
+
+ユーザー × エンドポイント × メソッドごとにトークンバケットを持ち、トークンが無ければ429を返す。
+（以前の debounce_request は1つのロックの下の dict で、1000件を超えると毎リクエスト全件を走査していた）
+- memory  : プロセス内。キーのハッシュで RATE_LIMIT_SHARDS 個に分け、シャードごとにロックする
+            満杯に戻ったバケットはタイミングホイールで期限切れにする（全件の走査はしない）
+- postgres: 全ワーカー共通。UNLOGGED テーブル ratelimit を1文の UPSERT で更新する
+            （migrations/013_rate_limit.sql が必要。DBエラー時はこのワーカーの memory で判定する）
+"""
+import atexit
+import math
+import os
+import threading
+import time
+import zlib
+from functools import wraps
+
+import psycopg2
+from flask import request, jsonify
+
+# リクエスト単位のセッション（COMMITがリクエスト終了時）ではなく、プールから直接借りてすぐにCOMMITする
+from models.connection_pool import get_connection, release_connection
+from utils.background import PeriodicTask
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")     # memory / postgres
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_CLEANUP_INTERVAL = float(os.getenv("RATE_LIMIT_CLEANUP_INTERVAL", "60"))   # 秒
+# タイミングホイールの1スロットの幅（秒）とスロット数（1周 = 幅 × スロット数）
+_WHEEL_TICK = 0.25
+_WHEEL_SLOTS = 256
+# postgres のバケットは、最後の更新からこの秒数が過ぎたら削除する（どのバケットもそれまでに満杯に戻る長さにする）
+_PG_IDLE_SECONDS = 600
+
+
+class _Shard:
+    """バケットの一部（1つのロックで守る範囲）"""
+
+    def __init__(self, now):
+        self.lock = threading.Lock()
+        self.buckets = {}                               # key → [トークン数, 更新時刻, 満杯に戻る時刻]
+        self.wheel = [set() for _ in range(_WHEEL_SLOTS)]
+        self.tick = int(now / _WHEEL_TICK)              # 処理済みのスロット
+
+    def _schedule(self, key, expires):
+        self.wheel[int(expires / _WHEEL_TICK) % _WHEEL_SLOTS].add(key)
+
+    def advance(self, now):
+        """現在時刻までのスロットを処理し、満杯に戻ったバケットを削除。削除した数を返す"""
+        target = int(now / _WHEEL_TICK)
+        # 長く呼ばれなかった場合も1周分だけ見れば全スロットを処理できる
+        start = max(self.tick + 1, target - _WHEEL_SLOTS + 1)
+        expired = 0
+        for tick in range(start, target + 1):
+            slot = self.wheel[tick % _WHEEL_SLOTS]
+            if not slot:
+                continue
+            keys = list(slot)
+            slot.clear()
+            for key in keys:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    continue
+                if bucket[2] <= now:
+                    del self.buckets[key]
+                    expired += 1
+                else:
+                    # 更新されて期限が延びた、または1周より先のもの
+                    self._schedule(key, bucket[2])
+        self.tick = max(self.tick, target)
+        return expired
+
+    def acquire(self, key, capacity, rate, now):
+        """トークンを1つ使う。(許可したか, 次のトークンまでの秒数)"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        if tokens < 1:
+            bucket[0], bucket[1] = tokens, now
+            return False, (1 - tokens) / rate
+        tokens -= 1
+        expires = now + (capacity - tokens) / rate
+        if bucket is None:
+            self.buckets[key] = [tokens, now, expires]
+            self._schedule(key, expires)
+        else:
+            # 古いスロットに残ったキーは advance() で新しい期限のスロットへ移す
+            bucket[0], bucket[1], bucket[2] = tokens, now, expires
+        return True, 0.0
+
+
+class MemoryRateLimiter:
+    """プロセス内のトークンバケット"""
+
+    def __init__(self, shards=RATE_LIMIT_SHARDS):
+        now = time.monotonic()
+        self._shards = [_Shard(now) for _ in range(max(1, shards))]
+        self._stats_lock = threading.Lock()
+        self._stats = {"expired": 0}
+
+    def _shard(self, key):
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    def acquire(self, key, capacity, rate):
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            expired = shard.advance(now)
+            result = shard.acquire(key, capacity, rate, now)
+        if expired:
+            with self._stats_lock:
+                self._stats["expired"] += expired
+        return result
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["buckets"] = sum(len(shard.buckets) for shard in self._shards)
+        stats["shards"] = len(self._shards)
+        return stats
+
+
+class PostgresRateLimiter:
+    """全ワーカー共通のトークンバケット（UNLOGGED テーブル ratelimit）"""
+
+    def acquire(self, key, capacity, rate):
+        """トークンを1つ使う。(許可したか, 次のトークンまでの秒数)。DBエラーは psycopg2.Error を送出"""
+        conn = None
+        try:
+            conn = get_connection()
+            with conn.cursor() as cur:
+                # 補充後のトークンが1以上のときだけ更新する（行が返らなければ制限）
+                cur.execute("""
+                    INSERT INTO ratelimit AS r (key, tokens, updatedat)
+                    VALUES (%(key)s, %(capacity)s - 1, NOW())
+                    ON CONFLICT (key) DO UPDATE
+                       SET tokens = LEAST(%(capacity)s, r.tokens + EXTRACT(EPOCH FROM NOW() - r.updatedat) * %(rate)s) - 1,
+                           updatedat = NOW()
+                     WHERE LEAST(%(capacity)s, r.tokens + EXTRACT(EPOCH FROM NOW() - r.updatedat) * %(rate)s) >= 1
+                    RETURNING tokens;
+                """, {"key": key, "capacity": capacity, "rate": rate})
+                row = cur.fetchone()
+            conn.commit()
+            if row is None:
+                # 残りのトークン数は返らないので、空から1つ補充される時間を目安にする
+                return False, 1 / rate
+            return True, 0.0
+        except psycopg2.Error:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                release_connection(conn)
+
+    def cleanup(self):
+        """しばらく使われていない（満杯に戻った）バケットを削除"""
+        conn = None
+        try:
+            conn = get_connection()
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM ratelimit
+                     WHERE updatedat < NOW() - make_interval(secs => %s);
+                """, (_PG_IDLE_SECONDS,))
+            conn.commit()
+        except psycopg2.Error:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                release_connection(conn)
+        return False
+
+
+_memory = MemoryRateLimiter()
+_postgres = PostgresRateLimiter() if RATE_LIMIT_BACKEND == "postgres" else None
+_cleanup_task = None
+_lock = threading.Lock()
+_stats = {"allowed": 0, "limited": 0, "backend_errors": 0}
+
+
+def acquire(key, capacity, per):
+    """
+    key のバケットからトークンを1つ使う
+
+    Args:
+        capacity: バケットの容量（連続して許可する回数）
+        per     : トークン1つが補充されるまでの秒数
+    Returns:
+        (許可したか, 次のトークンまでの秒数)
+    """
+    rate = 1.0 / per
+    result = None
+    if _postgres is not None:
+        try:
+            result = _postgres.acquire(key, capacity, rate)
+        except Exception:
+            with _lock:
+                _stats["backend_errors"] += 1
+    if result is None:
+        result = _memory.acquire(key, capacity, rate)
+    with _lock:
+        _stats["allowed" if result[0] else "limited"] += 1
+    return result
+
+
+def rate_limit(capacity=1, per=1.0):
+    """
+    ユーザー × エンドポイント × メソッドごとのレート制限デコレーター
+    per 秒に1回（連続では capacity 回まで）を超えた分は429を返す。jwt_required の後に付ける
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            uid = None
+            if hasattr(request, 'user') and request.user:
+                uid = request.user.get("firebase_uid")
+
+            if uid:
+                allowed, retry_after = acquire(f"{uid}:{request.endpoint}:{request.method}", capacity, per)
+                if not allowed:
+                    # 制限されたリクエストはログ出力しない（正常な動作）
+                    response = jsonify({
+                        "status": "error",
+                        "message": "リクエストが頻繁すぎます。しばらく待ってから再度お試しください。"
+                    })
+                    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+                    return response, 429
+
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def init_rate_limiter(app):
+    """postgres の場合、使われなくなったバケットを削除するワーカーを登録"""
+    global _cleanup_task
+    if _postgres is None:
+        return
+    _cleanup_task = PeriodicTask("rate-limit-cleanup", RATE_LIMIT_CLEANUP_INTERVAL, _postgres.cleanup, app=app)
+    atexit.register(_cleanup_task.stop)
+
+    @app.before_request
+    def _start_rate_limit_cleanup():
+        _cleanup_task.ensure_started()
+
+
+def get_rate_limit_stats():
+    """レート制限のメトリクスを取得"""
+    with _lock:
+        stats = dict(_stats)
+    stats["backend"] = "postgres" if _postgres is not None else "memory"
+    stats["memory"] = _memory.stats()
+    if _cleanup_task is not None:
+        stats["cleanup_task"] = _cleanup_task.stats()
+    return stats
@@ -3,17 +3,156 @@ S3 & CloudFront ユーティリティ
 ファイルのアップロードとURL生成を管理
 """
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import io
 from werkzeug.utils import secure_filename
 from flask import current_app
 import os
+import threading
+import time
+
+# ========================================
+# S3クライアントの共有
+# ========================================
+# boto3.client() の生成は認証情報・エンドポイントの解決で数十msかかるため、プロセスで1回だけ作って使い回す。
+# botocoreのクライアントはスレッドセーフなので、全リクエスト・バックグラウンドスレッドで共有する。
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '50'))
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '5'))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '60'))
+
+
+class S3ClientManager:
+    """
+    S3クライアントのキャッシュと操作ごとのレイテンシ計測
+    リージョン・認証情報ごとにクライアントを1つだけ作る（gunicornのfork後は各プロセスで作り直す）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = None
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _config(self):
+        return Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=S3_READ_TIMEOUT,
+            retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"}
+        )
+
+    def get_client(self, region, access_key=None, secret_key=None):
+        """クライアントを取得（認証情報が無ければデフォルトの認証情報＝IAMロールなどを使う）"""
+        cache_key = (region, access_key, secret_key)
+        client = self._clients.get(cache_key) if self._pid == os.getpid() else None
+        if client is not None:
+            return client
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork前のクライアント（コネクション）は引き継がない
+                self._clients = {}
+                self._pid = os.getpid()
+            client = self._clients.get(cache_key)
+            if client is None:
+                session = boto3.session.Session()
+                if access_key and secret_key:
+                    client = session.client(
+                        's3',
+                        region_name=region,
+                        aws_access_key_id=access_key,
+                        aws_secret_access_key=secret_key,
+                        config=self._config()
+                    )
+                else:
+                    client = session.client('s3', region_name=region, config=self._config())
+                self._register_metrics(client)
+                self._clients[cache_key] = client
+        return client
+
+    def _register_metrics(self, client):
+        events = client.meta.events
+        events.register('before-call.s3', self._before_call)
+        events.register('after-call.s3', self._after_call)
+        events.register('after-call-error.s3', self._after_call_error)
+
+    def _before_call(self, context, model=None, **kwargs):
+        # after-call-error には model が渡されないので、操作名は context に残しておく
+        context['_s3_started'] = time.monotonic()
+        context['_s3_operation'] = model.name if model is not None else 'unknown'
+
+    def _record(self, context, error):
+        started = context.get('_s3_started')
+        if started is None:
+            return
+        elapsed = time.monotonic() - started
+        name = context.get('_s3_operation', 'unknown')
+        with self._stats_lock:
+            stat = self._stats.setdefault(name, {"calls": 0, "errors": 0, "time": 0.0, "max": 0.0})
+            stat["calls"] += 1
+            stat["errors"] += 1 if error else 0
+            stat["time"] += elapsed
+            stat["max"] = max(stat["max"], elapsed)
+
+    def _after_call(self, context, http_response=None, **kwargs):
+        self._record(context, http_response is None or http_response.status_code >= 400)
+
+    def _after_call_error(self, context, exception=None, **kwargs):
+        # botocore は通信エラー時に exception と context だけを渡して発火する
+        self._record(context, True)
+
+    def stats(self):
+        """操作ごとの呼び出し回数・エラー数・平均/最大レイテンシ（リトライ込み）"""
+        with self._stats_lock:
+            operations = {
+                name: {
+                    "calls": stat["calls"],
+                    "errors": stat["errors"],
+                    "avg_ms": round(stat["time"] / stat["calls"] * 1000, 3) if stat["calls"] else 0.0,
+                    "max_ms": round(stat["max"] * 1000, 3),
+                }
+                for name, stat in sorted(self._stats.items())
+            }
+        return {
+            "clients": len(self._clients) if self._pid == os.getpid() else 0,
+            "max_pool_connections": S3_MAX_POOL_CONNECTIONS,
+            "operations": operations,
+        }
+
+
+_client_manager = S3ClientManager()
+
+
+def get_s3_stats():
+    """S3操作のメトリクスを取得"""
+    return _client_manager.stats()
+
+
+def _get_s3_settings():
+    """
+    S3の設定（リージョン・認証情報）を取得
+    アプリケーションコンテキストがあればconfig、ない場合（バックグラウンド処理など）は環境変数から取得
+    """
+    from flask import has_app_context
+    if has_app_context():
+        config = current_app.config
+        return (
+            config.get('S3_REGION', 'ap-northeast-1'),
+            config.get('AWS_ACCESS_KEY_ID'),
+            config.get('AWS_SECRET_ACCESS_KEY'),
+        )
+    return (
+        os.getenv('S3_REGION', 'ap-northeast-1'),
+        os.getenv('AWS_ACCESS_KEY_ID'),
+        os.getenv('AWS_SECRET_ACCESS_KEY'),
+    )
 
 
 def get_s3_client():
-    """S3クライアントを取得"""
-    config = current_app.config
-    access_key = config.get('AWS_ACCESS_KEY_ID')
-    secret_key = config.get('AWS_SECRET_ACCESS_KEY')
+    """S3クライアントを取得（プロセス共通のクライアントを返す）"""
+    region, access_key, secret_key = _get_s3_settings()
     
     # AWS認証情報が設定されていない場合のエラーチェック
     if not access_key or not secret_key:
@@ -22,12 +161,7 @@ def get_s3_client():
             "環境変数 AWS_ACCESS_KEY_ID と AWS_SECRET_ACCESS_KEY を設定してください。"
         )
     
-    return boto3.client(
-        's3',
-        region_name=config.get('S3_REGION', 'ap-northeast-1'),
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key
-    )
+    return _client_manager.get_client(region, access_key, secret_key)
 
 
 def upload_to_s3(file_data, folder, filename, content_type='application/octet-stream', bucket_name=None, metadata=None):
@@ -89,6 +223,251 @@ def upload_to_s3(file_data, folder, filename, content_type='application/octet-st
         raise
 
 
+# マルチパートアップロードの1パートのサイズ（S3の最小は5MB。最後のパート以外はこれ以上にする）
+S3_MULTIPART_PART_SIZE = max(int(os.getenv('S3_MULTIPART_PART_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+
+class S3StreamingUpload:
+    """
+    S3へのストリーミングアップロード（マルチパートアップロード）
+    write() で受け取ったデータを part_size ごとにS3へ送るので、メモリに保持するのは1パート分だけ。
+    合計が1パートに満たなければ complete() で put_object 1回にまとめる。
+    失敗時は abort() で途中のパートを破棄すること。
+    """
+
+    def __init__(self, folder, filename, content_type='application/octet-stream', bucket_name=None,
+                 metadata=None, part_size=S3_MULTIPART_PART_SIZE):
+        self.s3 = get_s3_client()
+        if bucket_name is None:
+            self.bucket = current_app.config.get('S3_BUCKET_NAME', 'spotlight-contents')
+        else:
+            self.bucket = bucket_name
+        self.folder = folder
+        self.filename = filename
+        self.key = f"{folder}/{secure_filename(filename)}"
+        self.content_type = content_type
+        self.metadata = metadata
+        self.part_size = part_size
+        self.size = 0
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = None
+
+    def _create_args(self, acl=True):
+        args = {"Bucket": self.bucket, "Key": self.key, "ContentType": self.content_type}
+        if acl:
+            args["ACL"] = "private"  # CloudFront経由でアクセスするためprivate
+        if self.metadata:
+            args["Metadata"] = self.metadata
+        return args
+
+    def _start(self):
+        """マルチパートアップロードを開始（upload_to_s3 と同じくACLが無効なバケットではACLなしで再試行）"""
+        try:
+            response = self.s3.create_multipart_upload(**self._create_args())
+        except Exception as acl_error:
+            if 'AccessControlListNotSupported' in str(acl_error) or 'InvalidArgument' in str(acl_error):
+                response = self.s3.create_multipart_upload(**self._create_args(acl=False))
+            else:
+                raise
+        self._upload_id = response["UploadId"]
+
+    def _upload_part(self, body):
+        if self._upload_id is None:
+            self._start()
+        part_number = len(self._parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def write(self, data):
+        """データを追加。1パート分たまったらS3へ送信"""
+        if not data:
+            return
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def complete(self):
+        """
+        アップロードを完了
+        
+        Returns:
+            str: アップロードされたファイルのキー（パス）
+        """
+        if self._upload_id is None:
+            # 1パートに満たない小さなファイルは通常のアップロード
+            key = upload_to_s3(
+                file_data=bytes(self._buffer),
+                folder=self.folder,
+                filename=self.filename,
+                content_type=self.content_type,
+                bucket_name=self.bucket,
+                metadata=self.metadata
+            )
+            self._buffer = bytearray()
+            return key
+        if self._buffer:
+            self._upload_part(bytes(self._buffer))
+            self._buffer = bytearray()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts}
+        )
+        self._upload_id = None
+        return self.key
+
+    def abort(self):
+        """途中まで送ったパートを破棄（失敗しても例外は出さない）"""
+        self._buffer = bytearray()
+        if self._upload_id is None:
+            return
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except Exception as e:
+            print(f"❌ マルチパートアップロードの中止に失敗: {self.key}: {e}")
+        self._upload_id = None
+
+
+# 署名付きURLの有効期限（秒）
+S3_PRESIGN_EXPIRES = int(os.getenv('S3_PRESIGN_EXPIRES', '3600'))
+
+
+def _get_bucket(bucket_name=None):
+    from flask import has_app_context
+    if bucket_name is not None:
+        return bucket_name
+    if has_app_context():
+        return current_app.config.get('S3_BUCKET_NAME', 'spotlight-contents')
+    return os.getenv('S3_BUCKET_NAME', 'spotlight-contents')
+
+
+def generate_presigned_put(folder, filename, content_type='application/octet-stream', metadata=None,
+                           bucket_name=None, expires=S3_PRESIGN_EXPIRES):
+    """
+    クライアントが直接S3へPUTするための署名付きURLを発行
+    
+    Returns:
+        dict: {"key": キー, "url": 署名付きURL, "headers": PUT時に付けるヘッダー}
+    """
+    s3 = get_s3_client()
+    key = f"{folder}/{secure_filename(filename)}"
+    params = {"Bucket": _get_bucket(bucket_name), "Key": key, "ContentType": content_type}
+    headers = {"Content-Type": content_type}
+    if metadata:
+        # メタデータも署名に含まれるため、クライアントは同じヘッダーを付けてPUTする
+        params["Metadata"] = metadata
+        headers.update({f"x-amz-meta-{k}": v for k, v in metadata.items()})
+    url = s3.generate_presigned_url("put_object", Params=params, ExpiresIn=expires)
+    return {"key": key, "url": url, "headers": headers}
+
+
+def generate_presigned_get(key, bucket_name=None, expires=S3_PRESIGN_EXPIRES):
+    """オブジェクトを読み取るための署名付きURLを発行（ffmpeg などにS3から直接読ませる用）"""
+    s3 = get_s3_client()
+    return s3.generate_presigned_url(
+        "get_object", Params={"Bucket": _get_bucket(bucket_name), "Key": key}, ExpiresIn=expires
+    )
+
+
+def generate_presigned_multipart(folder, filename, part_count, content_type='application/octet-stream',
+                                 metadata=None, bucket_name=None, expires=S3_PRESIGN_EXPIRES):
+    """
+    マルチパートアップロードを開始し、各パートをクライアントが直接PUTするための署名付きURLを発行
+    
+    Returns:
+        dict: {"key": キー, "uploadId": アップロードID, "parts": [{"partNumber": 1, "url": ...}, ...]}
+    """
+    s3 = get_s3_client()
+    bucket = _get_bucket(bucket_name)
+    key = f"{folder}/{secure_filename(filename)}"
+    create_args = {"Bucket": bucket, "Key": key, "ContentType": content_type, "ACL": "private"}
+    if metadata:
+        create_args["Metadata"] = metadata
+    try:
+        upload_id = s3.create_multipart_upload(**create_args)["UploadId"]
+    except Exception as acl_error:
+        # ACLが無効化されている場合はACLなしで再試行
+        if 'AccessControlListNotSupported' in str(acl_error) or 'InvalidArgument' in str(acl_error):
+            create_args.pop("ACL")
+            upload_id = s3.create_multipart_upload(**create_args)["UploadId"]
+        else:
+            raise
+    parts = [
+        {
+            "partNumber": part_number,
+            "url": s3.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": bucket, "Key": key, "UploadId": upload_id, "PartNumber": part_number},
+                ExpiresIn=expires
+            )
+        }
+        for part_number in range(1, part_count + 1)
+    ]
+    return {"key": key, "uploadId": upload_id, "parts": parts}
+
+
+def complete_multipart_upload(key, upload_id, parts, bucket_name=None):
+    """
+    クライアントが送信したパートをまとめてマルチパートアップロードを完了
+    
+    Args:
+        parts: [{"PartNumber": 1, "ETag": "..."}, ...]（各パートのPUTレスポンスのETag）
+    """
+    s3 = get_s3_client()
+    s3.complete_multipart_upload(
+        Bucket=_get_bucket(bucket_name),
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])}
+    )
+
+
+def abort_multipart_upload(key, upload_id, bucket_name=None):
+    """マルチパートアップロードを中止（失敗しても例外は出さない）"""
+    try:
+        get_s3_client().abort_multipart_upload(Bucket=_get_bucket(bucket_name), Key=key, UploadId=upload_id)
+    except Exception as e:
+        print(f"❌ マルチパートアップロードの中止に失敗: {key}: {e}")
+
+
+def download_from_s3(key, bucket_name=None):
+    """オブジェクトをメモリに読み込む（サムネイルなど小さいファイル用）"""
+    s3 = get_s3_client()
+    response = s3.get_object(Bucket=_get_bucket(bucket_name), Key=key)
+    return response["Body"].read()
+
+
+def head_s3_object(key, bucket_name=None):
+    """
+    オブジェクトの存在とサイズを確認
+    
+    Returns:
+        dict: {"size": バイト数, "content_type": MIMEタイプ, "metadata": メタデータ}。存在しない場合はNone
+    """
+    s3 = get_s3_client()
+    try:
+        response = s3.head_object(Bucket=_get_bucket(bucket_name), Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return {
+        "size": response.get("ContentLength", 0),
+        "content_type": response.get("ContentType"),
+        "metadata": response.get("Metadata", {})
+    }
+
+
 def get_cloudfront_url(folder, filename):
     """
     CloudFront URLを生成
@@ -319,49 +698,18 @@ def delete_from_s3(key, bucket_name=None):
     アプリケーションコンテキストなしでも動作するように環境変数から直接取得。
     """
     try:
-        import os
         from flask import has_app_context
         
         # アプリケーションコンテキストがある場合はそれを使用、ない場合は環境変数から取得
-        if has_app_context():
-            try:
-                if bucket_name is None:
-                    bucket = current_app.config.get('S3_BUCKET_NAME', 'spotlight-contents')
-                else:
-                    bucket = bucket_name
-                access_key = current_app.config.get('AWS_ACCESS_KEY_ID')
-                secret_key = current_app.config.get('AWS_SECRET_ACCESS_KEY')
-                region = current_app.config.get('S3_REGION', 'ap-northeast-1')
-            except (RuntimeError, AttributeError):
-                # フォールバック: 環境変数から取得
-                if bucket_name is None:
-                    bucket = os.getenv('S3_BUCKET_NAME', 'spotlight-contents')
-                else:
-                    bucket = bucket_name
-                access_key = os.getenv('AWS_ACCESS_KEY_ID')
-                secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-                region = os.getenv('S3_REGION', 'ap-northeast-1')
+        if bucket_name is not None:
+            bucket = bucket_name
+        elif has_app_context():
+            bucket = current_app.config.get('S3_BUCKET_NAME', 'spotlight-contents')
         else:
-            # アプリケーションコンテキストがない場合は環境変数から直接取得
-            if bucket_name is None:
-                bucket = os.getenv('S3_BUCKET_NAME', 'spotlight-contents')
-            else:
-                bucket = bucket_name
-            access_key = os.getenv('AWS_ACCESS_KEY_ID')
-            secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-            region = os.getenv('S3_REGION', 'ap-northeast-1')
+            bucket = os.getenv('S3_BUCKET_NAME', 'spotlight-contents')
         
-        # S3クライアントを作成
-        if access_key and secret_key:
-            s3 = boto3.client(
-                's3',
-                region_name=region,
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key
-            )
-        else:
-            # 認証情報がない場合はデフォルトの認証情報を使用（IAMロールなど）
-            s3 = boto3.client('s3', region_name=region)
+        # 認証情報がない場合はデフォルトの認証情報を使用（IAMロールなど）
+        s3 = _client_manager.get_client(*_get_s3_settings())
 
         s3.delete_object(Bucket=bucket, Key=key)
 
@@ -371,6 +719,54 @@ def delete_from_s3(key, bucket_name=None):
         return False
 
 
+def delete_objects_from_s3(keys, bucket_name=None):
+    """
+    複数のオブジェクトを delete_objects でまとめて削除（1回のリクエストで最大1000件）
+    
+    Returns:
+        dict: 削除できなかったキーとエラー内容 {key: message}（全て成功なら空）
+    """
+    s3 = _client_manager.get_client(*_get_s3_settings())
+    bucket = _get_bucket(bucket_name)
+    keys = list(dict.fromkeys(keys))
+    failed = {}
+    for i in range(0, len(keys), 1000):
+        chunk = keys[i:i + 1000]
+        try:
+            response = s3.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True}
+            )
+        except Exception as e:
+            failed.update({key: str(e) for key in chunk})
+            continue
+        # Quiet モードでは失敗したものだけが Errors に返る（存在しないキーは成功扱い）
+        for error in response.get("Errors", []):
+            failed[error.get("Key")] = f"{error.get('Code')}: {error.get('Message')}"
+    return failed
+
+
+def s3_key_from_path(path):
+    """
+    DBに保存されたパス（CloudFront/S3のURL、または movie/xxx.mp4 形式のキー）からS3のキーを取得
+    S3のファイルでない場合（テキスト投稿など）はNone
+    """
+    if not path or not isinstance(path, str):
+        return None
+    path = path.strip()
+    if path.startswith('http://') or path.startswith('https://'):
+        key = extract_s3_key_from_url(path)
+    elif path.startswith('/content/'):
+        key = path.replace('/content/', '', 1)
+    else:
+        key = path.lstrip('/')
+    if not key or '/' not in key:
+        return None
+    if key.split('/', 1)[0] not in ['movie', 'picture', 'audio', 'thumbnail', 'icon']:
+        return None
+    return key
+
+
 def delete_file_from_url(url):
     """
     CloudFront URL を元に S3 のファイルを削除する統合関数。
@@ -0,0 +1,55 @@
+"""
+S3ファイル削除キューのワーカー
+
+コンテンツ・アカウント削除時に s3deletequeue へ登録されたキーを、
+各ワーカープロセスのバックグラウンドスレッドが delete_objects（1回最大1000件）でまとめて削除する。
+取り出した行はリース（再試行時刻を先にずらしてCOMMIT）するので、S3での削除中は行ロックもDBのコネクションも持たない。
+失敗したキーはDBに残り、バックオフ後に再試行される（models/deletedata.py:process_s3_delete_queue）。
+"""
+import atexit
+import os
+import threading
+
+from models.deletedata import process_s3_delete_queue
+from utils.background import PeriodicTask
+from utils.s3 import delete_objects_from_s3
+
+S3_DELETE_INTERVAL = float(os.getenv("S3_DELETE_INTERVAL", "30"))          # キューを確認する間隔（秒）
+S3_DELETE_BATCH_SIZE = min(int(os.getenv("S3_DELETE_BATCH_SIZE", "1000")), 1000)
+
+_task = None
+_lock = threading.Lock()
+_stats = {"deleted": 0, "failed": 0}
+
+
+def drain_s3_delete_queue():
+    """キューから1バッチ分を削除。1バッチ分埋まっていた（まだ残っていそう）なら True"""
+    result = process_s3_delete_queue(delete_objects_from_s3, S3_DELETE_BATCH_SIZE)
+    if result is None:
+        return False
+    deleted, failed = result
+    with _lock:
+        _stats["deleted"] += deleted
+        _stats["failed"] += failed
+    return deleted + failed >= S3_DELETE_BATCH_SIZE
+
+
+def init_s3_delete_queue(app):
+    """削除ワーカーを登録（gunicornのfork後に各プロセスで起動されるよう、リクエスト時に起動を確認する）"""
+    global _task
+    _task = PeriodicTask("s3-delete-queue", S3_DELETE_INTERVAL, drain_s3_delete_queue, app=app)
+    atexit.register(_task.stop)
+
+    @app.before_request
+    def _start_s3_delete_queue():
+        _task.ensure_started()
+
+
+def get_s3_delete_stats():
+    """削除ワーカーのメトリクスを取得（未起動ならNone）"""
+    if _task is None:
+        return None
+    stats = _task.stats()
+    with _lock:
+        stats.update(_stats)
+    return stats
@@ -0,0 +1,56 @@
+"""
+スポットライト数の fold ワーカー
+
+スポットライトのON/OFFは spotlightcounter のランダムなスロットに +1/-1 するだけなので（models/updatedata.py）、
+各ワーカープロセスのバックグラウンドスレッドが SPOTLIGHT_FOLD_INTERVAL 秒ごとに
+コンテンツごとの合計を content.spotlightnum にまとめて反映する。
+同時に実行できるのは1プロセスだけ（アドバイザリロックが取れなかったプロセスは何もしない）。
+"""
+import atexit
+import os
+import threading
+
+from models.updatedata import fold_spotlight_counters
+from utils.background import PeriodicTask
+
+SPOTLIGHT_FOLD_INTERVAL = float(os.getenv("SPOTLIGHT_FOLD_INTERVAL", "5"))        # 反映する間隔（秒）
+SPOTLIGHT_FOLD_BATCH_SIZE = int(os.getenv("SPOTLIGHT_FOLD_BATCH_SIZE", "1000"))     # 1回に反映するコンテンツ数
+
+_task = None
+_lock = threading.Lock()
+_stats = {"folded_slots": 0, "updated_contents": 0, "skipped": 0}
+
+
+def fold_spotlight():
+    """1バッチ分を反映。1バッチ分埋まっていた（まだ残っていそう）なら True"""
+    result = fold_spotlight_counters(SPOTLIGHT_FOLD_BATCH_SIZE)
+    if result is None:
+        with _lock:
+            _stats["skipped"] += 1
+        return False
+    drained, updated, contents = result
+    with _lock:
+        _stats["folded_slots"] += drained
+        _stats["updated_contents"] += updated
+    return contents >= SPOTLIGHT_FOLD_BATCH_SIZE
+
+
+def init_spotlight_counter(app):
+    """fold ワーカーを登録（gunicornのfork後に各プロセスで起動されるよう、リクエスト時に起動を確認する）"""
+    global _task
+    _task = PeriodicTask("spotlight-fold", SPOTLIGHT_FOLD_INTERVAL, fold_spotlight, app=app)
+    atexit.register(_task.stop)
+
+    @app.before_request
+    def _start_spotlight_counter():
+        _task.ensure_started()
+
+
+def get_spotlight_counter_stats():
+    """fold ワーカーのメトリクスを取得（未起動ならNone）"""
+    if _task is None:
+        return None
+    stats = _task.stats()
+    with _lock:
+        stats.update(_stats)
+    return stats
@@ -0,0 +1,323 @@
+"""
+動画のバックグラウンドトランスコード
+
+投稿時は元の動画をそのままS3に保存して transcodejob を登録するだけにし、変換はここで行う。
+1. ffprobe で解像度・ビットレートを取得（S3の署名付きURLを直接読むのでローカルに保存しない）
+2. ffmpeg を1回だけ起動し、1回のデコードから複数の出力を作る
+   - ビットレートが TRANSCODE_MAX_BITRATE を超える場合は、同じ解像度でビットレートを抑えた版
+   - TRANSCODE_LADDER のうち元の解像度より小さいものの低解像度版（例: 720p / 480p）
+   出力は一時ディレクトリ（TRANSCODE_TMPDIR、未指定ならOSの一時ディレクトリ）に書き、S3へはマルチパートで分割して送る
+3. content.contentpath を差し替え、低解像度版のキーを content.renditions に保存
+   （投稿一覧・投稿詳細のレスポンスの renditions で返す）
+   （差し替えた元のファイルはS3削除キューへ）
+
+ffmpeg 自体が子プロセスなので、ワーカーはスレッドで待つだけにし、同時に動く ffmpeg の数を
+TRANSCODE_WORKERS で制限する（gunicorn のワーカーごと。0 にするとこのプロセスでは処理しない）。
+"""
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models.transcode_sql import (
+    claim_transcode_jobs, finish_transcode_job, fail_transcode_job, count_transcode_jobs
+)
+from utils.background import PeriodicTask
+from utils.s3 import generate_presigned_get, S3StreamingUpload, normalize_content_url
+
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "1"))
+TRANSCODE_INTERVAL = float(os.getenv("TRANSCODE_INTERVAL", "10"))            # 新しいジョブを確認する間隔（秒）
+TRANSCODE_MAX_BITRATE = int(os.getenv("TRANSCODE_MAX_BITRATE", str(6000 * 1000)))
+# 低解像度版（短辺の高さ:映像ビットレートkbps）
+TRANSCODE_LADDER = os.getenv("TRANSCODE_LADDER", "720:3000,480:1200")
+TRANSCODE_TIMEOUT = int(os.getenv("TRANSCODE_TIMEOUT", "1800"))
+TRANSCODE_PRESET = os.getenv("TRANSCODE_PRESET", "veryfast")
+# 1GBまでの動画の出力を書くので、容量の小さい tmpfs（/dev/shm）ではなくディスク上に置く
+TRANSCODE_TMPDIR = os.getenv("TRANSCODE_TMPDIR") or None
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+
+AUDIO_BITRATE = "128k"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_ladder(ladder):
+    """TRANSCODE_LADDER を解析。例: 720:3000,480:1200 → [(720, 3000000), (480, 1200000)]（高い順）"""
+    rungs = []
+    for item in ladder.split(","):
+        if ":" not in item:
+            continue
+        height, kbps = item.split(":", 1)
+        rungs.append((int(height), int(kbps) * 1000))
+    return sorted(rungs, reverse=True)
+
+
+def rendition_urls(renditions):
+    """content.renditions（{"720p": S3キー, ...}）を CloudFront URL の辞書にする（無ければ空の辞書）"""
+    if not renditions:
+        return {}
+    return {label: normalize_content_url(key) for label, key in renditions.items() if key}
+
+
+def _even(value):
+    return max(2, int(round(value / 2.0)) * 2)
+
+
+def probe_video(url):
+    """
+    ffprobe で動画の情報を取得
+    Returns: {"width", "height", "bitrate"}（width/height は回転を反映した表示上のサイズ）
+    """
+    result = subprocess.run(
+        [
+            FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,bit_rate:stream_tags=rotate:stream_side_data=rotation"
+                             ":format=bit_rate",
+            "-of", "json",
+            url
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe失敗: {result.stderr.strip()[:500]}")
+    info = json.loads(result.stdout or "{}")
+    streams = info.get("streams") or []
+    if not streams:
+        raise RuntimeError("映像ストリームがありません")
+    stream = streams[0]
+    width, height = int(stream["width"]), int(stream["height"])
+
+    rotation = stream.get("tags", {}).get("rotate")
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            rotation = side_data["rotation"]
+    if rotation is not None and abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+
+    bitrate = stream.get("bit_rate") or info.get("format", {}).get("bit_rate")
+    return {"width": width, "height": height, "bitrate": int(bitrate) if bitrate else None}
+
+
+def plan_renditions(info, sourcekey, max_bitrate=TRANSCODE_MAX_BITRATE, ladder=None):
+    """
+    作成する出力の一覧
+    Returns: [{"label", "key", "width", "height", "bitrate"}, ...]
+             label が "main" のものは contentpath を差し替える版（scale なし）
+    """
+    if ladder is None:
+        ladder = parse_ladder(TRANSCODE_LADDER)
+    stem = sourcekey.rsplit(".", 1)[0]
+    width, height = info["width"], info["height"]
+    short_side = min(width, height)
+    outputs = []
+
+    if info["bitrate"] is None or info["bitrate"] > max_bitrate:
+        outputs.append({
+            "label": "main",
+            "key": f"{stem}_h264.mp4",
+            "width": None,
+            "height": None,
+            "bitrate": max_bitrate,
+        })
+    for rung_height, rung_bitrate in ladder:
+        if rung_height >= short_side:
+            continue
+        scale = rung_height / short_side
+        outputs.append({
+            "label": f"{rung_height}p",
+            "key": f"{stem}_{rung_height}p.mp4",
+            "width": _even(width * scale),
+            "height": _even(height * scale),
+            "bitrate": min(rung_bitrate, max_bitrate),
+        })
+    return outputs
+
+
+def build_ffmpeg_command(src_url, outputs, workdir):
+    """1回のデコードで全ての出力を作る ffmpeg コマンド"""
+    cmd = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", "-i", src_url]
+    for output in outputs:
+        bitrate = output["bitrate"]
+        cmd += ["-map", "0:v:0", "-map", "0:a:0?"]
+        if output["width"]:
+            cmd += ["-vf", f"scale={output['width']}:{output['height']}"]
+        cmd += [
+            "-c:v", "libx264", "-preset", TRANSCODE_PRESET, "-pix_fmt", "yuv420p",
+            "-b:v", str(bitrate), "-maxrate", str(bitrate), "-bufsize", str(bitrate * 2),
+            "-c:a", "aac", "-b:a", AUDIO_BITRATE,
+            "-movflags", "+faststart",
+            os.path.join(workdir, f"{output['label']}.mp4"),
+        ]
+    return cmd
+
+
+def _upload_file(path, key):
+    """一時ファイルをチャンクごとにS3へ送る（ファイル全体をメモリに載せない）"""
+    folder, filename = key.split("/", 1)
+    upload = S3StreamingUpload(folder=folder, filename=filename, content_type="video/mp4")
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                upload.write(chunk)
+        return upload.complete()
+    except Exception:
+        upload.abort()
+        raise
+
+
+def transcode_content(sourcekey):
+    """
+    1つの動画をトランスコードしてS3へ保存
+    Returns: (差し替え後のキー, {"720p": キー, ...}, {"probe": ms, "transcode": ms, "upload": ms})
+    """
+    timings = {"probe": 0, "transcode": 0, "upload": 0}
+    src_url = generate_presigned_get(sourcekey)
+
+    start = time.monotonic()
+    info = probe_video(src_url)
+    outputs = plan_renditions(info, sourcekey)
+    timings["probe"] = int((time.monotonic() - start) * 1000)
+    if not outputs:
+        return sourcekey, {}, timings
+
+    workdir = tempfile.mkdtemp(prefix="transcode_", dir=TRANSCODE_TMPDIR)
+    try:
+        start = time.monotonic()
+        result = subprocess.run(
+            build_ffmpeg_command(src_url, outputs, workdir),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=TRANSCODE_TIMEOUT
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg失敗: {result.stderr.strip()[-500:]}")
+        timings["transcode"] = int((time.monotonic() - start) * 1000)
+
+        start = time.monotonic()
+        outputkey = sourcekey
+        renditions = {}
+        for output in outputs:
+            path = os.path.join(workdir, f"{output['label']}.mp4")
+            key = _upload_file(path, output["key"])
+            if output["label"] == "main":
+                outputkey = key
+            else:
+                renditions[output["label"]] = key
+        timings["upload"] = int((time.monotonic() - start) * 1000)
+        return outputkey, renditions, timings
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class TranscodeWorker:
+    """ジョブの取り出し（PeriodicTask）と、同時実行数を制限したスレッドプール"""
+
+    def __init__(self, app, workers=TRANSCODE_WORKERS, interval=TRANSCODE_INTERVAL):
+        self.app = app
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stats = {"done": 0, "failed": 0, "probe_ms": 0, "transcode_ms": 0, "upload_ms": 0, "last_job": None}
+        self.task = PeriodicTask("transcode", interval, self.poll, app=app)
+
+    def poll(self):
+        """空いているワーカーの数だけジョブを取り出して実行"""
+        if self._pid != os.getpid():
+            # fork前のスレッドプールは引き継がない
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode")
+            self._active = 0
+            self._pid = os.getpid()
+        with self._lock:
+            free = self.workers - self._active
+        if free <= 0:
+            return False
+        for job in claim_transcode_jobs(free):
+            with self._lock:
+                self._active += 1
+            self._executor.submit(self._run_job, *job)
+        return False
+
+    def _run_job(self, job_id, content_id, sourcekey):
+        start = time.monotonic()
+        try:
+            with self.app.app_context():
+                try:
+                    outputkey, renditions, timings = transcode_content(sourcekey)
+                    finish_transcode_job(job_id, content_id, sourcekey, outputkey, renditions,
+                                         timings["probe"], timings["transcode"], timings["upload"])
+                    with self._lock:
+                        self._stats["done"] += 1
+                        self._stats["probe_ms"] += timings["probe"]
+                        self._stats["transcode_ms"] += timings["transcode"]
+                        self._stats["upload_ms"] += timings["upload"]
+                        self._stats["last_job"] = {
+                            "jobID": job_id,
+                            "contentID": content_id,
+                            "total_ms": int((time.monotonic() - start) * 1000),
+                            **{f"{k}_ms": v for k, v in timings.items()},
+                        }
+                    print(f"トランスコード完了:job{job_id}:content{content_id}:{int(time.monotonic() - start)}s")
+                except Exception as e:
+                    fail_transcode_job(job_id, str(e)[:1000])
+                    with self._lock:
+                        self._stats["failed"] += 1
+                    print(f"❌ トランスコード失敗:job{job_id}: {e}")
+        finally:
+            with self._lock:
+                self._active -= 1
+            # 空きができたので次のジョブをすぐ取りに行く
+            self.task.wake()
+
+    def stop(self, timeout=5.0):
+        self.task.stop(timeout)
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active"] = self._active
+        done = stats["done"]
+        for key in ("probe_ms", "transcode_ms", "upload_ms"):
+            total = stats.pop(key)
+            stats[f"avg_{key}"] = round(total / done, 1) if done else 0.0
+        stats["workers"] = self.workers
+        stats["queue"] = count_transcode_jobs()
+        return stats
+
+
+_worker = None
+
+
+def init_transcode_worker(app):
+    """トランスコードワーカーを登録（TRANSCODE_WORKERS=0 ならこのプロセスでは処理しない）"""
+    global _worker
+    if TRANSCODE_WORKERS <= 0:
+        return
+    _worker = TranscodeWorker(app)
+    atexit.register(_worker.stop)
+
+    @app.before_request
+    def _start_transcode_worker():
+        _worker.task.ensure_started()
+
+
+def get_transcode_stats():
+    """トランスコードのメトリクスを取得（無効ならNone）"""
+    if _worker is None:
+        return None
+    return _worker.stats()
@@ -0,0 +1,93 @@
+"""
+multipart/form-data のストリーミング解析
+
+request.form / request.files を使うとボディ全体が一時ファイルに書き出されてから処理が始まるため、
+リクエストストリームを少しずつ読みながら werkzeug の MultipartDecoder でイベントに分解する。
+ファイル本体は読み込んだ分だけ呼び出し元に渡すので、1リクエストのメモリ使用量はチャンクサイズ程度に収まる。
+"""
+import os
+
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.wsgi import get_input_stream
+
+UPLOAD_READ_CHUNK_SIZE = int(os.getenv("UPLOAD_READ_CHUNK_SIZE", str(64 * 1024)))
+UPLOAD_MAX_FIELD_SIZE = int(os.getenv("UPLOAD_MAX_FIELD_SIZE", str(64 * 1024)))   # テキスト項目1つあたりの上限
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(1024 * 1024 * 1024)))        # リクエスト全体の上限（1GB）
+UPLOAD_MAX_THUMBNAIL_SIZE = int(os.getenv("UPLOAD_MAX_THUMBNAIL_SIZE", str(10 * 1024 * 1024)))
+UPLOAD_TICKET_SALT = "content-upload"
+
+
+def open_upload_stream(environ, max_size=UPLOAD_MAX_SIZE):
+    """
+    リクエストボディをアップロード用の上限で開く
+    request.stream は MAX_CONTENT_LENGTH（JSON用の16MB）で打ち切られるため、WSGIの入力を直接ラップする
+    """
+    return get_input_stream(environ, max_content_length=max_size)
+
+
+def iter_multipart(stream, boundary, read_size=UPLOAD_READ_CHUNK_SIZE, max_field_size=UPLOAD_MAX_FIELD_SIZE):
+    """
+    multipart/form-data を読みながらイベントを返すジェネレータ
+
+    Yields:
+        ("field", name, value)                         テキスト項目（値は str）
+        ("file_start", name, filename, content_type)   ファイル項目の開始
+        ("file_data", name, bytes)                     ファイル本体の断片
+        ("file_end", name)                             ファイル項目の終了
+    """
+    if isinstance(boundary, str):
+        boundary = boundary.encode("latin-1")
+    decoder = MultipartDecoder(boundary)
+    current = None          # 現在処理中のパート（Field / File）
+    field_buffer = bytearray()
+    finished = False
+
+    while not finished:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            chunk = stream.read(read_size)
+            decoder.receive_data(chunk if chunk else None)
+            continue
+        if isinstance(event, Field):
+            current = event
+            field_buffer = bytearray()
+        elif isinstance(event, File):
+            current = event
+            yield ("file_start", event.name, event.filename, event.headers.get("Content-Type"))
+        elif isinstance(event, Data):
+            if isinstance(current, File):
+                if event.data:
+                    yield ("file_data", current.name, event.data)
+                if not event.more_data:
+                    yield ("file_end", current.name)
+                    current = None
+            elif isinstance(current, Field):
+                field_buffer += event.data
+                if len(field_buffer) > max_field_size:
+                    raise RequestEntityTooLarge(f"{current.name} が大きすぎます")
+                if not event.more_data:
+                    charset = current.headers.get("charset", "utf-8")
+                    yield ("field", current.name, field_buffer.decode(charset, "replace"))
+                    current = None
+        elif isinstance(event, Epilogue):
+            finished = True
+
+
+def _ticket_serializer():
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=UPLOAD_TICKET_SALT)
+
+
+def make_upload_ticket(payload):
+    """署名付きアップロード（/upload/presign）の内容を改ざんできないチケットにする"""
+    return _ticket_serializer().dumps(payload)
+
+
+def load_upload_ticket(ticket, max_age):
+    """
+    チケットを検証して中身を返す
+    署名が不正・期限切れの場合は itsdangerous.BadSignature（SignatureExpired を含む）
+    """
+    return _ticket_serializer().loads(ticket, max_age=max_age)